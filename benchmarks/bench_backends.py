@@ -0,0 +1,112 @@
+#!/usr/bin/python3
+"""
+执行后端压测：ssh(Manager + Task)、native(ssh2-python)、paramiko 跑同样的命令
+
+测试服务器(tests/embedded_server.py)在单独的进程里监听 0.0.0.0，每台"主机"是一个
+127.0.x.y 地址；每个后端也在自己的子进程里跑，CPU 和 RSS 互不影响。
+报告吞吐(hosts/s)、单台主机延迟(建连 + 执行)的分位数、CPU 时间(含 ssh 子进程)和峰值 RSS。
+
+    python benchmarks/bench_backends.py [-n 200] [-p 100] [-c 'echo foo'] [-b native]
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "tests"))
+
+SSH_OPTIONS = ("-o", "StrictHostKeyChecking=no", "-o", "UserKnownHostsFile=/dev/null",
+               "-o", "LogLevel=ERROR")
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def hosts(n):
+    return [f"127.0.{i // 250}.{i % 250 + 1}" for i in range(n)]
+
+
+def serve(conn):
+    from embedded_server import EmbeddedServer, make_user_key
+    server = EmbeddedServer(host="0.0.0.0").start()
+    conn.send((server.port, make_user_key()))
+    conn.recv()
+    server.stop()
+
+
+def worker(args):
+    """在子进程里跑一个后端，结果用 JSON 打到 stdout"""
+    from fpssh.backends import get_backend
+
+    backend = get_backend(args.worker)(hosts(args.hosts), "bench", "bench", args.port,
+                                       pkey=args.pkey, pool_size=args.par, timeout=30,
+                                       ssh_options=SSH_OPTIONS)
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    start = time.perf_counter()
+    with backend:
+        results = list(backend.run(args.cmd))
+    wall = time.perf_counter() - start
+    usage_end = resource.getrusage(resource.RUSAGE_SELF)
+    children_end = resource.getrusage(resource.RUSAGE_CHILDREN)
+    cpu = (usage_end.ru_utime + usage_end.ru_stime - usage.ru_utime - usage.ru_stime +
+           children_end.ru_utime + children_end.ru_stime - children.ru_utime -
+           children.ru_stime)
+    latencies = [(r.connect_time or 0) + r.elapsed for r in results if r.exception is None]
+    json.dump(dict(wall=wall, cpu=cpu, rss=usage_end.ru_maxrss, latencies=latencies,
+                   errors=len(results) - len(latencies)), sys.stdout)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="execution backend benchmark")
+    parser.add_argument("-n", "--hosts", type=int, default=200)
+    parser.add_argument("-p", "--par", type=int, default=100)
+    parser.add_argument("-c", "--cmd", default="echo foo")
+    parser.add_argument("-b", "--backend", action="append", dest="backends",
+                        help="backend to run (default: all)")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--pkey", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        worker(args)
+        return
+
+    from fpssh.backends import BACKENDS
+
+    conn, child_conn = multiprocessing.Pipe()
+    server = multiprocessing.Process(target=serve, args=(child_conn,), daemon=True)
+    server.start()
+    port, pkey = conn.recv()
+
+    print(f"{'backend':>9} {'wall':>8} {'hosts/s':>9} {'p50':>9} {'p99':>9} "
+          f"{'cpu':>8} {'rss':>8} {'errors':>6}")
+    try:
+        for name in args.backends or BACKENDS:
+            out = subprocess.run([sys.executable, __file__, "--worker", name,
+                                  "--port", str(port), "--pkey", pkey,
+                                  "-n", str(args.hosts), "-p", str(args.par),
+                                  "-c", args.cmd],
+                                 stdout=subprocess.PIPE, check=True).stdout
+            stats = json.loads(out)
+            latencies = stats["latencies"] or [0]
+            print(f"{name:>9} {stats['wall']:>7.2f}s {args.hosts / stats['wall']:>9.0f} "
+                  f"{percentile(latencies, 50) * 1000:>7.1f}ms "
+                  f"{percentile(latencies, 99) * 1000:>7.1f}ms "
+                  f"{stats['cpu']:>7.2f}s {stats['rss'] // 1024:>6}MB {stats['errors']:>6}")
+    finally:
+        conn.send("stop")
+        server.join()
+
+
+if __name__ == "__main__":
+    main()
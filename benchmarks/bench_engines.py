@@ -0,0 +1,69 @@
+#!/usr/bin/python3
+"""
+执行引擎压测：Manager(IOMap) 对比 AsyncManager(asyncio/uvloop)
+
+用本地 sh 代替 ssh 跑同样的命令，统计吞吐(tasks/s)和单个 Task 的延迟分位数。
+
+    python benchmarks/bench_engines.py [-n 2000] [-p 200] [-c 'echo foo']
+"""
+import argparse
+import contextlib
+import os
+import sys
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fpslib.aiomanager import AsyncManager  # noqa: E402
+from fpslib.manager import Manager  # noqa: E402
+from fpslib.task import Task  # noqa: E402
+
+ENGINES = [("iomap", Manager), ("asyncio", AsyncManager)]
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def bench(manager_cls, n, par, cmd):
+    opts = SimpleNamespace(par=par, timeout=0, idle_timeout=0, outdir=None,
+                           errdir=None, verbose=False, user=None, inline=True,
+                           inline_stdout=False, print_out=False)
+    manager = manager_cls(opts)
+    for i in range(n):
+        manager.add_task(Task(f"host{i}", None, None, ["sh", "-c", cmd], opts))
+
+    latencies = []
+    finished = manager.finished
+
+    def record(task):
+        latencies.append(task.elapsed())
+        finished(task)
+
+    manager.finished = record
+    start = time.perf_counter()
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        manager.run()
+    wall = time.perf_counter() - start
+    return wall, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description="execution engine benchmark")
+    parser.add_argument("-n", "--tasks", type=int, default=2000)
+    parser.add_argument("-p", "--par", type=int, default=200)
+    parser.add_argument("-c", "--cmd", default="echo foo")
+    args = parser.parse_args()
+
+    print(f"{'engine':>8} {'wall':>8} {'tasks/s':>9} {'p50':>9} {'p99':>9}")
+    for name, cls in ENGINES:
+        wall, latencies = bench(cls, args.tasks, args.par, args.cmd)
+        print(f"{name:>8} {wall:>7.2f}s {args.tasks / wall:>9.0f} "
+              f"{percentile(latencies, 50) * 1e3:>7.1f}ms "
+              f"{percentile(latencies, 99) * 1e3:>7.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
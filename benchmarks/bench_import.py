@@ -0,0 +1,76 @@
+#!/usr/bin/python3
+"""
+CLI 启动耗时压测：fpssh 经常在脚本里一次次调用，启动时间会累加。
+
+测 `fpssh_cli.py --help` 的墙钟时间(减去空解释器启动)，用 -X importtime 列出最慢的模块，
+并检查默认路径没有导入 gevent/ssh2/paramiko 这些只有 native/paramiko 后端才用的依赖。
+超过 --budget 或者导入了重依赖时退出码为 1，可以放进 CI。
+
+    python benchmarks/bench_import.py [-n 20] [--budget 40] [--top 10]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CLI = os.path.join(ROOT, "bin", "fpssh_cli.py")
+
+# 默认的 ssh 子进程路径不应该导入的模块
+HEAVY_MODULES = ("gevent", "ssh2", "paramiko", "sqlite3", "concurrent.futures")
+
+
+def run(args, env):
+    start = time.perf_counter()
+    subprocess.run([sys.executable, *args], env=env, check=True,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+
+def import_times(env):
+    """-X importtime 的输出解析成 [(累计微秒, 模块名)]"""
+    out = subprocess.run([sys.executable, "-X", "importtime", CLI, "--help"], env=env,
+                         stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                         check=True).stderr.decode()
+    times = []
+    for line in out.splitlines()[1:]:
+        _, _, cumulative, name = (field.strip() for field in line.replace(":", "|", 1)
+                                  .split("|"))
+        times.append((int(cumulative), name))
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CLI startup benchmark")
+    parser.add_argument("-n", "--runs", type=int, default=20)
+    parser.add_argument("--budget", type=float, default=40,
+                        help="max CLI startup above a bare interpreter, in ms")
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    # 先跑一次，写好 .pyc
+    run([CLI, "--help"], env)
+    bare = statistics.median(run(["-c", "pass"], env) for _ in range(args.runs))
+    cli = statistics.median(run([CLI, "--help"], env) for _ in range(args.runs))
+    startup = (cli - bare) * 1000
+
+    times = import_times(env)
+    print(f"interpreter {bare * 1000:7.1f}ms")
+    print(f"cli         {cli * 1000:7.1f}ms  (+{startup:.1f}ms, budget {args.budget:.0f}ms)")
+    print("\nslowest imports (cumulative):")
+    for cumulative, name in sorted(times, reverse=True)[:args.top]:
+        print(f"  {cumulative / 1000:7.1f}ms  {name}")
+
+    imported = {name for _, name in times}
+    heavy = [name for name in HEAVY_MODULES if name in imported]
+    if heavy:
+        print(f"\nheavy modules imported at startup: {', '.join(heavy)}")
+    if heavy or startup > args.budget:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+#!/usr/bin/python3
+"""
+IOMap 后端压测：select / poll / epoll
+
+每个假 Task 持有一个 pipe 的读端，每轮随机向少量 pipe 写一个字节，
+模拟大量并发 ssh 进程里只有少数有输出的场景，统计每次唤醒的平均耗时。
+
+    python benchmarks/bench_iomap.py [-n 1000 5000 10000] [-r 200] [-a 16]
+"""
+import argparse
+import os
+import random
+import resource
+import select
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fpslib.manager import IOMap, PollIOMap, EpollIOMap  # noqa: E402
+
+# select() 只能处理小于 FD_SETSIZE 的 fd
+FD_SETSIZE = 1024
+
+BACKENDS = [("select", IOMap), ("poll", PollIOMap), ("epoll", EpollIOMap)]
+
+
+def raise_nofile_limit():
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    return hard
+
+
+def bench(iomap_cls, n, rounds, active):
+    iomap = iomap_cls()
+    pipes = [os.pipe() for _ in range(n)]
+    hits = [0]
+
+    def handler(fd, iomap):
+        os.read(fd, 64)
+        hits[0] += 1
+
+    try:
+        for r, _ in pipes:
+            iomap.register_read(r, handler)
+        if iomap_cls is IOMap and max(r for r, _ in pipes) >= FD_SETSIZE:
+            return None
+
+        rng = random.Random(n)
+        start = time.perf_counter()
+        for _ in range(rounds):
+            for _, w in rng.sample(pipes, active):
+                os.write(w, b"x")
+            iomap.poll(0)
+        elapsed = time.perf_counter() - start
+    finally:
+        for r, w in pipes:
+            iomap.unregister(r)
+            os.close(r)
+            os.close(w)
+        if hasattr(iomap, "close"):
+            iomap.close()
+    return elapsed / rounds
+
+
+def main():
+    parser = argparse.ArgumentParser(description="IOMap backend benchmark")
+    parser.add_argument("-n", "--tasks", type=int, nargs="+",
+                        default=[1000, 5000, 10000])
+    parser.add_argument("-r", "--rounds", type=int, default=200)
+    parser.add_argument("-a", "--active", type=int, default=16,
+                        help="pipes with data per wakeup")
+    args = parser.parse_args()
+
+    limit = raise_nofile_limit()
+    backends = [(name, cls) for name, cls in BACKENDS
+                if name != "epoll" or hasattr(select, "epoll")]
+
+    print(f"{'tasks':>8} " + " ".join(f"{name:>12}" for name, _ in backends))
+    for n in args.tasks:
+        row = []
+        # 每个假 Task 占两个 fd，另外留一些余量
+        if 2 * n + 64 > limit:
+            row = ["no fds"] * len(backends)
+        else:
+            for _, cls in backends:
+                per_wakeup = bench(cls, n, args.rounds, min(args.active, n))
+                row.append("n/a" if per_wakeup is None
+                           else f"{per_wakeup * 1e6:.1f}us")
+        print(f"{n:>8} " + " ".join(f"{x:>12}" for x in row))
+
+
+if __name__ == "__main__":
+    main()
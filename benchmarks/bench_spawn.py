@@ -0,0 +1,74 @@
+#!/usr/bin/python3
+"""
+子进程启动速度压测(tasks/s)
+
+对比以前 Task.start 的 os.environ.copy() + Popen(preexec_fn=os.setsid)、
+Popen(start_new_session=True) 和 posix_spawn + 环境变量模板。
+只统计启动耗时，子进程在计时结束后统一回收。
+
+    python benchmarks/bench_spawn.py [-n 1000] [-c true]
+"""
+import argparse
+import os
+import sys
+import time
+from subprocess import Popen, PIPE
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fpslib import spawn  # noqa: E402
+
+
+def old_popen(cmd, i):
+    env = os.environ.copy()
+    env["PSSH_NODE_NUM"] = str(i)
+    return Popen(cmd, stdin=PIPE, stderr=PIPE, stdout=PIPE,
+                 close_fds=True, preexec_fn=os.setsid, env=env)
+
+
+def session_popen(cmd, i):
+    env = spawn.base_environ().copy()
+    env["PSSH_NODE_NUM"] = str(i)
+    return Popen(cmd, stdin=PIPE, stderr=PIPE, stdout=PIPE,
+                 close_fds=True, start_new_session=True, env=env)
+
+
+def posix_spawn(cmd, i):
+    env = spawn.base_environ().copy()
+    env["PSSH_NODE_NUM"] = str(i)
+    return spawn.posix_spawn(cmd, env)
+
+
+METHODS = [("popen+preexec", old_popen), ("popen+session", session_popen),
+           ("posix_spawn", posix_spawn)]
+
+
+def bench(fn, cmd, n):
+    procs = []
+    start = time.perf_counter()
+    for i in range(n):
+        procs.append(fn(cmd, i))
+    elapsed = time.perf_counter() - start
+    for proc in procs:
+        for f in (proc.stdin, proc.stdout, proc.stderr):
+            f.close()
+        os.waitpid(proc.pid, 0)
+    return n / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="spawn rate benchmark")
+    parser.add_argument("-n", "--tasks", type=int, default=1000)
+    parser.add_argument("-c", "--cmd", default="true")
+    args = parser.parse_args()
+
+    cmd = args.cmd.split()
+    for name, fn in METHODS:
+        if fn is posix_spawn and not spawn.use_posix_spawn:
+            print(f"{name:>14}  n/a")
+            continue
+        print(f"{name:>14} {bench(fn, cmd, args.tasks):>8.0f} tasks/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,5 @@
 #!/usr/bin/python3
+import itertools
 import os
 import sys
 
@@ -11,8 +12,13 @@ parent, bindir = os.path.split(
 from fpslib import util
 from fpslib.manager import Manager, FatalError
 from fpslib.task import Task
+from fpslib.inputbuffer import InputBuffer
+from fpslib.probe import probe_hosts, probe_key, DEFAULT_PROBE_TIMEOUT
+from fpslib.rollout import parse_count
+from fpslib.output import DEFAULT_HOST_BUFFER, DEFAULT_BUFFER_BUDGET
 from fpslib.cli import common_parser, common_defaults
-from fpssh.clients.native.parallel import ParallelSSHClient
+from fpslib.controlmaster import ControlMasterCache, DEFAULT_CONTROL_DIR, \
+    DEFAULT_CONTROL_PERSIST, DEFAULT_MAX_MASTERS
 
 _DEFAULT_TIMEOUT = 60
 
@@ -24,18 +30,68 @@ def option_args():
                         help="inline aggregated output and error for each server")
     parser.add_argument("--inline-stdout", dest="inline_stdout", action="store_true",
                         help="inline standard output for each server")
+    parser.add_argument("--max-host-buffer", dest="max_host_buffer", type=util.parse_size,
+                        metavar="SIZE",
+                        help="inline output kept in memory per host before spilling "
+                             "to a temp file, e.g. 16M (0 = no limit)")
+    parser.add_argument("--max-buffer", dest="max_buffer", type=util.parse_size,
+                        metavar="SIZE",
+                        help="inline output kept in memory for all hosts, e.g. 256M "
+                             "(0 = no limit)")
     parser.add_argument("-I", "--send-input", dest="send_input", action="store_true",
                         help="read from standard input and send as input to ssh")
+    parser.add_argument("--input-file", dest="input_file", metavar="FILE",
+                        help="send FILE as standard input to ssh (implies -I)")
     parser.add_argument("-P", "--print", dest="print_out", action="store_true",
                         help="print output as we get it")
 
+    parser.add_argument("--probe", dest="probe", action="store_true",
+                        help="check every host's ssh port with a TCP connect first and "
+                             "fail unreachable hosts without starting ssh")
+    parser.add_argument("--probe-timeout", dest="probe_timeout", type=float,
+                        metavar="SECS",
+                        help="TCP probe timeout (default: %s)" % DEFAULT_PROBE_TIMEOUT)
+
+    parser.add_argument("--batch-size", dest="batch_size", type=parse_count,
+                        metavar="N|N%",
+                        help="run hosts in batches, starting the next batch only when "
+                             "the previous one has finished")
+    parser.add_argument("--canary", dest="canary", type=parse_count, metavar="N|N%",
+                        help="run a first batch of N hosts alone, any failure aborts")
+    parser.add_argument("--max-fail", dest="max_fail", type=parse_count, metavar="N|N%",
+                        help="abort when more than N hosts (or N%% of hosts) failed: "
+                             "queued hosts are canceled")
+    parser.add_argument("--abort-kill", dest="abort_kill", action="store_true",
+                        help="on abort also kill hosts that are still running")
+
+    parser.add_argument("--control-master", dest="control_master", action="store_true",
+                        help="reuse ssh ControlMaster connections across runs")
+    parser.add_argument("--control-dir", dest="control_dir", metavar="DIR",
+                        help="directory for ControlMaster sockets (default: %s)"
+                             % DEFAULT_CONTROL_DIR)
+    parser.add_argument("--control-persist", dest="control_persist", type=int,
+                        metavar="SECS",
+                        help="close idle ControlMaster connections after SECS "
+                             "(default: %d)" % DEFAULT_CONTROL_PERSIST)
+    parser.add_argument("--max-masters", dest="max_masters", type=int,
+                        help="max ControlMaster connections kept open "
+                             "(default: %d)" % DEFAULT_MAX_MASTERS)
+    parser.add_argument("--close-masters", dest="close_masters", action="store_true",
+                        help="close all cached ControlMaster connections and exit")
+
     parser.add_argument("-c", dest="cmd", action="store")
     return parser
 
 
 def parse_args():
     parser = option_args()
-    defaults = common_defaults(timeout=_DEFAULT_TIMEOUT)
+    defaults = common_defaults(timeout=_DEFAULT_TIMEOUT,
+                               max_host_buffer=DEFAULT_HOST_BUFFER,
+                               max_buffer=DEFAULT_BUFFER_BUDGET,
+                               control_dir=DEFAULT_CONTROL_DIR,
+                               control_persist=DEFAULT_CONTROL_PERSIST,
+                               max_masters=DEFAULT_MAX_MASTERS,
+                               probe_timeout=DEFAULT_PROBE_TIMEOUT)
     parser.set_defaults(**defaults)
     # 解析设置的参数，没设置的也存下来作为发送到远程主机的命令
     opts, args = parser.parse_known_args()
@@ -47,22 +103,48 @@ def do_pssh(hosts, cmdline, opts):
         os.makedirs(opts.outdir)
     if opts.errdir and not os.path.exists(opts.errdir):
         os.makedirs(opts.errdir)
-    if opts.send_input:
-        if hasattr(sys.stdin, "buffer"):
-            stdin = sys.stdin.buffer.read()
-        else:
-            stdin = sys.stdin.read()
+    # 所有主机共享同一份输入，文件 mmap，不按主机复制
+    if opts.input_file:
+        stdin = InputBuffer.open(opts.input_file)
+    elif opts.send_input:
+        stdin = InputBuffer.from_file(getattr(sys.stdin, "buffer", sys.stdin))
     else:
         stdin = None
 
-    manager = Manager(opts)
+    # 探测和 ControlMaster 需要完整的主机列表，否则边解析边执行
+    if opts.probe or opts.control_master:
+        hosts = list(hosts)
+
+    # 先并发探测端口，连不上的主机不占用并行名额等超时
+    dead = probe_hosts(hosts, opts.probe_timeout) if opts.probe else {}
+
+    manager = make_manager(opts)
 
-    for host, port, user in hosts:
+    if opts.control_master:
+        cache = make_control_cache(opts)
+        with cache:
+            masters = cache.reserve(hosts)
+    else:
+        cache = masters = None
+
+    manager.add_tasks(make_tasks(manager, hosts, cmdline, opts, stdin, dead, cache, masters))
+    exit_with_statuses(manager)
+
+
+def make_tasks(manager, hosts, cmdline, opts, stdin, dead, cache, masters):
+    """按需产出 Task，探测不可达的主机直接交给 manager 记为失败"""
+    for host, port, user, host_opts in hosts:
         cmd = [
             "ssh", "-T", host, "-o", "NumberOfPasswordPrompts=1",
             "-o", "SendEnv=PSSH_NODENUM", "-o", "SendEnv=PSSH_NUMNODES",
             "-o", "SendEnv=PSSH_HOST"
         ]
+        # 连接阶段的超时交给 ssh 自己处理
+        connect_timeout = host_opts.get("connect_timeout", opts.connect_timeout)
+        if connect_timeout:
+            cmd += ["-o", f"ConnectTimeout={connect_timeout}"]
+        if cache is not None:
+            cmd += cache.ssh_options(user, host, port, masters)
         if opts.options:
             for opt in opts.options:
                 cmd += ["-o", opt]
@@ -74,9 +156,31 @@ def do_pssh(hosts, cmdline, opts):
             cmd.extend(opts.extra)
         if cmdline:
             cmd.append(cmdline)
-        t = Task(host, port, user, cmd, opts, stdin)
-        manager.add_task(t)
+        t = Task(host, port, user, cmd, opts, stdin, host_opts)
+        reason = dead.get(probe_key(host, port))
+        if reason:
+            manager.fail_task(t, f"Unreachable: {reason}")
+            continue
+        yield t
+
 
+def do_close_masters(opts):
+    """并行让所有缓存的 ControlMaster 退出"""
+    cache = make_control_cache(opts)
+    with cache:
+        manager = make_manager(opts)
+        for key, entry in cache.index.items():
+            t = Task(entry["host"], entry["port"], entry["user"], cache.exit_cmd(key), opts)
+            manager.add_task(t)
+        cache.index.clear()
+    exit_with_statuses(manager)
+
+
+def make_control_cache(opts):
+    return ControlMasterCache(opts.control_dir, opts.control_persist, opts.max_masters)
+
+
+def exit_with_statuses(manager):
     try:
         statuses = manager.run()
     except FatalError:
@@ -91,6 +195,13 @@ def do_pssh(hosts, cmdline, opts):
         sys.exit(5)
 
 
+def make_manager(opts):
+    if opts.engine == "asyncio":
+        from fpslib.aiomanager import AsyncManager
+        return AsyncManager(opts)
+    return Manager(opts)
+
+
 def fit(manager, host_list, remote_cmd):
     for host, user, port in host_list:
         cmd = gen_cmd(host, user, port, remote_cmd)
@@ -99,6 +210,9 @@ def fit(manager, host_list, remote_cmd):
         manager.add_task(task)
 
 def do_fpssh(cmd):
+    # 只有用到时才导入 gevent/ssh2，默认的 ssh 子进程路径不需要
+    from fpssh.clients.native.parallel import ParallelSSHClient
+
     hosts = ["tail1"]
     user = "root"
     password = "456"
@@ -121,17 +235,34 @@ if __name__ == "__main__":
     opts, args = parse_args()
     cmdline = " ".join(args)
 
+    if opts.close_masters:
+        do_close_masters(opts)
+        sys.exit(0)
+
     try:
-        hosts = util.read_host_files(opts.host_files, opts.host_glob,
-                                     default_user=opts.user)
+        if opts.select or opts.index:
+            if not opts.host_files:
+                sys.stderr.write('--select and --index need a hosts file (-h)\n')
+                sys.exit(1)
+            from fpslib.inventory import Inventory
+            hosts = Inventory(opts.host_files, opts.index_dir).hosts(
+                opts.select, opts.host_glob, default_user=opts.user)
+        else:
+            hosts = util.iter_host_files(opts.host_files, opts.host_glob,
+                                         default_user=opts.user)
     except IOError:
         _, e, _ = sys.exc_info()
         sys.stderr.write('Could not open hosts file: %s\n' % e.strerror)
         sys.exit(1)
+    except ValueError as e:
+        sys.stderr.write(f'{e}\n')
+        sys.exit(1)
 
     if opts.host_strings:
-        for x in opts.host_strings:
-            hosts.extend(util.parse_host_string(x, default_user=opts.user))
+        hosts = itertools.chain(hosts, *(util.iter_host_string(x, default_user=opts.user)
+                                         for x in opts.host_strings))
+    # 文件和 -H 里重复的 (user, host, port) 只执行一次
+    hosts = util.unique_hosts(hosts)
 
     do_pssh(hosts, cmdline, opts)
 
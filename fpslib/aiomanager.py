@@ -0,0 +1,305 @@
+import asyncio
+import collections
+import os
+import sys
+import time
+from asyncio.subprocess import PIPE, DEVNULL
+
+from fpslib.manager import Writer
+from fpslib import color
+from fpslib.output import MemoryBudget, LinePrinter, DEFAULT_BUFFER_BUDGET
+from fpslib.rollout import Rollout
+from fpslib.task import BUFFER_SIZE
+
+
+class AsyncManager:
+    """
+    基于 asyncio 的执行引擎，和 Manager 接口一致(add_task/run)。
+    子进程、管道和超时都交给事件循环，不需要 IOMap、唤醒管道和 SIGCHLD 处理。
+    在已有事件循环里可以直接 await run_async()。
+    """
+
+    def __init__(self, opts):
+        self.limit = opts.par
+
+        self.outdir = opts.outdir
+        self.errdir = opts.errdir
+        # -i 模式下所有主机输出共享的内存额度
+        self.budget = MemoryBudget(getattr(opts, "max_buffer", DEFAULT_BUFFER_BUDGET))
+        # -P 模式按行输出，每轮循环批量写一次
+        if getattr(opts, "print_out", False):
+            self.printer = LinePrinter(color.has_colors(sys.stdout))
+        else:
+            self.printer = None
+
+        # --batch-size/--canary/--max-fail
+        self.rollout = Rollout.from_opts(opts)
+        # 有 Task 结束时 set，等下一批的 worker 被唤醒
+        self._finished_event = None
+
+        self.current_node_num = 0
+        self.node_count = 0
+        self.tasks = collections.deque()
+        # add_tasks() 传进来的迭代器，worker 空闲时按需取 Task
+        self.feeds = []
+        self.running = set()
+        self.done = []
+        self._flush_scheduled = False
+
+    def add_task(self, task):
+        task.set_budget(self.budget)
+        task.printer = self.printer
+        self.tasks.append(task)
+        self.node_count += 1
+
+    def add_tasks(self, tasks):
+        """同 Manager.add_tasks"""
+        self.feeds.append(iter(tasks))
+
+    def _next_task(self):
+        while not self.tasks and self.feeds:
+            task = next(self.feeds[0], None)
+            if task is None:
+                self.feeds.pop(0)
+            else:
+                self.add_task(task)
+        return self.tasks.popleft() if self.tasks else None
+
+    def _drain_feeds(self):
+        """feeds 里剩下的 Task 全部取出来"""
+        for feed in self.feeds:
+            for task in feed:
+                self.add_task(task)
+        self.feeds = []
+
+    def run(self):
+        loop = new_event_loop()
+        asyncio.set_event_loop(loop)
+        main = loop.create_task(self.run_async())
+        try:
+            return loop.run_until_complete(main)
+        except KeyboardInterrupt:
+            # 不打印错误信息直接先后走，结束程序
+            self.interrupt_clean()
+            # 取消 run_async 并等它结束，finally 里才会让 Writer 线程退出，
+            # 否则这个非 daemon 线程会一直挂住进程
+            main.cancel()
+            try:
+                loop.run_until_complete(main)
+            except (asyncio.CancelledError, KeyboardInterrupt):
+                pass
+            return [task.exit_code for task in self.done]
+        finally:
+            asyncio.set_event_loop(None)
+            loop.close()
+
+    async def run_async(self):
+        # 有输出路径拉起线程写数据
+        if self.outdir or self.errdir:
+            writer = Writer(self.outdir, self.errdir)
+            writer.start()
+        else:
+            writer = None
+
+        if self.rollout.needs_total:
+            self._drain_feeds()
+            self.rollout.resolve(len(self.tasks) + len(self.done))
+        else:
+            self.rollout.resolve()
+        self._finished_event = asyncio.Event()
+
+        try:
+            count = self.limit if self.feeds else min(self.limit, len(self.tasks))
+            workers = [self._worker(writer) for _ in range(count)]
+            await asyncio.gather(*workers)
+        finally:
+            if writer:
+                writer.signal_quit()
+                writer.join()
+
+        return [task.exit_code for task in self.done]
+
+    async def _worker(self, writer):
+        while True:
+            while not self.rollout.allow(len(self.running)):
+                if self.rollout.aborted:
+                    self.cancel_tasks()
+                    return
+                # 等这一批全部结束
+                await self._finished_event.wait()
+            task = self._next_task()
+            if task is None:
+                break
+            if self.rollout.aborted:
+                # 取 Task 的时候 feed 里的 fail_task 触发了中止
+                self.tasks.appendleft(task)
+                self.cancel_tasks()
+                return
+            self.rollout.start(task)
+            node_num = self.current_node_num
+            self.current_node_num += 1
+            self.running.add(task)
+            try:
+                await self.run_task(task, node_num, writer)
+            finally:
+                self.running.discard(task)
+            self.finished(task)
+
+    async def run_task(self, task, node_num, writer):
+        env = task.prepare(node_num, self.node_count, writer)
+        try:
+            proc = await asyncio.create_subprocess_exec(
+                *task.cmd, env=env, start_new_session=True,
+                stdin=PIPE if task.inputbuffer else DEVNULL,
+                stdout=PIPE, stderr=PIPE)
+        except OSError:
+            task.log_exception()
+            task.exit_code = -1
+            task.stdout_closed()
+            task.stderr_closed()
+            return
+        task.proc = proc
+        task.timestamp = time.time()
+        task.last_output = task.timestamp
+
+        loop = asyncio.get_running_loop()
+        timers = []
+        if task.timeout > 0:
+            timers.append(loop.call_later(task.timeout, task.timedout))
+        if task.idle_timeout > 0:
+            timers.append(_IdleTimer(loop, task))
+
+        io = [self._read(proc.stdout, task.got_stdout, task.stdout_closed),
+              self._read(proc.stderr, task.got_stderr, task.stderr_closed)]
+        if task.inputbuffer:
+            io.append(self._write(proc.stdin, task))
+        try:
+            await asyncio.gather(*io)
+            exit_code = await proc.wait()
+        except asyncio.CancelledError:
+            task.interrupted()
+            raise
+        finally:
+            for timer in timers:
+                timer.cancel()
+
+        task.exited(exit_code)
+
+    async def _read(self, stream, got, closed):
+        try:
+            while True:
+                buf = await stream.read(BUFFER_SIZE)
+                if not buf:
+                    break
+                got(buf)
+                if self.printer and not self._flush_scheduled:
+                    # 本轮循环里其他 Task 的输出也一起写
+                    self._flush_scheduled = True
+                    asyncio.get_running_loop().call_soon(self._flush_printer)
+        finally:
+            closed()
+
+    def _flush_printer(self):
+        self._flush_scheduled = False
+        self.printer.flush()
+
+    @staticmethod
+    async def _write(stream, task):
+        try:
+            # 分块写，传输层缓冲超过高水位时 drain 等待，
+            # 不会把剩下的数据整个复制进 transport 的缓冲区
+            data = task.inputbuffer
+            for start in range(0, len(data), BUFFER_SIZE):
+                stream.write(data[start:start + BUFFER_SIZE])
+                await stream.drain()
+                task.byteswritten = min(len(data), start + BUFFER_SIZE)
+        except (BrokenPipeError, ConnectionResetError):
+            # 远端不读 stdin 就退出了，和 Manager 的 handle_stdin 一样记一条异常，报告里算失败
+            task.log_exception()
+        finally:
+            stream.close()
+
+    def interrupt_clean(self):
+        """keyboard中断后，清理"""
+        for task in self.running:
+            task.interrupted()
+            self.finished(task)
+
+        self.cancel_tasks()
+
+    def cancel_tasks(self):
+        """排队中和 feeds 里还没启动的 Task 全部取消"""
+        self._drain_feeds()
+        tasks, self.tasks = self.tasks, collections.deque()
+        for task in tasks:
+            task.cancel()
+            self.finished(task)
+
+    def abort(self):
+        """同 Manager.abort，排队的 Task 由 worker 在 feed 外面取消"""
+        sys.stderr.write(f"Aborting: {self.rollout.failures} hosts failed\n")
+        if self.rollout.kill:
+            for task in self.running:
+                task.timedout("Aborted")
+
+    def fail_task(self, task, reason, exit_code=255):
+        """没有启动就失败的 Task(比如探测不可达)，直接计入结果"""
+        task.exit_code = exit_code
+        task.failures.append(reason)
+        self.finished(task)
+
+    def finished(self, task):
+        # 先输出已经收到的行，保证在这个 Task 的结果之前
+        if self.printer:
+            self.printer.flush()
+        self.done.append(task)
+        n = len(self.done)
+        task.report(n)
+        if self.rollout.record(task):
+            self.abort()
+        if self._finished_event:
+            # 换一个新的 Event，已经在等的 worker 都会被唤醒
+            self._finished_event.set()
+            self._finished_event = asyncio.Event()
+
+
+class _IdleTimer:
+    """和 Manager 一样到期时再检查 last_output，有输出就按最新值重新定时"""
+
+    def __init__(self, loop, task):
+        self.loop = loop
+        self.task = task
+        self.handle = loop.call_later(task.idle_timeout, self.check)
+
+    def check(self):
+        timeleft = self.task.last_output + self.task.idle_timeout - time.time()
+        if timeleft > 0:
+            self.handle = self.loop.call_later(timeleft, self.check)
+        else:
+            self.task.timedout("Idle timeout")
+
+    def cancel(self):
+        self.handle.cancel()
+
+
+def new_event_loop():
+    """装了 uvloop 就用 uvloop，否则用默认事件循环"""
+    try:
+        import uvloop
+    except ImportError:
+        pass
+    else:
+        return uvloop.new_event_loop()
+
+    loop = asyncio.new_event_loop()
+    # 3.12 以前默认的 ThreadedChildWatcher 每个子进程一个线程，支持 pidfd 时换掉
+    if sys.version_info < (3, 12) and hasattr(asyncio, "PidfdChildWatcher") \
+            and hasattr(os, "pidfd_open"):
+        try:
+            os.close(os.pidfd_open(os.getpid()))
+        except OSError:
+            return loop
+        watcher = asyncio.PidfdChildWatcher()
+        watcher.attach_loop(loop)
+        asyncio.set_child_watcher(watcher)
+    return loop
@@ -15,11 +15,13 @@ def common_parser():
     parser.epilog = "Example: fpssh -h nodes.txt -l irb2 -o /tmp/foo uptime"
     parser.add_argument("-h", "--hosts", dest="host_files", action="append",
                         metavar="HOST_FILE",
-                        help="hosts file (each line '[user@]host[:port]')")
+                        help="hosts file (each line '[user@]host[:port]', "
+                             "host may contain ranges like web[001-800].dc[1,3])")
     parser.add_argument("-H", "--host",
                         dest="host_strings",
                         action="append",
-                        help="additional host entries ('[user@]host[:port]')",
+                        help="additional host entries ('[user@]host[:port]', "
+                             "host may contain ranges like 10.2.[0-31].[1-254])",
                         metavar="HOST_STRING")
     parser.add_argument("-l", "--user", dest="user",
                         help="username (OPTIONAL)")
@@ -33,6 +35,11 @@ def common_parser():
 
     parser.add_argument("-t", "--timeout", dest="timeout", type=int,
                         help="timeout (secs) (0 = no timeout) per host (OPTIONAL)")
+    parser.add_argument("--connect-timeout", dest="connect_timeout", type=int,
+                        help="ssh connect timeout (secs) per host (OPTIONAL)")
+    parser.add_argument("--idle-timeout", dest="idle_timeout", type=float,
+                        help="kill a host after this many secs without output "
+                             "(0 = no timeout) (OPTIONAL)")
     parser.add_argument("-O", "--option", dest="options", action="append",
                         metavar="OPTION", help="SSH option (OPTIONAL)")
     parser.add_argument("-v", "--verbose", dest="verbose", action="store_true",
@@ -47,8 +54,22 @@ def common_parser():
     parser.add_argument('-X', '--extra-arg', dest='extra', action='append',
                         metavar='ARG', help='Extra command-line argument')
 
+    parser.add_argument("--engine", dest="engine", choices=["iomap", "asyncio"],
+                        help="execution engine, asyncio uses uvloop when "
+                             "installed (default: iomap) (OPTIONAL)")
+
     parser.add_argument("-g", "--host-glob", dest="host_glob", type=str,
-                        help="Shell-style glob to filter hosts (OPTIONAL)")
+                        help="Shell-style globs to filter hosts, comma separated, "
+                             "!glob excludes (OPTIONAL)")
+    parser.add_argument("--select", dest="select", metavar="TAGS",
+                        help="only hosts whose hosts file tags match, e.g. "
+                             "'role=db,dc=fra|ams' (implies --index) (OPTIONAL)")
+    parser.add_argument("--index", dest="index", action="store_true",
+                        help="read hosts files through an on-disk index that is "
+                             "rebuilt only when they change (OPTIONAL)")
+    parser.add_argument("--index-dir", dest="index_dir", metavar="DIR",
+                        help="directory for hosts file indexes "
+                             "(default: ~/.fpssh/inventory)")
 
     return parser
 
@@ -67,7 +88,8 @@ def shlex_append(option, opt_str, value, parser):
 
 
 def common_defaults(**kwargs):
-    defaults = dict(par=_DEFAULT_PARALLELISM, timeout=_DEFAULT_TIMEOUT)
+    defaults = dict(par=_DEFAULT_PARALLELISM, timeout=_DEFAULT_TIMEOUT,
+                    connect_timeout=0, idle_timeout=0, engine="iomap")
     defaults.update(**kwargs)
     env_vars = [
         ('user', 'PSSH_USER'),
@@ -75,9 +97,12 @@ def common_defaults(**kwargs):
         ('outdir', 'PSSH_OUTDIR'),
         ('errdir', 'PSSH_ERRDIR'),
         ('timeout', 'PSSH_TIMEOUT'),
+        ('connect_timeout', 'PSSH_CONNECT_TIMEOUT'),
+        ('idle_timeout', 'PSSH_IDLE_TIMEOUT'),
         ('verbose', 'PSSH_VERBOSE'),
         ('print_out', 'PSSH_PRINT'),
         ('askpass', 'PSSH_ASKPASS'),
+        ('engine', 'PSSH_ENGINE'),
         ('inline', 'PSSH_INLINE'),
         ('recursive', 'PSSH_RECURSIVE'),
         ('archive', 'PSSH_ARCHIVE'),
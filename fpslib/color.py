@@ -1,4 +1,9 @@
 
+def with_color(string, color):
+    return f"\x1b[{color}m{string}\x1b[0m"
+
+def B(string): return f"\x1b[1m{string}\x1b[22m" # Bold
+
 def r(string): return with_color(string, 31) # Red
 def g(string): return with_color(string, 32) # Green
 def y(string): return with_color(string, 33) # Yellow
@@ -7,6 +12,9 @@ def m(string): return with_color(string, 35) # Magenta
 def c(string): return with_color(string, 36) # Cyan
 def w(string): return with_color(string, 37) # White
 
+# -P 模式下给主机前缀轮流使用的颜色
+HOST_COLORS = (r, g, y, b, m, c)
+
 # Python cookbook #475186
 def has_colors(stream):
     if not hasattr(stream, "isatty") or not stream.isatty():
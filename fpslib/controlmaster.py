@@ -0,0 +1,133 @@
+import fcntl
+import hashlib
+import json
+import os
+import subprocess
+import time
+
+DEFAULT_CONTROL_DIR = "~/.fpssh/cm"
+# master 空闲多少秒后自己退出(ControlPersist)
+DEFAULT_CONTROL_PERSIST = 600
+# 最多同时保留的 master 数
+DEFAULT_MAX_MASTERS = 1000
+
+INDEX_FILE = "index.json"
+
+
+class ControlMasterCache:
+    """
+    管理 OpenSSH ControlMaster socket，多次运行之间复用同一个连接。
+
+    每个 (user, host, port) 在私有目录里对应一个 socket，index.json 记录最后使用时间。
+    空闲超时交给 ssh 的 ControlPersist，master 退出后 socket 文件也会消失；
+    超过 max_masters 时关闭最久没用的 master。
+    """
+
+    def __init__(self, control_dir=DEFAULT_CONTROL_DIR, persist=DEFAULT_CONTROL_PERSIST,
+                 max_masters=DEFAULT_MAX_MASTERS):
+        self.dir = os.path.expanduser(control_dir)
+        self.persist = persist
+        self.max_masters = max_masters
+        # 只有自己能访问，socket 等同于已认证的连接
+        os.makedirs(self.dir, mode=0o700, exist_ok=True)
+        os.chmod(self.dir, 0o700)
+        self.index_path = os.path.join(self.dir, INDEX_FILE)
+        self.index = {}
+        self._lock_file = None
+
+    def __enter__(self):
+        self._lock_file = open(self.index_path + ".lock", "w")
+        # 同时运行的多个 fpssh 串行读写 index
+        fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+        self.load()
+        return self
+
+    def __exit__(self, *exc):
+        try:
+            self.save()
+        finally:
+            self._lock_file.close()
+            self._lock_file = None
+
+    @staticmethod
+    def key(user, host, port):
+        return f"{user or ''}@{host}:{port or 22}"
+
+    def socket_path(self, user, host, port):
+        # unix socket 路径有长度限制，用哈希做文件名
+        digest = hashlib.sha1(self.key(user, host, port).encode()).hexdigest()
+        return os.path.join(self.dir, digest[:20] + ".sock")
+
+    def load(self):
+        try:
+            with open(self.index_path) as f:
+                self.index = json.load(f)
+        except (IOError, ValueError):
+            self.index = {}
+        # master 已经空闲退出的条目去掉
+        for key, entry in list(self.index.items()):
+            if not os.path.exists(entry["path"]):
+                del self.index[key]
+
+    def save(self):
+        tmp = self.index_path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.index, f)
+        os.rename(tmp, self.index_path)
+
+    def reserve(self, hosts):
+        """
+        为这次要连的主机预留 master 名额，超过上限时关闭最久没用的 master。
+        返回可以使用 master 的 key 集合，剩下的主机直接连接。
+        """
+        now = time.time()
+        wanted = {}
+        for host, port, user, _ in hosts:
+            wanted.setdefault(self.key(user, host, port), (host, port, user))
+        for key in wanted:
+            if key in self.index:
+                self.index[key]["last_used"] = now
+
+        new = [key for key in wanted if key not in self.index]
+        overflow = len(self.index) + len(new) - self.max_masters
+        if overflow > 0:
+            idle = sorted((key for key in self.index if key not in wanted),
+                          key=lambda key: self.index[key]["last_used"])
+            victims = idle[:overflow]
+            self.close(victims)
+            overflow -= len(victims)
+        if overflow > 0:
+            new = new[:len(new) - overflow]
+
+        for key in new:
+            host, port, user = wanted[key]
+            self.index[key] = dict(host=host, port=port, user=user, last_used=now,
+                                   path=self.socket_path(user, host, port))
+        return set(key for key in wanted if key in self.index)
+
+    def ssh_options(self, user, host, port, allowed):
+        if self.key(user, host, port) not in allowed:
+            return ["-o", "ControlMaster=no", "-o", "ControlPath=none"]
+        return ["-o", "ControlMaster=auto",
+                "-o", f"ControlPath={self.socket_path(user, host, port)}",
+                "-o", f"ControlPersist={self.persist}"]
+
+    def exit_cmd(self, key):
+        entry = self.index[key]
+        cmd = ["ssh", "-O", "exit", "-o", f"ControlPath={entry['path']}"]
+        if entry["user"]:
+            cmd += ["-l", entry["user"]]
+        if entry["port"]:
+            cmd += ["-p", entry["port"]]
+        cmd.append(entry["host"])
+        return cmd
+
+    def close(self, keys):
+        """让这些 master 退出，并从 index 里删除"""
+        procs = [subprocess.Popen(self.exit_cmd(key), stdin=subprocess.DEVNULL,
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+                 for key in keys]
+        for proc in procs:
+            proc.wait()
+        for key in keys:
+            del self.index[key]
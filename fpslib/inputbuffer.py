@@ -0,0 +1,48 @@
+import mmap
+import os
+import shutil
+import stat
+
+COPY_SIZE = 1 << 20
+
+
+class InputBuffer:
+    """
+    -I 模式下发给所有主机的同一份输入。
+
+    普通文件直接 mmap，管道先落到临时文件再 mmap，数据只在页缓存里存一份；
+    每个 Task 只拿 memoryview 切片或者用 fd + offset 做 sendfile，不会按主机复制。
+    """
+
+    def __init__(self, data=b"", fileobj=None):
+        # fileobj 要一直打开，sendfile 用它的 fd
+        self.fileobj = fileobj
+        self.fd = fileobj.fileno() if fileobj is not None else None
+        self.view = memoryview(data)
+
+    def __len__(self):
+        return len(self.view)
+
+    @classmethod
+    def from_file(cls, fileobj):
+        """fileobj 是二进制文件对象，比如 sys.stdin.buffer"""
+        fd = fileobj.fileno()
+        if not stat.S_ISREG(os.fstat(fd).st_mode):
+            # 管道/终端不能 mmap，先写到临时文件
+            import tempfile
+            spool = tempfile.TemporaryFile(prefix="pssh.")
+            shutil.copyfileobj(fileobj, spool, COPY_SIZE)
+            spool.flush()
+            fileobj = spool
+            fd = spool.fileno()
+        size = os.fstat(fd).st_size
+        if size == 0:
+            return cls()
+        data = mmap.mmap(fd, size, prot=mmap.PROT_READ)
+        if hasattr(data, "madvise"):
+            data.madvise(mmap.MADV_SEQUENTIAL)
+        return cls(data, fileobj)
+
+    @classmethod
+    def open(cls, path):
+        return cls.from_file(open(path, "rb"))
@@ -0,0 +1,139 @@
+import hashlib
+import json
+import os
+import sqlite3
+
+from fpslib.util import iter_host_files, compile_host_glob
+
+DEFAULT_INDEX_DIR = "~/.fpssh/inventory"
+# 表结构变了就加一，旧的索引会重建
+SCHEMA_VERSION = 1
+
+_SCHEMA = """
+CREATE TABLE sources (path TEXT PRIMARY KEY, mtime_ns INTEGER, size INTEGER);
+CREATE TABLE hosts (id INTEGER PRIMARY KEY, host TEXT, port TEXT, user TEXT, opts TEXT);
+-- 每个 key=value 一个按 host_id 排好序的倒排表
+CREATE TABLE tags (key TEXT, value TEXT, host_id INTEGER,
+                   PRIMARY KEY (key, value, host_id)) WITHOUT ROWID;
+"""
+
+
+def parse_select(select):
+    """
+    'role=db,dc=fra|ams' -> [('role', ['db']), ('dc', ['fra', 'ams'])]
+    逗号之间是与，| 分隔的多个值是或。
+    """
+    terms = []
+    for term in select.split(','):
+        key, sep, values = term.strip().partition('=')
+        if not sep or not key or not values:
+            raise ValueError(f"Bad select term {term!r}, should be key=value")
+        terms.append((key.strip(), [value.strip() for value in values.split('|')]))
+    return terms
+
+
+class Inventory:
+    """
+    主机文件编译成的 sqlite 索引，放在 index_dir 下，按主机文件的路径区分。
+
+    索引里记着每个源文件的 mtime 和大小，变了才重新解析，否则直接查索引。
+    行尾的 key=value(比如 role=db dc=fra)既是主机选项也是标签，
+    --select 通过每个标签的倒排表求交集，不需要扫描整个清单。
+    """
+
+    def __init__(self, paths, index_dir=None):
+        self.paths = [os.path.abspath(path) for path in paths]
+        self.dir = os.path.expanduser(index_dir or DEFAULT_INDEX_DIR)
+        digest = hashlib.sha1("\0".join(self.paths).encode()).hexdigest()
+        self.index_path = os.path.join(self.dir, digest[:20] + ".db")
+
+    def _stat_sources(self):
+        stats = {}
+        for path in self.paths:
+            st = os.stat(path)
+            stats[path] = (st.st_mtime_ns, st.st_size)
+        return stats
+
+    def _is_fresh(self, stats):
+        try:
+            conn = sqlite3.connect(f"file:{self.index_path}?mode=ro", uri=True)
+        except sqlite3.Error:
+            return False
+        try:
+            if conn.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+                return False
+            indexed = {path: (mtime_ns, size) for path, mtime_ns, size
+                       in conn.execute("SELECT path, mtime_ns, size FROM sources")}
+            return indexed == stats
+        except sqlite3.Error:
+            return False
+        finally:
+            conn.close()
+
+    def build(self, stats=None):
+        """重新解析主机文件，写到临时文件后替换，同时运行的进程读到的总是完整的索引"""
+        if stats is None:
+            stats = self._stat_sources()
+        os.makedirs(self.dir, mode=0o700, exist_ok=True)
+        tmp = f"{self.index_path}.{os.getpid()}.tmp"
+        conn = sqlite3.connect(tmp)
+        try:
+            conn.execute("PRAGMA journal_mode=OFF")
+            conn.execute("PRAGMA synchronous=OFF")
+            conn.executescript(_SCHEMA)
+            conn.executemany("INSERT INTO sources VALUES (?, ?, ?)",
+                             [(path, *stat) for path, stat in stats.items()])
+            tags = []
+            rows = enumerate(iter_host_files(self.paths, None), 1)
+            for host_id, (host, port, user, host_opts) in rows:
+                conn.execute("INSERT INTO hosts VALUES (?, ?, ?, ?, ?)",
+                             (host_id, host, port, user,
+                              json.dumps(host_opts) if host_opts else None))
+                tags.extend((key, value, host_id) for key, value in host_opts.items())
+            conn.executemany("INSERT INTO tags VALUES (?, ?, ?)", tags)
+            conn.execute(f"PRAGMA user_version={SCHEMA_VERSION}")
+            conn.commit()
+        except BaseException:
+            conn.close()
+            os.remove(tmp)
+            raise
+        conn.close()
+        os.replace(tmp, self.index_path)
+
+    def connect(self):
+        """索引过期就重建，返回只读连接；主机文件打不开时抛 IOError"""
+        stats = self._stat_sources()
+        if not self._is_fresh(stats):
+            self.build(stats)
+        return sqlite3.connect(f"file:{self.index_path}?mode=ro", uri=True)
+
+    def hosts(self, select=None, host_glob=None, default_user=None, default_port=None):
+        """
+        返回 (host, port, user, host_opts) 的生成器，按主机文件里的顺序。
+        select 写错抛 ValueError，和索引的检查、重建一样在调用时就完成。
+        """
+        query = "SELECT host, port, user, opts FROM hosts"
+        args = []
+        if select:
+            postings = []
+            for key, values in parse_select(select):
+                marks = ",".join("?" * len(values))
+                postings.append(f"SELECT host_id FROM tags WHERE key = ? "
+                                f"AND value IN ({marks})")
+                args += [key, *values]
+            query += f" WHERE id IN ({' INTERSECT '.join(postings)})"
+        query += " ORDER BY id"
+        conn = self.connect()
+        return self._iter_hosts(conn, conn.execute(query, args),
+                                compile_host_glob(host_glob), default_user, default_port)
+
+    @staticmethod
+    def _iter_hosts(conn, rows, host_filter, default_user, default_port):
+        try:
+            for host, port, user, opts in rows:
+                if host_filter is None or host_filter(host):
+                    yield (host, port or default_port, user or default_user,
+                           json.loads(opts) if opts else {})
+        finally:
+            conn.close()
+
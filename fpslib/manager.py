@@ -1,34 +1,64 @@
 from errno import EINTR
 
+import collections
 import fcntl
+import heapq
+import itertools
 import os
 import threading
 import queue
 import select
 import sys
 import signal
+import time
 from enum import Enum, unique
-from fpslib.askpass_server import PasswordServer
+from fpslib import color
+from fpslib.output import MemoryBudget, LinePrinter, DEFAULT_BUFFER_BUDGET
+from fpslib.rollout import Rollout
 
 READ_SIZE = 1 << 16
+# Writer 同时打开的输出文件数
+MAX_OPEN_FILES = 256
+# Writer 队列长度，超过后写数据的一方阻塞
+MAX_QUEUE = 4096
+# Writer 一次最多合并的消息数
+MAX_BATCH = 1024
+IOV_MAX = os.sysconf("SC_IOV_MAX") if hasattr(os, "sysconf") else 1024
 
 
 class Manager:
     def __init__(self, opts):
         self.limit = opts.par
-        self.timeout = opts.timeout
 
         self.outdir = opts.outdir
         self.errdir = opts.errdir
+        # -i 模式下所有主机输出共享的内存额度
+        self.budget = MemoryBudget(getattr(opts, "max_buffer", DEFAULT_BUFFER_BUDGET))
+        # -P 模式按行输出，每轮循环批量写一次
+        if getattr(opts, "print_out", False):
+            self.printer = LinePrinter(color.has_colors(sys.stdout))
+        else:
+            self.printer = None
+        # --batch-size/--canary/--max-fail
+        self.rollout = Rollout.from_opts(opts)
         self.iomap = make_iomap()
+        # 内核支持 pidfd 时每个子进程一个 fd，退出时只处理那一个 Task
+        self.reaper = make_reaper(self.iomap)
 
         # self.next_nodenum = 0
         # self.numnodes = 0
         self.current_node_num = 0
         self.node_count = 0
         self.tasks = []
-        self.running = []
+        # add_tasks() 传进来的迭代器，启动时按需取 Task
+        self.feeds = []
+        self.running = set()
         self.done = []
+        # 进程已退出但输出管道还没读完的 Task
+        self.draining = []
+        # 超时堆 (deadline, seq, task, kind)，Task 结束后的条目在弹出时丢弃
+        self.deadlines = []
+        self._deadline_seq = itertools.count()
 
         self.wlist = {}
         self.queue = queue.Queue()
@@ -44,23 +74,34 @@ class Manager:
         try:
             # 有输出路径拉起线程写数据
             if self.outdir or self.errdir:
-                writer = Writer()
+                writer = Writer(self.outdir, self.errdir)
                 writer.start()
             else:
                 writer = None
 
             if self.askpass:
+                from fpslib.askpass_server import PasswordServer
                 pass_server = PasswordServer()
 
-            self.set_sigchld_handler()
+            if not self.reaper:
+                self.set_sigchld_handler()
+
+            if self.rollout.needs_total:
+                self._drain_feeds()
+                self.rollout.resolve(len(self.tasks) + len(self.done))
+            else:
+                self.rollout.resolve()
 
             try:
                 self.update_task(writer)
-                wait = None
-                while self.running or self.tasks:
-                    if wait is None or wait < 1:
+                wait = self.check_timeout()
+                while self.running or self.tasks or self.feeds:
+                    # 没有超时也定期醒来，防止 SIGCHLD 回退模式下丢信号
+                    if wait is None:
                         wait = 1
                     self.iomap.poll(wait)
+                    if self.printer:
+                        self.printer.flush()
                     self.update_task(writer)
                     wait = self.check_timeout()
 
@@ -79,9 +120,36 @@ class Manager:
         return [task.exit_code for task in self.done]
 
     def add_task(self, task):
+        task.set_budget(self.budget)
+        task.printer = self.printer
         self.tasks.append(task)
         self.node_count += 1
 
+    def add_tasks(self, tasks):
+        """
+        Task 的可迭代对象(比如生成器)，有空位时才取下一个，
+        大的主机清单不用等全部解析完就开始执行。
+        流式加入的 Task 看到的 PSSH_NUMNODES 是当时已经取到的数量。
+        """
+        self.feeds.append(iter(tasks))
+
+    def _fill(self):
+        """self.tasks 空了从 feeds 取一个，还有待启动的 Task 返回 True"""
+        while not self.tasks and self.feeds:
+            task = next(self.feeds[0], None)
+            if task is None:
+                self.feeds.pop(0)
+            else:
+                self.add_task(task)
+        return bool(self.tasks)
+
+    def _drain_feeds(self):
+        """feeds 里剩下的 Task 全部取出来"""
+        for feed in self.feeds:
+            for task in feed:
+                self.add_task(task)
+        self.feeds = []
+
     def update_task(self, writer):
         """收集完成的Task，启动下一批"""
         # Mask signal Python Bug
@@ -90,9 +158,12 @@ class Manager:
         # 因为信号是masked，所以要每次调用reap_tasks()
         running = True
         while running:
-            self.clear_sigchld_handler()
-            self._start_tasks_once(writer)
-            self.set_sigchld_handler()
+            if self.reaper:
+                self._start_tasks_once(writer)
+            else:
+                self.clear_sigchld_handler()
+                self._start_tasks_once(writer)
+                self.set_sigchld_handler()
             running = self.reap_tasks()
 
     def clear_sigchld_handler(self):
@@ -118,16 +189,22 @@ class Manager:
         self.set_sigchld_handler()
 
     def reap_tasks(self):
+        if self.reaper:
+            # 只检查 pidfd 报告退出的 Task 和上一轮还在排空输出的 Task
+            candidates = self.draining + self.reaper.pop_exited()
+        else:
+            candidates = list(self.running)
 
-        still_running = []
+        self.draining = []
         finished_count = 0
-        for task in self.running:
+        for task in candidates:
             if task.is_running():
-                still_running.append(task)
+                if self.reaper:
+                    self.draining.append(task)
             else:
+                self.running.discard(task)
                 self.finished(task)
                 finished_count += 1
-        self.running = still_running
 
         return finished_count
 
@@ -137,42 +214,90 @@ class Manager:
             task.interrupted()
             self.finished(task)
 
-        for task in self.running:
+        self.cancel_tasks()
+
+    def cancel_tasks(self):
+        """排队中和 feeds 里还没启动的 Task 全部取消"""
+        self._drain_feeds()
+        tasks, self.tasks = self.tasks, []
+        for task in tasks:
             task.cancel()
             self.finished(task)
 
+    def abort(self):
+        """
+        失败超过阈值：rollout 已经不再放行新的 Task，这里按需杀掉在跑的。
+        可能是 feed 里调用 fail_task 触发的，这时 feed 正在执行，
+        排队的 Task 留给 _start_tasks_once 在 feed 外面取消。
+        """
+        sys.stderr.write(f"Aborting: {self.rollout.failures} hosts failed\n")
+        if self.rollout.kill:
+            for task in self.running:
+                task.timedout("Aborted")
+
+    def fail_task(self, task, reason, exit_code=255):
+        """没有启动就失败的 Task(比如探测不可达)，直接计入结果"""
+        task.exit_code = exit_code
+        task.failures.append(reason)
+        self.finished(task)
+
     def finished(self, task):
+        # 先输出已经收到的行，保证在这个 Task 的结果之前
+        if self.printer:
+            self.printer.flush()
         self.done.append(task)
         n = len(self.done)
         task.report(n)
+        if self.rollout.record(task):
+            self.abort()
 
     def _start_tasks(self):
         for task in self.tasks:
-            self.running.append(task)
+            self.running.add(task)
             task.start()
 
     def _start_tasks_once(self, writer):
-        while 0 < len(self.tasks) and len(self.running) <= self.limit:
+        while (len(self.running) < self.limit and self.rollout.allow(len(self.running))
+               and self._fill() and not self.rollout.aborted):
             task = self.tasks.pop(0)
-            self.running.append(task)
+            self.rollout.start(task)
+            self.running.add(task)
             task.start(self.current_node_num, self.node_count, self.iomap, writer)
+            if self.reaper:
+                self.reaper.watch(task)
+            self.schedule_timeouts(task)
             self.current_node_num += 1
+        if self.rollout.aborted and (self.tasks or self.feeds):
+            self.cancel_tasks()
+
+    def schedule_timeouts(self, task):
+        if task.timeout > 0:
+            self._push_deadline(task.timestamp + task.timeout, task, Deadline.TOTAL)
+        if task.idle_timeout > 0:
+            self._push_deadline(task.timestamp + task.idle_timeout, task, Deadline.IDLE)
+
+    def _push_deadline(self, when, task, kind):
+        heapq.heappush(self.deadlines, (when, next(self._deadline_seq), task, kind))
 
     def check_timeout(self):
-        """杀死超时进程，返回最小剩余时间"""
-        if self.timeout <= 0:
-            return None
-        min_timeleft = None
-        for task in self.running:
-            timeleft = self.timeout - task.elapsed()
-            if timeleft <= 0:
+        """杀死超时进程，返回距离最早 deadline 的时间，没有则返回 None"""
+        now = time.time()
+        while self.deadlines and self.deadlines[0][0] <= now:
+            _, _, task, kind = heapq.heappop(self.deadlines)
+            if task not in self.running:
+                continue
+            if kind == Deadline.IDLE:
+                # 有输出时只更新 last_output，到期时再按最新值重新入堆
+                when = task.last_output + task.idle_timeout
+                if when > now:
+                    self._push_deadline(when, task, kind)
+                    continue
+                task.timedout("Idle timeout")
+            else:
                 task.timedout()
-            elif min_timeleft is None or timeleft < min_timeleft:
-                min_timeleft = timeleft
-        if min_timeleft is None:
-            return 0
-        else:
-            return max(0, min_timeleft)
+        if not self.deadlines:
+            return None
+        return max(0, self.deadlines[0][0] - now)
 
 
 class IOMap:
@@ -262,11 +387,17 @@ class PollIOMap(IOMap):
 
     def unregister(self, fd):
         super(PollIOMap, self).unregister(fd)
-        self._poller.unregister(fd)
+        try:
+            self._poller.unregister(fd)
+        except KeyError:
+            pass
 
     def poll(self, timeout=None):
         if not self.readmap and not self.writemap:
             return
+        # select.poll 的超时单位是毫秒
+        if timeout is not None:
+            timeout = timeout * 1000
         try:
             event_list = self._poller.poll(timeout)
         except select.error:
@@ -277,25 +408,142 @@ class PollIOMap(IOMap):
             else:
                 raise
         for fd, event in event_list:
-            if event & (select.POLLIN | select.POLLHUP):
-                handler = self.readmap[fd]
+            self._dispatch(fd, event & (select.POLLIN | select.POLLHUP | select.POLLERR),
+                           event & (select.POLLOUT | select.POLLHUP | select.POLLERR))
+
+    def _dispatch(self, fd, readable, writable):
+        # handler 里可能会 unregister 这个 fd，所以每次都重新查表
+        if readable:
+            handler = self.readmap.get(fd)
+            if handler:
                 handler(fd, self)
-            if event & (select.POLLOUT | select.POLLERR):
-                handler = self.writemap[fd]
+        if writable:
+            handler = self.writemap.get(fd)
+            if handler:
                 handler(fd, self)
 
 
-class EpollIOMap:
-    pass
+class EpollIOMap(PollIOMap):
+    """基于 epoll 的 IOMap，只返回就绪的 fd，不用每次重建整个监听集合"""
+
+    def __init__(self):
+        self._epoll = select.epoll()
+        # fd -> 当前注册的事件掩码，同一个 fd 读写都注册时需要 modify
+        self._masks = {}
+        IOMap.__init__(self)
+
+    def register_read(self, fd, handler):
+        IOMap.register_read(self, fd, handler)
+        self._update(fd, select.EPOLLIN)
+
+    def register_write(self, fd, handler):
+        IOMap.register_write(self, fd, handler)
+        self._update(fd, select.EPOLLOUT)
+
+    def _update(self, fd, flag):
+        mask = self._masks.get(fd)
+        if mask is None:
+            self._epoll.register(fd, flag)
+            self._masks[fd] = flag
+        elif not mask & flag:
+            self._epoll.modify(fd, mask | flag)
+            self._masks[fd] = mask | flag
+
+    def unregister(self, fd):
+        IOMap.unregister(self, fd)
+        if self._masks.pop(fd, None) is not None:
+            try:
+                self._epoll.unregister(fd)
+            except (OSError, IOError):
+                # fd 已经被关闭，内核会自动把它从 epoll 集合里删掉
+                pass
+
+    def poll(self, timeout=None):
+        if not self.readmap and not self.writemap:
+            return
+        if timeout is None:
+            timeout = -1
+        try:
+            event_list = self._epoll.poll(timeout)
+        except select.error:
+            _, e, _ = sys.exc_info()
+            errno = e.args[0]
+            if errno == EINTR:
+                return
+            else:
+                raise
+        # EPOLLHUP/EPOLLERR 总会上报：读端交给读 handler 读到 EOF，
+        # 写端交给写 handler 让 os.write 报 EPIPE 后关闭
+        for fd, event in event_list:
+            self._dispatch(fd, event & (select.EPOLLIN | select.EPOLLHUP | select.EPOLLERR),
+                           event & (select.EPOLLOUT | select.EPOLLHUP | select.EPOLLERR))
+
+    def close(self):
+        self._epoll.close()
+
+
+class PidfdReaper:
+    """
+    为每个子进程打开一个 pidfd 注册到 IOMap，子进程退出时 pidfd 可读，
+    只 waitpid 这一个进程，不用在 SIGCHLD 里轮询所有运行中的 Task。
+    """
+
+    def __init__(self, iomap):
+        self.iomap = iomap
+        self.fdmap = {}
+        self.exited = []
+
+    def watch(self, task):
+        try:
+            fd = os.pidfd_open(task.proc.pid)
+        except ProcessLookupError:
+            # 已经被回收了，直接当作退出处理
+            self.exited.append(task)
+            return
+        self.fdmap[fd] = task
+        self.iomap.register_read(fd, self.handle_exit)
+
+    def handle_exit(self, fd, iomap):
+        task = self.fdmap.pop(fd)
+        iomap.unregister(fd)
+        os.close(fd)
+        if task.proc:
+            # 回收僵尸进程，设置返回码
+            task.proc.poll()
+        self.exited.append(task)
+
+    def pop_exited(self):
+        exited = self.exited
+        self.exited = []
+        return exited
+
+
+def make_reaper(iomap):
+    """内核不支持 pidfd(Linux < 5.3) 时返回 None，使用 SIGCHLD 处理"""
+    if not hasattr(os, 'pidfd_open'):
+        return None
+    try:
+        os.close(os.pidfd_open(os.getpid()))
+    except OSError:
+        return None
+    return PidfdReaper(iomap)
 
 
 def make_iomap():
-    if hasattr(select, 'poll'):
+    if hasattr(select, 'epoll'):
+        return EpollIOMap()
+    elif hasattr(select, 'poll'):
         return PollIOMap()
     else:
         return IOMap()
 
 
+@unique
+class Deadline(Enum):
+    TOTAL = 0
+    IDLE = 1
+
+
 @unique
 class Sig(Enum):
     EOF = -1
@@ -305,40 +553,117 @@ class Sig(Enum):
 
 
 class Writer(threading.Thread):
-    def __init__(self, out_dir):
+    """
+    输出文件写线程。
+
+    一次取出队列里所有消息，同一个文件的数据合并后用 writev 一次写入，不再每块 flush。
+    队列有上限，写不过来时 IOMap 循环会在 put 上阻塞(背压)。
+    打开的文件句柄是一个 LRU，超过 max_open 关掉最久没写的，主机再多也不会耗尽 fd。
+    """
+
+    def __init__(self, outdir, errdir, max_open=MAX_OPEN_FILES, max_queue=MAX_QUEUE):
         super().__init__()
-        self.queue = queue.Queue()
-        self.out_dir = out_dir
+        self.queue = queue.Queue(max_queue)
+        self.outdir = outdir
+        self.errdir = errdir
+        self.max_open = max_open
+        # path -> fd，按最近使用排序
+        self.files = collections.OrderedDict()
+        # OPEN 之后还没真正打开过的文件，第一次打开时截断
+        self.fresh = set()
 
     def run(self):
         while True:
-            sig, file, data = self.queue.get()
-            if sig == Sig.KILL:
-                return
-            # if 没有直接打开文件，懒加载
-            if sig == Sig.OPEN:
-                self.files[file] = None
-            if sig == Sig.EOF and self.files[file] is not None:
-                self.files[file].close()
-            if sig == Sig.WRITE:
-                if self.files[file] is None:
-                    self.files[file] = open(file, 'wb', buffering=1)
-                self.files[file].write(data)
-                self.files[file].flush()
-
-    def open_files(self, file):
-        self.queue.put(Sig.OPEN, file, None)
+            batch = [self.queue.get()]
+            # 把已经排队的消息一起取出来
+            try:
+                while len(batch) < MAX_BATCH:
+                    batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                pass
+
+            pending = {}
+            for sig, file, data in batch:
+                if sig == Sig.WRITE:
+                    pending.setdefault(file, []).append(data)
+                elif sig == Sig.OPEN:
+                    self.fresh.add(file)
+                elif sig == Sig.EOF:
+                    self._flush(file, pending.pop(file, None))
+                    self._close(file)
+                elif sig == Sig.KILL:
+                    for file, chunks in pending.items():
+                        self._flush(file, chunks)
+                    for file in list(self.files):
+                        self._close(file)
+                    return
+            for file, chunks in pending.items():
+                self._flush(file, chunks)
+
+    def _flush(self, file, chunks):
+        if not chunks and file not in self.fresh:
+            return
+        try:
+            fd = self._open(file)
+            while chunks:
+                written = os.writev(fd, chunks[:IOV_MAX])
+                chunks = _consume(chunks, written)
+        except (OSError, IOError):
+            _, e, _ = sys.exc_info()
+            sys.stderr.write(f"Error writing to {file}: {e.strerror}\n")
+
+    def _open(self, file):
+        fd = self.files.get(file)
+        if fd is not None:
+            self.files.move_to_end(file)
+            return fd
+        if len(self.files) >= self.max_open:
+            _, old_fd = self.files.popitem(last=False)
+            os.close(old_fd)
+        # 第一次打开截断，被 LRU 关掉后再打开就追加
+        flags = os.O_WRONLY | os.O_CREAT | os.O_CLOEXEC
+        if file in self.fresh:
+            flags |= os.O_TRUNC
+            self.fresh.discard(file)
+        else:
+            flags |= os.O_APPEND
+        fd = os.open(file, flags, 0o666)
+        self.files[file] = fd
+        return fd
+
+    def _close(self, file):
+        fd = self.files.pop(file, None)
+        if fd is not None:
+            os.close(fd)
+
+    def open_files(self, host):
+        """返回 (stdout 文件, stderr 文件) 路径，没有设置目录的为 None"""
+        outfile = os.path.join(self.outdir, host) if self.outdir else None
+        errfile = os.path.join(self.errdir, host) if self.errdir else None
+        for file in (outfile, errfile):
+            if file:
+                self.queue.put((Sig.OPEN, file, None))
+        return outfile, errfile
 
     def write(self, file, data):
-        self.queue.put(Sig.WRITE, file, data)
+        self.queue.put((Sig.WRITE, file, data))
 
     def close(self, file):
-        self.queue.put(Sig.EOF, file, None)
+        self.queue.put((Sig.EOF, file, None))
 
-    def quit(self):
+    def signal_quit(self):
         self.queue.put((Sig.KILL, None, None))
 
 
+def _consume(chunks, written):
+    """去掉 writev 已经写出的 written 字节"""
+    for i, chunk in enumerate(chunks):
+        if written < len(chunk):
+            return [chunk[written:]] + chunks[i + 1:]
+        written -= len(chunk)
+    return []
+
+
 class FatalError(RuntimeError):
     """A fatal error in the PSSH Manager."""
     pass
\ No newline at end of file
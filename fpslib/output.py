@@ -0,0 +1,176 @@
+import shutil
+import sys
+import zlib
+
+from fpslib import color
+
+# 每个主机在内存里最多缓存的输出，超过后写到临时文件
+DEFAULT_HOST_BUFFER = 16 << 20
+# 所有主机的输出在内存里最多占用的大小
+DEFAULT_BUFFER_BUDGET = 256 << 20
+
+COPY_SIZE = 1 << 16
+# -P 模式下一行超过这个长度还没有换行符就先输出
+MAX_LINE = 1 << 16
+
+
+class MemoryBudget:
+    """所有 OutputBuffer 共享的内存额度，0 表示不限制"""
+
+    def __init__(self, limit=DEFAULT_BUFFER_BUDGET):
+        self.limit = limit
+        self.used = 0
+
+    def reserve(self, size):
+        if self.limit and self.used + size > self.limit:
+            return False
+        self.used += size
+        return True
+
+    def release(self, size):
+        self.used -= size
+
+
+class OutputBuffer:
+    """
+    -i 模式下单个主机的输出。
+
+    数据按块保存在列表里，追加是 O(1)；超过单主机上限或全局额度时，
+    把已有数据和后续输出都写到临时文件，report 时再从文件流式输出。
+    """
+
+    def __init__(self, max_memory=DEFAULT_HOST_BUFFER, budget=None):
+        self.max_memory = max_memory
+        self.budget = budget
+        self.chunks = []
+        # 内存里的字节数
+        self.memory = 0
+        self.size = 0
+        self.spill = None
+
+    def __len__(self):
+        return self.size
+
+    def append(self, buf):
+        self.size += len(buf)
+        if self.spill is None:
+            if self.max_memory and self.memory + len(buf) > self.max_memory:
+                self._spill()
+            elif self.budget and not self.budget.reserve(len(buf)):
+                self._spill()
+            else:
+                self.chunks.append(buf)
+                self.memory += len(buf)
+                return
+        self.spill.write(buf)
+
+    def _spill(self):
+        # 大多数主机的输出不会溢出，用到时才导入
+        import tempfile
+        self.spill = tempfile.TemporaryFile(prefix="pssh.")
+        for chunk in self.chunks:
+            self.spill.write(chunk)
+        self._release()
+
+    def _release(self):
+        if self.budget:
+            self.budget.release(self.memory)
+        self.chunks = []
+        self.memory = 0
+
+    def write_to(self, stream):
+        """写到二进制流，不会把临时文件整个读进内存"""
+        if self.spill is None:
+            for chunk in self.chunks:
+                stream.write(chunk)
+        else:
+            self.spill.flush()
+            self.spill.seek(0)
+            shutil.copyfileobj(self.spill, stream, COPY_SIZE)
+            self.spill.seek(0, 2)
+
+    def getvalue(self):
+        if self.spill is None:
+            return b"".join(self.chunks)
+        self.spill.flush()
+        self.spill.seek(0)
+        data = self.spill.read()
+        self.spill.seek(0, 2)
+        return data
+
+    def close(self):
+        """释放内存额度，删除临时文件"""
+        self._release()
+        self.size = 0
+        if self.spill is not None:
+            self.spill.close()
+            self.spill = None
+
+
+class LinePrinter:
+    """
+    -P 模式的输出。
+
+    每个 Task 的半行数据先攒着，凑成完整的行再加上 "host: " 前缀；
+    一轮事件循环里所有 Task 的行在 flush() 时一次写到 stdout。
+    """
+
+    def __init__(self, colors=False):
+        self.colors = colors
+        self.lines = []
+        # task -> 还没有换行符的半行
+        self.partial = {}
+        self.prefixes = {}
+
+    def _prefix(self, host):
+        prefix = self.prefixes.get(host)
+        if prefix is None:
+            prefix = f"{host}: "
+            if self.colors:
+                paint = color.HOST_COLORS[zlib.crc32(host.encode()) % len(color.HOST_COLORS)]
+                prefix = paint(prefix)
+            prefix = prefix.encode()
+            self.prefixes[host] = prefix
+        return prefix
+
+    def feed(self, task, host, buf):
+        partial = self.partial.get(task)
+        if partial is not None:
+            partial += buf
+            if b"\n" not in buf and len(partial) < MAX_LINE:
+                return
+            buf = bytes(partial)
+            del self.partial[task]
+
+        end = buf.rfind(b"\n")
+        if end < 0:
+            if len(buf) < MAX_LINE:
+                self.partial[task] = bytearray(buf)
+            else:
+                self.lines.extend((self._prefix(host), buf, b"\n"))
+            return
+        prefix = self._prefix(host)
+        for line in buf[:end].split(b"\n"):
+            self.lines.extend((prefix, line, b"\n"))
+        if end + 1 < len(buf):
+            self.partial[task] = bytearray(buf[end + 1:])
+
+    def finish(self, task, host):
+        """输出结束，剩下的半行补上换行"""
+        partial = self.partial.pop(task, None)
+        if partial:
+            self.lines.extend((self._prefix(host), bytes(partial), b"\n"))
+
+    def flush(self):
+        if not self.lines:
+            return
+        data = b"".join(self.lines)
+        self.lines = []
+        sys.stdout.flush()
+        try:
+            out = sys.stdout.buffer
+        except AttributeError:
+            sys.stdout.write(data.decode(errors="replace"))
+        else:
+            out.write(data)
+            out.flush()
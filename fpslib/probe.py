@@ -0,0 +1,107 @@
+import errno
+import os
+import selectors
+import socket
+import time
+
+# 探测的连接超时(秒)
+DEFAULT_PROBE_TIMEOUT = 2.0
+# 同时在途的连接数，受 fd 上限约束
+DEFAULT_PROBE_LIMIT = 512
+# getaddrinfo 是阻塞的，放到线程里并发解析
+DNS_WORKERS = 32
+
+_dns_cache = {}
+
+
+def resolve_all(names, workers=DNS_WORKERS):
+    """并发解析，返回 {name: addrinfo 列表或者异常}，结果在进程内缓存"""
+    todo = [name for name in set(names) if name not in _dns_cache]
+
+    def resolve(name):
+        try:
+            return socket.getaddrinfo(name, None, 0, socket.SOCK_STREAM)
+        except OSError as ex:
+            return ex
+
+    if todo:
+        # 只有 --probe 时才用到，不拖慢 CLI 启动
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(min(workers, len(todo))) as pool:
+            for name, result in zip(todo, pool.map(resolve, todo)):
+                _dns_cache[name] = result
+    return {name: _dns_cache[name] for name in names}
+
+
+def probe_key(host, port):
+    return host, int(port or 22)
+
+
+def probe_hosts(hosts, timeout=DEFAULT_PROBE_TIMEOUT, limit=DEFAULT_PROBE_LIMIT):
+    """
+    对所有 (host, port, user, host_opts) 并发做非阻塞 TCP connect，
+    返回 {probe_key: 原因}，只包含不可达的主机。
+
+    每个连接最多等 timeout 秒，一个地址失败再试下一个地址，和 ssh 的行为一样。
+    """
+    targets = list(dict.fromkeys(probe_key(host, port) for host, port, _, _ in hosts))
+    resolved = resolve_all([host for host, _ in targets])
+    dead = {}
+    queue = []
+    for host, port in targets:
+        addrs = resolved[host]
+        if isinstance(addrs, Exception):
+            dead[host, port] = f"DNS lookup failed: {addrs}"
+            continue
+        queue.append(((host, port), [ai[:3] + ((ai[4][0], port) + ai[4][2:],)
+                                     for ai in addrs]))
+    queue.reverse()
+
+    selector = selectors.DefaultSelector()
+    # sock -> (key, 剩下的地址, 截止时间)
+    inflight = {}
+
+    def start(key, addrs, error=None):
+        while addrs:
+            family, type_, proto, addr = addrs.pop(0)
+            sock = socket.socket(family, type_, proto)
+            sock.setblocking(False)
+            err = sock.connect_ex(addr)
+            if err == 0:
+                sock.close()
+                return
+            if err in (errno.EINPROGRESS, errno.EWOULDBLOCK):
+                inflight[sock] = (key, addrs, time.monotonic() + timeout)
+                selector.register(sock, selectors.EVENT_WRITE)
+                return
+            sock.close()
+            error = os.strerror(err)
+        dead[key] = error or "No address"
+
+    def finish(sock, error):
+        key, addrs, _ = inflight.pop(sock)
+        selector.unregister(sock)
+        sock.close()
+        if error is not None:
+            start(key, addrs, error)
+
+    try:
+        while queue or inflight:
+            while queue and len(inflight) < limit:
+                start(*queue.pop())
+            if not inflight:
+                continue
+            wait = max(0, min(deadline for _, _, deadline in inflight.values())
+                       - time.monotonic())
+            for key, _ in selector.select(wait):
+                err = key.fileobj.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                finish(key.fileobj, os.strerror(err) if err else None)
+            now = time.monotonic()
+            for sock, (_, _, deadline) in list(inflight.items()):
+                if deadline <= now:
+                    finish(sock, "Connection timed out")
+    finally:
+        for sock in inflight:
+            sock.close()
+        selector.close()
+    return dead
@@ -0,0 +1,97 @@
+import math
+
+INFINITY = float("inf")
+
+
+def parse_count(value):
+    """'10' -> (10, False)，'25%' -> (25.0, True)"""
+    value = value.strip()
+    if value.endswith('%'):
+        count = float(value[:-1])
+        if not 0 <= count <= 100:
+            raise ValueError(f"Bad percentage {value}")
+        return count, True
+    count = int(value)
+    if count < 0:
+        raise ValueError(f"Bad count {value}")
+    return count, False
+
+
+class Rollout:
+    """
+    分批执行和失败阈值，Manager 和 AsyncManager 共用。
+
+    batch_size：一批启动完后等这一批全部结束才启动下一批，批内并发仍然受 par 限制。
+    canary：最前面单独跑的一批，其中任何一台失败都中止。
+    max_fail：失败的主机超过这个数(或者百分比)就中止，不再启动新的 Task。
+    百分比按主机总数计算，流式加入的 Task 要先全部取出来才知道总数。
+    """
+
+    def __init__(self, batch_size=None, canary=None, max_fail=None, kill=False):
+        self.batch_spec = batch_size
+        self.canary_spec = canary
+        self.max_fail_spec = max_fail
+        # 中止时是否杀掉在跑的 Task
+        self.kill = kill
+        self.batch = None
+        self.canary = 0
+        self.threshold = None
+        self.batch_end = INFINITY
+        self.started = 0
+        self.failures = 0
+        self.aborted = False
+        self.canaries = set()
+
+    @classmethod
+    def from_opts(cls, opts):
+        return cls(getattr(opts, "batch_size", None), getattr(opts, "canary", None),
+                   getattr(opts, "max_fail", None), getattr(opts, "abort_kill", False))
+
+    @property
+    def needs_total(self):
+        return any(spec and spec[1]
+                   for spec in (self.batch_spec, self.canary_spec, self.max_fail_spec))
+
+    @staticmethod
+    def _count(spec, total):
+        count, percent = spec
+        if percent:
+            return max(1, math.ceil(total * count / 100))
+        return count
+
+    def resolve(self, total=None):
+        """run() 开始时调用，total 是主机总数，只有用到百分比时才需要"""
+        if self.batch_spec:
+            self.batch = self._count(self.batch_spec, total) or None
+        if self.canary_spec:
+            self.canary = self._count(self.canary_spec, total)
+        if self.max_fail_spec:
+            count, percent = self.max_fail_spec
+            self.threshold = total * count / 100 if percent else count
+        self.batch_end = self.canary or self.batch or INFINITY
+
+    def allow(self, running):
+        """还能不能启动下一个 Task；一批到头时等 running 清零再开始下一批"""
+        if self.aborted:
+            return False
+        if self.started < self.batch_end:
+            return True
+        if running:
+            return False
+        self.batch_end = self.started + (self.batch or INFINITY)
+        return True
+
+    def start(self, task):
+        if self.started < self.canary:
+            self.canaries.add(task)
+        self.started += 1
+
+    def record(self, task):
+        """记录一个结束的 Task，这一次触发中止时返回 True"""
+        if self.aborted or (task.exit_code == 0 and not task.failures):
+            return False
+        self.failures += 1
+        if task in self.canaries or (self.threshold is not None
+                                     and self.failures > self.threshold):
+            self.aborted = True
+        return self.aborted
@@ -0,0 +1,86 @@
+import os
+import signal
+from subprocess import Popen, PIPE
+
+# glibc 2.26 以后 posix_spawn 才支持 setsid，不支持时退回 Popen
+use_posix_spawn = hasattr(os, "posix_spawnp")
+
+_env_template = None
+
+# Python 忽略了这几个信号，子进程要恢复成默认处理，和 Popen 的 restore_signals 一样
+RESTORE_SIGNALS = tuple(getattr(signal, name) for name in ("SIGPIPE", "SIGXFSZ")
+                        if hasattr(signal, name))
+
+
+def base_environ():
+    """所有 Task 共用的环境变量模板，只从 os.environ 复制一次"""
+    global _env_template
+    if _env_template is None:
+        env = dict(os.environ)
+        # TODO SSH_ASKPASS
+        env.setdefault("DISPLAY", "pssh-gibberish")
+        _env_template = env
+    return _env_template
+
+
+class SpawnedProcess:
+    """posix_spawn 启动的子进程，提供 Task 用到的那部分 Popen 接口"""
+
+    def __init__(self, pid, stdin, stdout, stderr):
+        self.pid = pid
+        self.returncode = None
+        self.stdin = stdin
+        self.stdout = stdout
+        self.stderr = stderr
+
+    def poll(self):
+        if self.returncode is None:
+            try:
+                pid, status = os.waitpid(self.pid, os.WNOHANG)
+            except ChildProcessError:
+                # 和 Popen 一样，已经被别人回收了拿不到返回码
+                self.returncode = 0
+                return self.returncode
+            if pid == self.pid:
+                self.returncode = os.waitstatus_to_exitcode(status)
+        return self.returncode
+
+
+def spawn(cmd, env):
+    """启动新会话里的子进程，stdin/stdout/stderr 都是管道"""
+    global use_posix_spawn
+    if use_posix_spawn:
+        try:
+            return posix_spawn(cmd, env)
+        except NotImplementedError:
+            use_posix_spawn = False
+    # setsid 子进程自己属于一个进程组
+    return Popen(cmd, stdin=PIPE, stderr=PIPE, stdout=PIPE,
+                 close_fds=True, start_new_session=True, env=env)
+
+
+def posix_spawn(cmd, env):
+    """
+    Python 创建的 fd 默认都是 close-on-exec，不需要像 close_fds 一样逐个关闭，
+    也没有 preexec_fn，不用走 fork + 在子进程里执行 Python 代码的慢路径。
+    """
+    stdin_r, stdin_w = os.pipe()
+    stdout_r, stdout_w = os.pipe()
+    stderr_r, stderr_w = os.pipe()
+    child_fds = (stdin_r, stdout_w, stderr_w)
+    try:
+        # dup2 到 0/1/2 会清掉 close-on-exec
+        file_actions = [(os.POSIX_SPAWN_DUP2, fd, target)
+                        for target, fd in enumerate(child_fds)]
+        pid = os.posix_spawnp(cmd[0], cmd, env, file_actions=file_actions,
+                              setsid=True, setsigdef=RESTORE_SIGNALS)
+    except BaseException:
+        for fd in (stdin_w, stdout_r, stderr_r):
+            os.close(fd)
+        raise
+    finally:
+        for fd in child_fds:
+            os.close(fd)
+    return SpawnedProcess(pid, open(stdin_w, "wb", buffering=0),
+                          open(stdout_r, "rb", buffering=0),
+                          open(stderr_r, "rb", buffering=0))
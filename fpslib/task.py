@@ -1,18 +1,22 @@
+import fcntl
 import os
 import sys
-from subprocess import Popen, PIPE
 import signal
 import time
-from errno import EINTR
+import traceback
+from errno import EINTR, EAGAIN, EINVAL, ENOSYS
 
 from fpslib import color
+from fpslib.inputbuffer import InputBuffer
+from fpslib.output import OutputBuffer, DEFAULT_HOST_BUFFER
+from fpslib.spawn import spawn, base_environ
 
 BUFFER_SIZE = 1 << 16
 
 
 class Task:
 
-    def __init__(self, host, port, user, cmd, opts, stdin=None):
+    def __init__(self, host, port, user, cmd, opts, stdin=None, host_opts=None):
         # 退出状态码
         self.exit_code = None
 
@@ -28,14 +32,26 @@ class Task:
 
         self.proc = None
         self.writer = None
+        # -P 模式由 Manager 设置，所有 Task 共享
+        self.printer = None
         self.timestamp = None
+        self.last_output = None
         self.failures = []
         self.killed = False
 
-        self.inputbuffer = stdin
+        # stdin 是所有 Task 共享的 InputBuffer(或 bytes)，这里只保存 memoryview，
+        # 写的时候切片不会复制数据；有 fd 时用 sendfile 直接从页缓存发送
+        if isinstance(stdin, InputBuffer):
+            self.inputbuffer = stdin.view
+            self.input_fd = stdin.fd
+        else:
+            self.inputbuffer = memoryview(stdin) if stdin else None
+            self.input_fd = None
         self.byteswritten = 0
-        self.outputbuffer = bytes()
-        self.errorbuffer = bytes()
+        # -i 模式的输出，超过上限写到临时文件
+        max_memory = getattr(opts, "max_host_buffer", DEFAULT_HOST_BUFFER)
+        self.outputbuffer = OutputBuffer(max_memory)
+        self.errorbuffer = OutputBuffer(max_memory)
 
         self.stdin = None
         self.stdout = None
@@ -44,6 +60,12 @@ class Task:
         self.outfile = None
         self.errfile = None
 
+        # 超时，hosts 文件里的 timeout=/idle_timeout= 优先于命令行
+        host_opts = host_opts or {}
+        self.timeout = float(host_opts.get("timeout", opts.timeout) or 0)
+        self.idle_timeout = float(
+            host_opts.get("idle_timeout", getattr(opts, "idle_timeout", 0)) or 0)
+
         # Other options
         self.verbose = opts.verbose
         try:
@@ -58,31 +80,21 @@ class Task:
             self.inline_stdout = bool(opts.inline_stdout)
         except AttributeError:
             self.inline_stdout = False
+        # 后端接口需要分开的 stdout/stderr
+        self.separate_stderr = bool(getattr(opts, "separate_stderr", False))
 
     def start(self, node_num, node_count, iomap, writer):
-        # 线程写
-        self.writer = writer
-        if writer:
-            self.outfile, self.errfile = writer.open_files(self.pertty_host)
-
-        # 设置环境变量
-        env = os.environ.copy()
-        env["PSSH_NODE_NUM"] = str(node_num)
-        env["PSSH_NODE_COUNT"] = str(node_count)
-        env["PSSH_HOST"] = self.host
-        # close_fds=True作用是子进程除了0,1,2其他描述符都关闭了
-        # setsid 子进程自己属于一个进程组
-        # 所有设置成PIPE与主进程建立管道
-        self.proc = Popen(self.cmd, stdin=PIPE, stderr=PIPE, stdout=PIPE,
-                          close_fds=True, preexec_fn=os.setsid, env=env)
+        env = self.prepare(node_num, node_count, writer)
+        # 优先 posix_spawn，所有设置成PIPE与主进程建立管道
+        self.proc = spawn(self.cmd, env)
         self.timestamp = time.time()
-
-        # TODO SSH_ASKPASS
-        if "DISPLAY" not in env:
-            env["DISPLAY"] = "pssh-gibberish"
+        self.last_output = self.timestamp
 
         if self.inputbuffer:
             self.stdin = self.proc.stdin
+            # 非阻塞写，管道满了只写一部分，不会卡住整个循环
+            fl = fcntl.fcntl(self.stdin.fileno(), fcntl.F_GETFL)
+            fcntl.fcntl(self.stdin.fileno(), fcntl.F_SETFL, fl | os.O_NONBLOCK)
             iomap.register_write(self.stdin.fileno(), self.handle_stdin)
         else:
             self.proc.stdin.close()
@@ -91,6 +103,20 @@ class Task:
         self.stderr = self.proc.stderr
         iomap.register_read(self.stderr.fileno(), self.handle_stderr)
 
+    def prepare(self, node_num, node_count, writer):
+        """打开输出文件，返回子进程的环境变量，各个执行引擎共用"""
+        # 线程写
+        self.writer = writer
+        if writer:
+            self.outfile, self.errfile = writer.open_files(self.pretty_host)
+
+        # 设置环境变量，只有 PSSH_* 每个主机不同
+        env = base_environ().copy()
+        env["PSSH_NODE_NUM"] = str(node_num)
+        env["PSSH_NODE_COUNT"] = str(node_count)
+        env["PSSH_HOST"] = self.host
+        return env
+
     def _kill(self):
         if self.proc:
             try:
@@ -101,10 +127,10 @@ class Task:
                 pass
             self.killed = True
 
-    def timedout(self):
+    def timedout(self, reason="Timed out"):
         if not self.killed:
             self._kill()
-            self.failures.append("Timed out")
+            self.failures.append(reason)
 
     def interrupted(self):
         if not self.killed:
@@ -125,34 +151,50 @@ class Task:
             return True
         if self.proc:
             # Popen.poll() 检查子进程是否终止，如果终止返回code，否则返回None
-            self.exit_code = self.proc.poll()
-            if self.exit_code is None:
+            exit_code = self.proc.poll()
+            if exit_code is None:
                 if self.killed:
                     self.exit_code = -signal.SIGKILL
                     return False
                 else:
                     return True
             else:
-                if self.exit_code < 0:
-                    msg = f"Killed by signal {-self.exit_code}"
-                    self.failures.append(msg)
-                elif self.exit_code > 0:
-                    msg = f"Exited with error code {self.exit_code}"
-                    self.failures.append(msg)
-                self.proc = None
+                self.exited(exit_code)
                 return False
 
+    def exited(self, exit_code):
+        """记录子进程返回码"""
+        self.exit_code = exit_code
+        if exit_code < 0:
+            msg = f"Killed by signal {-exit_code}"
+            self.failures.append(msg)
+        elif exit_code > 0:
+            msg = f"Exited with error code {exit_code}"
+            self.failures.append(msg)
+        self.proc = None
+
     def handle_stdin(self, fd, iomap):
         try:
             start = self.byteswritten
             if start < len(self.inputbuffer):
-                chunk = self.inputbuffer[start:start+BUFFER_SIZE]
-                self.byteswritten = start + os.write(fd, chunk)
+                self.byteswritten = start + self._write_input(fd, start)
             else:
                 self.close_stdin(iomap)
         except (OSError, IOError):
             self.check_eintr(iomap, self.close_stdin)
 
+    def _write_input(self, fd, start):
+        if self.input_fd is not None:
+            try:
+                return os.sendfile(fd, self.input_fd, start, BUFFER_SIZE)
+            except OSError:
+                _, e, _ = sys.exc_info()
+                if e.errno not in (EINVAL, ENOSYS):
+                    raise
+                # 内核不支持 sendfile 到管道，退回 write
+                self.input_fd = None
+        return os.write(fd, self.inputbuffer[start:start+BUFFER_SIZE])
+
     def close_stdin(self, iomap):
         self.close_iomap_fd(iomap, self.stdin)
         self.stdin = None
@@ -161,22 +203,29 @@ class Task:
         try:
             buf = os.read(fd, BUFFER_SIZE)
             if buf:
-                if self.inline or self.inline_stdout:
-                    self.outputbuffer += buf
-                if self.outfile:
-                    self.writer.write(self.outfile, buf)
-                if self.print_out:
-                    sys.stdout.write(f"{self.host}: {buf}")
-                    if buf[-1] != '\n':
-                        sys.stdout.write('\n')
+                self.got_stdout(buf)
             else:
                 self.close_stdout(iomap)
         except (OSError, IOError):
             self.check_eintr(iomap, self.close_stdout)
 
+    def got_stdout(self, buf):
+        self.last_output = time.time()
+        if self.inline or self.inline_stdout:
+            self.outputbuffer.append(buf)
+        if self.outfile:
+            self.writer.write(self.outfile, buf)
+        if self.printer:
+            self.printer.feed(self, self.pretty_host, buf)
+
     def close_stdout(self, iomap):
         self.close_iomap_fd(iomap, self.stdout)
         self.stdout = None
+        self.stdout_closed()
+
+    def stdout_closed(self):
+        if self.printer:
+            self.printer.finish(self, self.pretty_host)
         self.close_write_file(self.outfile)
         self.outfile = None
 
@@ -184,25 +233,36 @@ class Task:
         try:
             buf = os.read(fd, BUFFER_SIZE)
             if buf:
-                if self.inline:
-                    self.outputbuffer += buf
-                if self.errfile:
-                    self.writer.write(self.errfile, buf)
+                self.got_stderr(buf)
             else:
                 self.close_stderr(iomap)
         except (OSError, IOError):
             self.check_eintr(iomap, self.close_stderr)
 
+    def got_stderr(self, buf):
+        self.last_output = time.time()
+        if self.inline:
+            # 默认 stderr 和 stdout 混在一起按顺序输出
+            if self.separate_stderr:
+                self.errorbuffer.append(buf)
+            else:
+                self.outputbuffer.append(buf)
+        if self.errfile:
+            self.writer.write(self.errfile, buf)
+
     def close_stderr(self, iomap):
         self.close_iomap_fd(iomap, self.stderr)
         self.stderr = None
+        self.stderr_closed()
+
+    def stderr_closed(self):
         self.close_write_file(self.errfile)
         self.errfile = None
 
     def log_exception(self):
         exc_type, exc_value, exc_traceback = sys.exc_info()
         exc = ("Exception: %s, %s, %s" %
-               (exc_type, exc_value, exc_traceback.format_tb(exc_traceback)))
+               (exc_type, exc_value, traceback.format_tb(exc_traceback)))
         self.failures.append(exc)
 
     def report(self, n):
@@ -228,19 +288,21 @@ class Task:
         print(p)
 
         # 刷新保证输出顺序。stdout遇到换行符会打印缓冲区中内容，没有手动flush()会打印。
-        if self.outputbuffer:
-            sys.stdout.flush()
-            try:
-                sys.stdout.buffer.write(self.outputbuffer)
+        for buffer in (self.outputbuffer, self.errorbuffer):
+            if buffer:
                 sys.stdout.flush()
-            except AttributeError:
-                sys.stdout.write(self.outputbuffer)
-        if self.errorbuffer:
-            sys.stdout.flush()
-            try:
-                sys.stdout.buffer.write(self.errorbuffer)
-            except AttributeError:
-                sys.stdout.write(self.errorbuffer)
+                try:
+                    buffer.write_to(sys.stdout.buffer)
+                except AttributeError:
+                    sys.stdout.write(buffer.getvalue().decode(errors="replace"))
+                sys.stdout.flush()
+            # 输出后释放内存额度和临时文件
+            buffer.close()
+
+    def set_budget(self, budget):
+        """所有 Task 共享 Manager 的内存额度"""
+        self.outputbuffer.budget = budget
+        self.errorbuffer.budget = budget
 
     @staticmethod
     def close_iomap_fd(iomap, fd):
@@ -254,9 +316,9 @@ class Task:
 
     def check_eintr(self, iomap, close_fn):
         _, e, _ = sys.exc_info()
-        if e.errno != EINTR:
+        if e.errno not in (EINTR, EAGAIN):
             close_fn(iomap)
-            self.log_exception(e)
+            self.log_exception()
 
 
 if __name__ == '__main__':
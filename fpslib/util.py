@@ -1,11 +1,18 @@
 import fcntl
+import math
 import re
 import fnmatch
 import sys
 
+# web[001-800]、10.2.[0-31].[1-254]、web[1,3,7-9]；[::1] 这种 IPv6 地址不展开
+_HOST_RANGE = re.compile(r'\[([\w,-]+)\]')
+
 DEFAULT_USER = "root"
 DEFAULT_PORT = "22"
 
+# 主机文件里数值型的选项，写错了在读主机文件时就报出来，不要等到 Task 启动时才抛异常
+_NUMERIC_HOST_OPTS = {"timeout": float, "idle_timeout": float, "connect_timeout": int}
+
 
 class HostParser:
 
@@ -45,66 +52,205 @@ def read_host_files(paths, host_glob, default_user=None, default_port=None):
     :param host_glob:
     :param default_user:
     :param default_port:
-    :return: a list of (host, port, user) triples
+    :return: a list of (host, port, user, host_opts) tuples
     """
-    hosts = []
-    if paths:
-        for path in paths:
-            hosts.extend(read_host_file(path, host_glob, default_user=default_user))
-    return hosts
+    return list(unique_hosts(iter_host_files(paths, host_glob, default_user=default_user,
+                                             default_port=default_port)))
 
 
 def read_host_file(path, host_glob, default_user=None, default_port=None):
-    lines = []
-    with open(path, 'r') as f:
-        for line in f:
-            lines.append(line.strip())
-    hosts = []
-    for line in lines:
-        # 删除注释
-        line = re.sub("#.*", '', line)
-        line.strip()
-
-        # 删除空行
-        if line:
-            host, port, user = parse_host_entry(line, default_user, default_port)
-            # glob 通配符判断
-            if host and (not host_glob or fnmatch.fnmatch(host, host_glob)):
-                hosts.append((host, port, user))
-
-    return hosts
-
-
-# [user@][host][:port]
+    return list(iter_host_files([path], host_glob, default_user=default_user,
+                                default_port=default_port))
+
+
+def iter_host_files(paths, host_glob, default_user=None, default_port=None):
+    """
+    逐行解析主机文件，产出 (host, port, user, host_opts)，不把整个清单读进内存。
+    文件在调用时就全部打开，打不开的话马上抛 IOError，而不是解析到一半才报错。
+    """
+    files = [open(path, 'r') for path in paths or ()]
+    return _iter_host_lines(files, compile_host_glob(host_glob), default_user, default_port)
+
+
+def _iter_host_lines(files, host_filter, default_user, default_port):
+    try:
+        for f in files:
+            for line in f:
+                # 删除注释
+                line = line.partition('#')[0].strip()
+                # 删除空行
+                if not line:
+                    continue
+                host, port, user, host_opts = parse_host_entry(line, default_user,
+                                                               default_port)
+                if not host:
+                    continue
+                try:
+                    names = expand_host(host)
+                except ValueError as e:
+                    sys.stderr.write(f"Bad line {line}. {e}\n")
+                    continue
+                # 展开一个判断一个，不生成中间列表
+                for name in names:
+                    # glob 通配符判断
+                    if host_filter is None or host_filter(name):
+                        yield name, port, user, host_opts
+    finally:
+        for f in files:
+            f.close()
+
+
+def compile_host_glob(host_glob):
+    """
+    'web*,db?' 这样的多个 glob(逗号或空格分隔)编译成一个正则，返回判断函数。
+    ! 开头的是排除，只有排除模式时表示其余全部。没有模式返回 None。
+    """
+    if not host_glob:
+        return None
+    include, exclude = [], []
+    for pattern in host_glob.replace(',', ' ').split():
+        if pattern.startswith('!'):
+            exclude.append(fnmatch.translate(pattern[1:]))
+        else:
+            include.append(fnmatch.translate(pattern))
+    included = re.compile('|'.join(include)).match if include else None
+    excluded = re.compile('|'.join(exclude)).match if exclude else None
+
+    def host_filter(host):
+        if excluded and excluded(host):
+            return False
+        return included is None or included(host) is not None
+
+    return host_filter
+
+
+def unique_hosts(hosts, default_port=DEFAULT_PORT):
+    """按 (user, host, port) 去重，保留第一次出现的条目和它的选项"""
+    seen = set()
+    for entry in hosts:
+        host, port, user, _ = entry
+        key = (user, host, port or default_port)
+        if key not in seen:
+            seen.add(key)
+            yield entry
+
+
+# [user@][host][:port] [user] [key=value ...]
 def parse_host_entry(line, default_user, default_port):
 
-    fields = line.split()
-    if len(fields) > 2:
+    fields = []
+    host_opts = {}
+    for field in line.split():
+        # key=value 是单个主机的选项，例如 timeout=30 idle_timeout=10
+        if '=' in field:
+            key, value = field.split('=', 1)
+            convert = _NUMERIC_HOST_OPTS.get(key)
+            try:
+                number = convert(value) if convert else 0
+                # nan 会打乱超时堆的顺序，inf 永远不会到期
+                if not (math.isfinite(number) and number >= 0):
+                    raise ValueError
+            except ValueError:
+                sys.stderr.write(f"Bad line {line}. {key} should be a non-negative "
+                                 f"{'integer' if convert is int else 'finite number'}\n")
+                return None, None, None, None
+            host_opts[key] = value
+        else:
+            fields.append(field)
+
+    if not fields or len(fields) > 2:
         sys.stderr.write(f"Bad line {line}. Format should be "
-                         "[user@][host][:port] [user]\n")
-        return None, None, None
+                         "[user@][host][:port] [user] [key=value ...]\n")
+        return None, None, None, None
     host_field = fields[0]
-    host, user, port = parse_host(host_field, default_port=default_port)
+    host, port, user = parse_host(host_field, default_port=default_port)
 
     if len(fields) == 2:
         if user is None:
             user = fields[1]
         else:
-            sys.stderr.write(f'User specified twice in line: {line}\n' % line)
-            return None, None, None
+            sys.stderr.write(f'User specified twice in line: {line}\n')
+            return None, None, None, None
 
     if user is None:
         user = default_user
-    return host, user, port
+    return host, port, user, host_opts
 
 
 # 解析命令行传入的主机信息
 def parse_host_string(host_string, default_user=None, default_port=None):
-    hosts = []
-    entries = host_string.split()
-    for entry in entries:
-        hosts.append(parse_host(entry, default_user, default_port))
-    return hosts
+    return list(iter_host_string(host_string, default_user, default_port))
+
+
+def iter_host_string(host_string, default_user=None, default_port=None):
+    for entry in host_string.split():
+        host, port, user = parse_host(entry, default_user, default_port)
+        try:
+            names = expand_host(host)
+        except ValueError as e:
+            sys.stderr.write(f"Bad host {entry}. {e}\n")
+            continue
+        for name in names:
+            yield name, port, user, {}
+
+
+def expand_host(pattern):
+    """
+    展开主机名里的 [..]：数字范围 [1-10]、补零范围 [001-800]、
+    单字母范围 [a-c] 和逗号分隔的集合 [1,3,7-9]，多个 [..] 按笛卡尔积展开。
+    返回生成器，按需产出；范围写错时在调用时就抛 ValueError。
+    """
+    parts = _HOST_RANGE.split(pattern)
+    if len(parts) == 1:
+        return iter((pattern,))
+    # parts 是 字面量, 范围, 字面量, 范围, ..., 字面量
+    ranges = [_parse_range(spec) for spec in parts[1::2]]
+    return _expand(parts[0::2], ranges, 0, parts[0])
+
+
+def _expand(literals, ranges, i, prefix):
+    if i == len(ranges):
+        yield prefix
+        return
+    for value in _iter_range(ranges[i]):
+        yield from _expand(literals, ranges, i + 1, prefix + value + literals[i + 1])
+
+
+def _parse_range(spec):
+    """'1,3,07-09' -> [(1, 1, 0), (3, 3, 0), (7, 9, 2)]，字母范围和字面量保存为字符串"""
+    items = []
+    for item in spec.split(','):
+        start, sep, end = item.partition('-')
+        if not sep:
+            if not item:
+                raise ValueError(f"Empty item in [{spec}]")
+            items.append(item)
+        elif start.isdigit() and end.isdigit():
+            if int(start) > int(end):
+                raise ValueError(f"Bad range {item} in [{spec}]")
+            # 开头是 0 的按起点的位数补零
+            width = len(start) if start.startswith('0') and len(start) > 1 else 0
+            items.append((int(start), int(end), width))
+        elif len(start) == len(end) == 1 and start.isalpha() and end.isalpha():
+            if start > end:
+                raise ValueError(f"Bad range {item} in [{spec}]")
+            items.append((start, end))
+        else:
+            raise ValueError(f"Bad range {item} in [{spec}]")
+    return items
+
+
+def _iter_range(items):
+    for item in items:
+        if isinstance(item, str):
+            yield item
+        elif len(item) == 2:
+            for code in range(ord(item[0]), ord(item[1]) + 1):
+                yield chr(code)
+        else:
+            start, end, width = item
+            for n in range(start, end + 1):
+                yield str(n).zfill(width)
 
 
 def parse_host(host, default_user=None, default_port=None):
@@ -119,6 +265,15 @@ def parse_host(host, default_user=None, default_port=None):
     return host, port, user
 
 
+def parse_size(value):
+    """'512', '64K', '16M', '1G' -> 字节数"""
+    units = {'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30}
+    value = value.strip().upper().rstrip('B')
+    if value and value[-1] in units:
+        return int(float(value[:-1]) * units[value[-1]])
+    return int(value)
+
+
 def set_cloexec(filelike):
     # exec 调用时自动关闭文件描述符
     # 所有文件描述符都设置了这个，subprocess.Popen()可以不设置close_fds
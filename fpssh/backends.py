@@ -0,0 +1,143 @@
+"""
+执行后端的统一接口。
+
+三种后端：ssh(fpslib 的 Manager + Task 调用系统 ssh)、native(ssh2-python + gevent)、
+paramiko(线程池)。都在所有主机上执行同一条命令，按完成顺序产出 CommandResult，
+每个后端的依赖都在用到时才导入。
+"""
+import time
+from types import SimpleNamespace
+
+from .known_hosts import ACCEPT_NEW, DEFAULT_KNOWN_HOSTS
+from .output import CommandResult
+
+DEFAULT_PKEY = '~/.ssh/id_rsa'
+DEFAULT_POOL_SIZE = 100
+
+
+class Backend:
+    name = None
+
+    def __init__(self, hosts, user=None, password=None, port=22, pkey=DEFAULT_PKEY,
+                 pool_size=DEFAULT_POOL_SIZE, timeout=None, ssh_options=(),
+                 known_hosts=DEFAULT_KNOWN_HOSTS, host_key_policy=ACCEPT_NEW):
+        self.hosts = hosts
+        self.user = user
+        self.password = password
+        self.port = port
+        self.pkey = pkey
+        self.pool_size = pool_size
+        self.timeout = timeout
+        # 只有 ssh 后端用，加在 ssh 命令行上
+        self.ssh_options = ssh_options
+        # native/paramiko 后端的主机密钥检查，ssh 后端由 ssh 自己检查
+        self.known_hosts = known_hosts
+        self.host_key_policy = host_key_policy
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def run(self, command):
+        """在所有主机上执行 command，产出每台主机的 CommandResult"""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class NativeBackend(Backend):
+    name = "native"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        from .clients.native.parallel import ParallelSSHClient
+        self.client = ParallelSSHClient(self.hosts, self.user, self.password, self.port,
+                                        pool_size=self.pool_size, pkey=self.pkey,
+                                        timeout=self.timeout, known_hosts=self.known_hosts,
+                                        host_key_policy=self.host_key_policy)
+
+    def run(self, command):
+        return self.client.run_commands([command])
+
+    def close(self):
+        self.client.disconnect()
+
+
+class ParamikoBackend(Backend):
+    name = "paramiko"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        from .clients.miko.parallel import ParallelSSHClient
+        self.client = ParallelSSHClient(self.hosts, self.user, self.password, self.port,
+                                        pool_size=self.pool_size, pkey=self.pkey,
+                                        timeout=self.timeout, known_hosts=self.known_hosts,
+                                        host_key_policy=self.host_key_policy)
+
+    def run(self, command):
+        return self.client.run_commands([command])
+
+    def close(self):
+        self.client.disconnect()
+
+
+class SubprocessBackend(Backend):
+    """每台主机一个 ssh 子进程，Manager 全部跑完后再产出结果"""
+    name = "ssh"
+
+    def ssh_cmd(self, host, command):
+        cmd = ["ssh", "-T", "-o", "BatchMode=yes", *self.ssh_options]
+        if self.pkey:
+            cmd += ["-i", self.pkey]
+        if self.timeout:
+            cmd += ["-o", f"ConnectTimeout={int(self.timeout)}"]
+        if self.user:
+            cmd += ["-l", self.user]
+        if self.port:
+            cmd += ["-p", str(self.port)]
+        return cmd + [host, command]
+
+    def run(self, command):
+        from fpslib.manager import Manager
+        from fpslib.task import Task
+
+        opts = SimpleNamespace(par=self.pool_size, timeout=self.timeout or 0, idle_timeout=0,
+                               outdir=None, errdir=None, verbose=False, user=self.user,
+                               inline=True, inline_stdout=False, separate_stderr=True,
+                               print_out=False)
+        results = []
+
+        class CollectingManager(Manager):
+            def finished(self, task):
+                self.done.append(task)
+                exception = None
+                if task.exit_code is None:
+                    exception = RuntimeError(", ".join(task.failures) or "Not started")
+                results.append(CommandResult(
+                    task.host, command, task.exit_code,
+                    task.outputbuffer.getvalue().decode("utf-8", "replace"),
+                    task.errorbuffer.getvalue().decode("utf-8", "replace"),
+                    exception, None,
+                    time.time() - task.timestamp if task.timestamp else None))
+                task.outputbuffer.close()
+                task.errorbuffer.close()
+
+        manager = CollectingManager(opts)
+        for host in self.hosts:
+            manager.add_task(Task(host, None, self.user, self.ssh_cmd(host, command), opts))
+        manager.run()
+        return iter(results)
+
+
+BACKENDS = {backend.name: backend
+            for backend in (SubprocessBackend, NativeBackend, ParamikoBackend)}
+
+
+def get_backend(name):
+    try:
+        return BACKENDS[name]
+    except KeyError:
+        raise ValueError(f"Unknown backend {name!r}, choose from {', '.join(BACKENDS)}")
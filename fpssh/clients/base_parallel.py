@@ -1,10 +1,16 @@
 from gevent import pool
+from gevent.queue import Queue
+
+from ..output import CommandResult
+
+# 同时连接的主机数，I/O 都是非阻塞的，可以开得很大
+DEFAULT_POOL_SIZE = 100
 
 
 class BaseParallelSSHClient:
 
-    def __init__(self, hosts, user, password, port):
-        self.pool_size = 4
+    def __init__(self, hosts, user, password, port, pool_size=DEFAULT_POOL_SIZE):
+        self.pool_size = pool_size
         self.pool = pool.Pool(self.pool_size)
         self.hosts = hosts
         self.user = user
@@ -22,6 +28,32 @@ class BaseParallelSSHClient:
 
         return output
 
+    def run_commands(self, commands, max_channels):
+        """
+        每台主机在一个会话上并发执行 commands，按结束顺序产出 CommandResult；
+        主机连不上时它的每条命令都产出一个带 exception 的结果。
+        """
+        commands = list(commands)
+        results = Queue()
+
+        def run(host):
+            remaining = list(commands)
+            try:
+                for result in self._run_commands(host, commands, max_channels):
+                    remaining.remove(result.command)
+                    results.put(result)
+            except Exception as ex:
+                for command in remaining:
+                    results.put(CommandResult(host, command, None, None, None, ex))
+
+        for host in self.hosts:
+            self.pool.spawn(run, host)
+        for _ in range(len(self.hosts) * len(commands)):
+            yield results.get()
+
     def _run_command(self, host, command):
         raise NotImplementedError
 
+    def _run_commands(self, host, commands, max_channels):
+        raise NotImplementedError
+
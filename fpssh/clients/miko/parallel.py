@@ -1,28 +1,98 @@
-import gevent
-from gevent import Greenlet
-from gevent import pool
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
+from ..base_parallel import DEFAULT_POOL_SIZE
+from ...known_hosts import open_known_hosts, ACCEPT_NEW, DEFAULT_KNOWN_HOSTS
+from ...output import CommandResult
+from .single import SSHClient, DEFAULT_PKEY
 
-class FooG(Greenlet):
-    def __init__(self):
-        super().__init__()
 
-    def switch_out(self):
-        print("out")
+class ParallelSSHClient:
+    """
+    paramiko 后端的并行客户端，每台主机占线程池的一个线程。
 
-    def _run(self):
-        print('1')
-        gevent.sleep(0)
-        print('2')
+    接口和 native.ParallelSSHClient 一致：run_command 返回 {host: (stdout, stderr)}，
+    run_commands 按完成顺序产出 CommandResult；连接在多次调用之间复用。
+    """
 
+    def __init__(self, hosts, user, password, port, pool_size=DEFAULT_POOL_SIZE,
+                 pkey=DEFAULT_PKEY, timeout=None, known_hosts=DEFAULT_KNOWN_HOSTS,
+                 host_key_policy=ACCEPT_NEW):
+        self.hosts = hosts
+        self.user = user
+        self.password = password
+        self.port = port
+        self.pool_size = pool_size
+        self.pkey = pkey
+        self.timeout = timeout
+        # 同 native.ParallelSSHClient，所有主机共用一个 KnownHosts，每次运行结束时写回
+        self.known_hosts = open_known_hosts(known_hosts, host_key_policy)
+        if self.known_hosts is not None:
+            self.known_hosts.preload([(host, port) for host in hosts])
+        self.host_key_policy = host_key_policy
+        self.pool = ThreadPoolExecutor(pool_size)
+        self.host_clients = {}
+        self._lock = threading.Lock()
 
-class ParallelSSHClient:
+    def _get_client(self, host):
+        with self._lock:
+            client = self.host_clients.get(host)
+        if client is None:
+            client = SSHClient(host, self.user, self.password, self.port, pkey=self.pkey,
+                               timeout=self.timeout, known_hosts=self.known_hosts,
+                               host_key_policy=self.host_key_policy)
+            with self._lock:
+                self.host_clients[host] = client
+        return client
+
+    def run_command(self, command):
+        futures = [self.pool.submit(lambda host: self._get_client(host).run_command(command),
+                                    host)
+                   for host in self.hosts]
+        output = {}
+        try:
+            for future in futures:
+                stdout, stderr, host = future.result()
+                output[host] = (stdout, stderr)
+        finally:
+            self.save_known_hosts()
+        return output
+
+    def run_commands(self, commands):
+        commands = list(commands)
+        results = queue.Queue()
+
+        def run(host):
+            remaining = list(commands)
+            try:
+                start = time.monotonic()
+                client = self._get_client(host)
+                connect_time = time.monotonic() - start
+                for result in client.run_commands(commands):
+                    remaining.remove(result.command)
+                    results.put(result._replace(connect_time=connect_time))
+            except Exception as ex:
+                for command in remaining:
+                    results.put(CommandResult(host, command, None, None, None, ex))
 
-    def __init__(self):
-        self.size = 4
-        self.pool = pool.Pool(self.size)
+        for host in self.hosts:
+            self.pool.submit(run, host)
+        try:
+            for _ in range(len(self.hosts) * len(commands)):
+                yield results.get()
+        finally:
+            self.save_known_hosts()
 
+    def save_known_hosts(self):
+        if self.known_hosts is not None:
+            self.known_hosts.save()
 
-g = FooG()
-g.start()
-g.join()
\ No newline at end of file
+    def disconnect(self):
+        with self._lock:
+            clients = list(self.host_clients.values())
+            self.host_clients.clear()
+        for client in clients:
+            client.disconnect()
+        self.save_known_hosts()
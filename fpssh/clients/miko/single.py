@@ -1,13 +1,137 @@
-import logging
+import os
+import select
+import socket
+import time
+
 import paramiko
-from gevent import monkey
-monkey.patch_all()
+
+from ...exceptions import UnknownHostException, ConnectionErrorException, \
+    AuthenticationException, Timeout, HostKeyError
+from ...known_hosts import open_known_hosts, ACCEPT_NEW, DEFAULT_KNOWN_HOSTS
+from ...output import CommandResult
+
+DEFAULT_PKEY = '~/.ssh/id_rsa'
+READ_SIZE = 1 << 15
 
 
 class SSHClient:
+    """
+    paramiko 实现的单主机客户端，和 native.SSHClient 的 run_command/run_commands 接口一致。
+
+    paramiko 是阻塞 I/O，由 ParallelSSHClient 的线程池并发，不需要 gevent。
+    """
+
+    def __init__(self, host, user, password, port=22, pkey=DEFAULT_PKEY, timeout=None,
+                 known_hosts=DEFAULT_KNOWN_HOSTS, host_key_policy=ACCEPT_NEW):
+        self.host = host
+        self.port = port
+        self.user = user
+        self.password = password
+        self.pkey = os.path.expanduser(pkey) if pkey else None
+        self.timeout = timeout
+        # 和 native 客户端一样，路径时自己写回，共享的 KnownHosts 由 ParallelSSHClient 写回
+        self._owns_known_hosts = isinstance(known_hosts, str)
+        self.known_hosts = open_known_hosts(known_hosts, host_key_policy)
+        self.client = paramiko.SSHClient()
+        # paramiko 自己不加载任何主机密钥，每次握手都走到这个策略，由 KnownHosts 检查
+        self.client.set_missing_host_key_policy(
+            _KnownHostsPolicy(self.known_hosts, host, port, host_key_policy))
+        self._connect()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.disconnect()
+
+    def _connect(self):
+        key_filename = self.pkey if self.pkey and os.path.exists(self.pkey) else None
+        try:
+            self.client.connect(self.host, self.port, username=self.user,
+                                password=self.password, key_filename=key_filename,
+                                timeout=self.timeout, allow_agent=False,
+                                look_for_keys=False)
+        except socket.gaierror as ex:
+            raise UnknownHostException(ex)
+        except socket.timeout as ex:
+            raise Timeout(ex)
+        except paramiko.AuthenticationException as ex:
+            raise AuthenticationException(ex)
+        except HostKeyError:
+            # 握手已经完成，传输线程要关掉
+            self.client.close()
+            raise
+        except (socket.error, paramiko.SSHException) as ex:
+            raise ConnectionErrorException(ex)
+
+    def _execute(self, command):
+        channel = self.client.get_transport().open_session(timeout=self.timeout)
+        channel.exec_command(command)
+        return channel
+
+    def _collect(self, channel):
+        """
+        stdout 和 stderr 一起读完，返回 (stdout, stderr, exit_code)。
+        只读一个流的话，另一个流没人读会占满 channel 窗口，远端就写不动了。
+        """
+        out, err = [], []
+        while True:
+            got = False
+            while channel.recv_ready():
+                out.append(channel.recv(READ_SIZE))
+                got = True
+            while channel.recv_stderr_ready():
+                err.append(channel.recv_stderr(READ_SIZE))
+                got = True
+            if channel.eof_received and not channel.recv_ready() \
+                    and not channel.recv_stderr_ready():
+                break
+            if not got:
+                # channel 的 fileno 在 stdout/stderr 有数据或者 EOF 时可读
+                if not select.select([channel], [], [], self.timeout)[0]:
+                    raise Timeout(f"No output from {self.host} in {self.timeout}s")
+        return b"".join(out), b"".join(err), channel.recv_exit_status()
+
+    def run_command(self, command, encoding="utf-8"):
+        """返回 (stdout, stderr, host)，stdout/stderr 是按行的 str 列表"""
+        channel = self._execute(command)
+        try:
+            out, err, _ = self._collect(channel)
+        finally:
+            channel.close()
+        return (out.decode(encoding, "replace").splitlines(keepends=True),
+                err.decode(encoding, "replace").splitlines(keepends=True), self.host)
+
+    def run_commands(self, commands, encoding="utf-8"):
+        """按顺序执行，每条结束产出一个 CommandResult"""
+        for command in commands:
+            start = time.monotonic()
+            channel = self._execute(command)
+            try:
+                out, err, exit_code = self._collect(channel)
+            finally:
+                channel.close()
+            yield CommandResult(self.host, command, exit_code,
+                                out.decode(encoding, "replace"),
+                                err.decode(encoding, "replace"),
+                                elapsed=time.monotonic() - start)
+
+    def disconnect(self):
+        self.client.close()
+        if self._owns_known_hosts and self.known_hosts is not None:
+            self.known_hosts.save()
+
+
+class _KnownHostsPolicy(paramiko.MissingHostKeyPolicy):
+    """把 paramiko 的主机密钥检查交给 KnownHosts，known_hosts 为 None 时不检查"""
+
+    def __init__(self, known_hosts, host, port, policy):
+        self.known_hosts = known_hosts
+        self.host = host
+        self.port = port
+        self.policy = policy
 
-    def __init__(self):
-        client = paramiko.SSHClient()
-        self.client = client
-        self.host = None
-        self.port = None
\ No newline at end of file
+    def missing_host_key(self, client, hostname, key):
+        if self.known_hosts is not None:
+            self.known_hosts.check(self.host, self.port, key.get_name(), key.asbytes(),
+                                   self.policy)
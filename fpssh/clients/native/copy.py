@@ -0,0 +1,55 @@
+import os
+import posixpath
+import stat
+from collections import Counter
+
+from fpslib.inputbuffer import InputBuffer
+
+# libssh2 每个 SFTP 写请求最多 30000 字节
+SFTP_CHUNK = 30000
+# 同时在途的写请求数，高延迟链路上靠它填满带宽
+DEFAULT_COPY_DEPTH = 16
+
+
+class LocalTree:
+    """
+    本地目录遍历一次，所有主机共用。
+
+    文件第一次被某台主机用到时才 mmap，之后其他主机复用同一个 InputBuffer；
+    users 台主机都 release() 之后丢掉映射，同时打开的文件数不会随目录变大。
+    """
+
+    def __init__(self, local_dir, users=1):
+        self.root = local_dir
+        self.users = users
+        # 远端相对路径(posix 分隔符)，父目录在前
+        self.dirs = []
+        # (远端相对路径, 本地路径, 权限)
+        self.files = []
+        self.total = 0
+        self._sources = {}
+        self._released = Counter()
+        for root, dirs, files in os.walk(local_dir):
+            dirs.sort()
+            rel = os.path.relpath(root, local_dir)
+            parts = [] if rel == os.curdir else rel.split(os.sep)
+            self.dirs.append(posixpath.join(*parts) if parts else "")
+            for name in sorted(files):
+                path = os.path.join(root, name)
+                st = os.stat(path)
+                if not stat.S_ISREG(st.st_mode):
+                    continue
+                self.files.append((posixpath.join(*parts, name), path, stat.S_IMODE(st.st_mode)))
+                self.total += st.st_size
+
+    def source(self, path):
+        buf = self._sources.get(path)
+        if buf is None:
+            buf = self._sources[path] = InputBuffer.open(path)
+        return buf
+
+    def release(self, path):
+        """一台主机用完(或者放弃)这个文件"""
+        self._released[path] += 1
+        if self._released[path] >= self.users:
+            self._sources.pop(path, None)
@@ -0,0 +1,36 @@
+import os
+import threading
+
+from ...exceptions import PKeyFileError
+
+
+class KeyCache:
+    """
+    进程内共享的私钥缓存，每个文件只读一次。
+
+    认证在线程池里执行，读写加锁。
+    """
+
+    def __init__(self):
+        self._keys = {}
+        self._lock = threading.Lock()
+
+    def get(self, path):
+        path = os.path.expanduser(path)
+        with self._lock:
+            data = self._keys.get(path)
+            if data is None:
+                try:
+                    with open(path, "rb") as f:
+                        data = f.read()
+                except OSError as ex:
+                    raise PKeyFileError(ex)
+                self._keys[path] = data
+        return data
+
+    def clear(self):
+        with self._lock:
+            self._keys.clear()
+
+
+key_cache = KeyCache()
@@ -1,22 +1,230 @@
-from fpssh.clients.base_parallel import BaseParallelSSHClient
-from gevent.lock import RLock
-from fpssh.clients.native.single import SSHClient
+import logging
+import os
+import time
+
+import gevent
+from gevent.queue import Queue
+
+from fpslib.inputbuffer import InputBuffer
+from fpssh.clients.base_parallel import BaseParallelSSHClient, DEFAULT_POOL_SIZE
+from fpssh.clients.native.single import SSHClient, DEFAULT_PKEY, DEFAULT_MAX_CHANNELS
+from fpssh.clients.native.session_pool import SessionPool, DEFAULT_IDLE_TTL
+from fpssh.clients.native.pipeline import ConnectPipeline
+from fpssh.clients.native.copy import LocalTree, DEFAULT_COPY_DEPTH
+from fpssh.clients.native.relay import relay_tree, chunk_checksums, verify_command, \
+    parse_verify, forward_command, DEFAULT_FANOUT, DEFAULT_RELAY_CHUNK
+from fpssh.exceptions import SessionError, ChecksumError
+from fpssh.known_hosts import open_known_hosts, ACCEPT_NEW, DEFAULT_KNOWN_HOSTS
+from fpssh.output import CopyStats
+
+
+logger = logging.getLogger(__name__)
 
 
 class ParallelSSHClient(BaseParallelSSHClient):
 
-    def __init__(self, hosts, user, password, port):
-        BaseParallelSSHClient.__init__(self, hosts, user, password, port)
-        self._clients_lock = RLock()
+    def __init__(self, hosts, user, password, port, pool_size=DEFAULT_POOL_SIZE,
+                 pkey=DEFAULT_PKEY, timeout=None, idle_ttl=DEFAULT_IDLE_TTL,
+                 keepalive_seconds=60, pipeline=None, known_hosts=DEFAULT_KNOWN_HOSTS,
+                 host_key_policy=ACCEPT_NEW, allow_agent=False):
+        BaseParallelSSHClient.__init__(self, hosts, user, password, port, pool_size)
+        self.pkey = pkey
+        # 建连各阶段的限流和耗时，pipeline.stats() 查看
+        self.pipeline = pipeline or ConnectPipeline()
+        self.timeout = timeout
+        self.keepalive_seconds = keepalive_seconds
+        # 所有主机共用一个 KnownHosts，新主机的密钥在每次运行结束时一起写回；
+        # host_key_policy=NO_CHECK 时不检查
+        known_hosts = open_known_hosts(known_hosts, host_key_policy)
+        self.known_hosts = known_hosts
+        if known_hosts is not None:
+            # 哈希条目一次扫完，每台主机检查密钥时不再逐个 salt 算 HMAC
+            known_hosts.preload([(host, port) for host in hosts])
+        self.host_key_policy = host_key_policy
+        self.allow_agent = allow_agent
+        # 已认证的会话在多次 run_command 之间复用
+        self.sessions = SessionPool(self._make_ssh_client, idle_ttl, keepalive_seconds)
+        self.host_clients = self.sessions.clients
+        # 最近一次 copy_file/copy_tree 每台主机的进度，复制过程中可以读
+        self.copy_stats = {}
 
     def _run_command(self, host, command):
-        self._make_ssh_client(host)
-        return self.host_clients[host].run_command(command)
+        # 返回后输出还没读完，会话由 client.busy 标记为在用
+        with self.sessions.session(host) as client:
+            try:
+                return client.run_command(command)
+            except SessionError:
+                # 缓存的连接已经断了，重连一次
+                self.sessions.discard(host)
+                return self.sessions.get(host).run_command(command)
+
+    def run_commands(self, commands, max_channels=DEFAULT_MAX_CHANNELS):
+        try:
+            yield from BaseParallelSSHClient.run_commands(self, commands, max_channels)
+        finally:
+            self.save_known_hosts()
+
+    def _run_commands(self, host, commands, max_channels):
+        started = False
+        start = time.monotonic()
+        with self.sessions.session(host) as client:
+            connect_time = time.monotonic() - start
+            try:
+                for result in client.run_commands(commands, max_channels):
+                    started = True
+                    yield result._replace(connect_time=connect_time)
+            except SessionError:
+                if started:
+                    raise
+                # 缓存的连接已经断了，重连一次
+                self.sessions.discard(host)
+                start = time.monotonic()
+                client = self.sessions.get(host)
+                connect_time = time.monotonic() - start
+                for result in client.run_commands(commands, max_channels):
+                    yield result._replace(connect_time=connect_time)
+
+    def copy_file(self, local_file, remote_file, depth=DEFAULT_COPY_DEPTH):
+        """
+        把本地文件复制到所有主机，文件只 mmap 一次，所有主机共用。
+        返回 {host: CopyStats}，失败的主机 exception 不为空。
+        """
+        source = InputBuffer.open(local_file)
+        mode = os.stat(local_file).st_mode & 0o777
+        self.copy_stats = {host: CopyStats(host, len(source)) for host in self.hosts}
+        return self._copy("copy_file", source, remote_file, depth=depth, mode=mode)
+
+    def copy_tree(self, local_dir, remote_dir, depth=DEFAULT_COPY_DEPTH):
+        """递归复制目录，本地目录只遍历一次，每个文件只 mmap 一次"""
+        tree = LocalTree(local_dir, users=len(self.hosts))
+        self.copy_stats = {host: CopyStats(host, tree.total) for host in self.hosts}
+        return self._copy("copy_tree", local_dir, remote_dir, depth=depth, tree=tree)
+
+    def _copy(self, method, *args, **kwargs):
+        def copy(host):
+            stats = self.copy_stats[host]
+            try:
+                with self.sessions.session(host) as client:
+                    try:
+                        getattr(client, method)(*args, stats=stats, **kwargs)
+                    except SessionError:
+                        if stats.sent:
+                            raise
+                        # 缓存的连接已经断了，重连一次
+                        self.sessions.discard(host)
+                        getattr(self.sessions.get(host), method)(*args, stats=stats, **kwargs)
+            except Exception as ex:
+                stats.finish(ex)
+            else:
+                stats.finish()
+
+        gevent.joinall([self.pool.spawn(copy, host) for host in self.hosts])
+        return self.copy_stats
+
+    def relay_file(self, local_file, remote_file, fanout=DEFAULT_FANOUT,
+                   chunk_size=DEFAULT_RELAY_CHUNK, ssh_options=(), depth=DEFAULT_COPY_DEPTH):
+        """
+        按 fanout 叉树分发文件：控制端只发给第一层，之后每台主机收到并校验通过后，
+        用 ssh 转发给自己的下一层，墙钟时间随主机数按 log 增长，而不是控制端发 n 份。
+
+        每台主机收到后按 chunk_size 分块比对 sha256，不一致的块从控制端直接补发；
+        转发失败或者大小不对就从控制端整个重发，它的下一层也改成由控制端直接发。
+        转发主机要能用 ssh 免密登录下一层，ssh_options 加在转发用的 ssh 命令上。
+        返回 {host: CopyStats}，via 是数据来源主机。
+        """
+        source = InputBuffer.open(local_file)
+        mode = os.stat(local_file).st_mode & 0o777
+        checksums = chunk_checksums(source.view, chunk_size)
+        hosts = list(dict.fromkeys(self.hosts))
+        tree = relay_tree(hosts, fanout)
+        self.copy_stats = {host: CopyStats(host, len(source)) for host in hosts}
+        ready = Queue()
+
+        def deliver(host, parent):
+            stats = self.copy_stats[host]
+            stats.via = parent
+            stats.begin()
+            try:
+                if parent is not None and not self._forward(parent, host, remote_file,
+                                                            ssh_options):
+                    stats.via = parent = None
+                if parent is None:
+                    with self.sessions.session(host) as client:
+                        client.copy_file(source, remote_file, stats, depth, mode)
+                else:
+                    stats.sent = len(source)
+                self._verify(host, source, remote_file, checksums, chunk_size, stats, depth)
+            except Exception as ex:
+                stats.finish(ex)
+                # 这台没收到，它的下一层改由控制端直接发
+                for child in tree[host]:
+                    ready.put((child, None))
+            else:
+                stats.finish()
+                for child in tree[host]:
+                    ready.put((child, host))
+
+        for host in tree[None]:
+            ready.put((host, None))
+        for _ in hosts:
+            self.pool.spawn(deliver, *ready.get())
+        self.pool.join()
+        return self.copy_stats
+
+    def _forward(self, parent, child, remote_file, ssh_options):
+        cmd = forward_command(remote_file, child, self.port, self.user, ssh_options)
+        try:
+            with self.sessions.session(parent) as client:
+                result, = client.run_commands([cmd])
+        except Exception as ex:
+            logger.warning("Relay %s -> %s failed: %s", parent, child, ex)
+            return False
+        if result.exit_code != 0:
+            logger.warning("Relay %s -> %s exited with %s: %s", parent, child,
+                           result.exit_code, result.stderr.strip())
+            return False
+        return True
+
+    def _verify(self, host, source, remote_file, checksums, chunk_size, stats, depth):
+        """比对分块校验和，坏块从控制端补发，补发后还不一致就报错"""
+        command = verify_command(remote_file, chunk_size, len(checksums))
+        with self.sessions.session(host) as client:
+            for attempt in range(2):
+                result, = client.run_commands([command])
+                bad = parse_verify(result.stdout, len(source), checksums, chunk_size)
+                if bad == []:
+                    return
+                if attempt:
+                    break
+                if bad is None:
+                    # 大小不对，整个重发
+                    stats.via = None
+                    client.copy_file(source, remote_file, stats, depth)
+                else:
+                    stats.repaired += len(bad)
+                    client.copy_file(source, remote_file, stats, depth, ranges=bad)
+        raise ChecksumError(f"{remote_file} on {host} does not match after repair")
 
     def _make_ssh_client(self, host):
-        # with 相当于 acquire release
-        with self._clients_lock:
-            self.host_clients[host] = SSHClient(host, self.user, self.password, self.port)
+        return SSHClient(host, self.user, self.password, self.port, pkey=self.pkey,
+                         timeout=self.timeout, keepalive_seconds=self.keepalive_seconds,
+                         pipeline=self.pipeline, known_hosts=self.known_hosts,
+                         host_key_policy=self.host_key_policy, allow_agent=self.allow_agent)
+
+    def run_command(self, command):
+        try:
+            return BaseParallelSSHClient.run_command(self, command)
+        finally:
+            self.save_known_hosts()
+
+    def save_known_hosts(self):
+        if self.known_hosts is not None:
+            self.known_hosts.save()
+
+    def disconnect(self):
+        """关闭所有缓存的会话"""
+        self.sessions.close()
+        self.save_known_hosts()
 
 
 if "__main__" == __name__:
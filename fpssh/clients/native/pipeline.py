@@ -0,0 +1,143 @@
+import os
+import time
+from contextlib import contextmanager
+
+from gevent import socket, get_hub
+from gevent.lock import BoundedSemaphore
+from gevent.monkey import get_original
+
+# 线程池里要用真正阻塞的 getaddrinfo，gevent 的版本本身又会转到线程池
+_getaddrinfo = get_original("socket", "getaddrinfo")
+
+# DNS 结果缓存多少秒
+DEFAULT_DNS_TTL = 300
+DEFAULT_DNS_LIMIT = 64
+# TCP connect 只等 socket，不占 CPU，可以开很大
+DEFAULT_CONNECT_LIMIT = 512
+# 密钥交换和公钥认证都是 CPU 密集的，放进线程池；中间还有网络往返，线程数比核数多一些
+DEFAULT_CRYPTO_LIMIT = 4 * (os.cpu_count() or 1)
+
+
+class Stage:
+    """一个阶段的并发限制和耗时统计"""
+
+    def __init__(self, name, limit):
+        self.name = name
+        self.limit = limit
+        self.sem = BoundedSemaphore(limit)
+        self.count = 0
+        self.errors = 0
+        # 等待名额的时间和真正执行的时间分开记，能看出是哪个限制卡住了
+        self.wait_time = 0.0
+        self.run_time = 0.0
+        self.max_time = 0.0
+
+    @contextmanager
+    def use(self):
+        """占一个名额执行；开始时间是每次调用自己的，同时进行的调用互不覆盖"""
+        start = time.monotonic()
+        self.sem.acquire()
+        begin = time.monotonic()
+        self.wait_time += begin - start
+        try:
+            yield
+        except BaseException:
+            self.errors += 1
+            raise
+        finally:
+            elapsed = time.monotonic() - begin
+            self.sem.release()
+            self.count += 1
+            self.run_time += elapsed
+            self.max_time = max(self.max_time, elapsed)
+
+    def stats(self):
+        return dict(count=self.count, errors=self.errors, wait_time=self.wait_time,
+                    run_time=self.run_time, max_time=self.max_time,
+                    avg_time=self.run_time / self.count if self.count else 0.0)
+
+
+class ConnectPipeline:
+    """
+    把建连拆成 dns -> connect -> handshake -> auth 四个阶段，每个阶段单独限流和计时。
+
+    DNS 在线程池里解析并缓存，connect 是 gevent 的非阻塞 connect；
+    handshake 和 auth 把会话临时切成阻塞模式放进线程池执行，
+    libssh2 调用期间释放 GIL，加解密不会占住 hub 线程。
+    """
+
+    def __init__(self, dns_limit=DEFAULT_DNS_LIMIT, connect_limit=DEFAULT_CONNECT_LIMIT,
+                 handshake_limit=DEFAULT_CRYPTO_LIMIT, auth_limit=DEFAULT_CRYPTO_LIMIT,
+                 dns_ttl=DEFAULT_DNS_TTL, threadpool=None):
+        self.stages = {
+            "dns": Stage("dns", dns_limit),
+            "connect": Stage("connect", connect_limit),
+            "handshake": Stage("handshake", handshake_limit),
+            "auth": Stage("auth", auth_limit),
+        }
+        self.dns_ttl = dns_ttl
+        self.dns_cache = {}
+        self.threadpool = threadpool or get_hub().threadpool
+        # 线程池要能同时容纳 handshake 和 auth
+        needed = dns_limit + handshake_limit + auth_limit
+        if self.threadpool.maxsize < needed:
+            self.threadpool.maxsize = needed
+
+    def resolve(self, host, port):
+        key = (host, port)
+        cached = self.dns_cache.get(key)
+        if cached is not None and cached[0] > time.monotonic():
+            return cached[1]
+        with self.stages["dns"].use():
+            addrs = self.threadpool.apply(_getaddrinfo, (host, port, 0, socket.SOCK_STREAM))
+        self.dns_cache[key] = (time.monotonic() + self.dns_ttl, addrs)
+        return addrs
+
+    def connect(self, host, port, timeout=None):
+        """依次尝试解析出的地址，返回已连接的 gevent socket"""
+        addrs = self.resolve(host, port)
+        with self.stages["connect"].use():
+            error = None
+            for family, type_, proto, _, addr in addrs:
+                sock = socket.socket(family, type_, proto)
+                if timeout:
+                    sock.settimeout(timeout)
+                try:
+                    sock.connect(addr)
+                    return sock
+                except socket.error as ex:
+                    sock.close()
+                    error = ex
+            raise error
+
+    def _offload(self, stage, session, timeout, func, *args):
+        with self.stages[stage].use():
+            session.set_blocking(True)
+            if timeout:
+                session.set_timeout(int(timeout * 1000))
+            try:
+                return self.threadpool.apply(func, args)
+            finally:
+                session.set_timeout(0)
+                session.set_blocking(False)
+
+    def handshake(self, session, sock, timeout=None):
+        return self._offload("handshake", session, timeout, session.handshake, sock)
+
+    def auth(self, session, func, *args, timeout=None):
+        """func 在会话是阻塞模式时执行认证"""
+        return self._offload("auth", session, timeout, func, *args)
+
+    def stats(self):
+        return {name: stage.stats() for name, stage in self.stages.items()}
+
+
+_default_pipeline = None
+
+
+def default_pipeline():
+    """没有指定 pipeline 的 SSHClient 共用一个，DNS 缓存也是共享的"""
+    global _default_pipeline
+    if _default_pipeline is None:
+        _default_pipeline = ConnectPipeline()
+    return _default_pipeline
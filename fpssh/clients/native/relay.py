@@ -0,0 +1,61 @@
+import hashlib
+import shlex
+
+# 每台转发主机最多转给几台
+DEFAULT_FANOUT = 4
+# 校验块大小
+DEFAULT_RELAY_CHUNK = 4 << 20
+# 转发用的 ssh 不能停下来问密码
+RELAY_SSH_OPTIONS = ("-o", "BatchMode=yes")
+
+
+def relay_tree(hosts, fanout=DEFAULT_FANOUT):
+    """
+    k 叉树：{parent: [children]}，parent 为 None 的是控制端直接发送的第一层。
+    按堆的下标排列，n 台主机的深度是 log_k(n)。
+    """
+    children = {None: hosts[:fanout]}
+    for i, host in enumerate(hosts):
+        start = fanout * (i + 1)
+        children[host] = hosts[start:start + fanout]
+    return children
+
+
+def chunk_checksums(view, chunk_size=DEFAULT_RELAY_CHUNK):
+    return [hashlib.sha256(view[offset:offset + chunk_size]).hexdigest()
+            for offset in range(0, len(view), chunk_size)]
+
+
+def verify_command(remote_file, chunk_size, count):
+    """远端输出文件大小和每块的 sha256，只用 POSIX 工具"""
+    path = shlex.quote(remote_file)
+    return (f"wc -c < {path} && i=0 && while [ $i -lt {count} ]; do "
+            f"dd if={path} bs={chunk_size} skip=$i count=1 2>/dev/null "
+            f"| sha256sum | cut -d' ' -f1; i=$((i+1)); done")
+
+
+def parse_verify(stdout, size, checksums, chunk_size):
+    """
+    返回需要重发的 [(offset, length)]；大小不一致返回 None，需要整个重发。
+    """
+    lines = stdout.split()
+    if not lines or int(lines[0]) != size:
+        return None
+    remote = lines[1:]
+    bad = []
+    for i, checksum in enumerate(checksums):
+        if i >= len(remote) or remote[i] != checksum:
+            bad.append((i * chunk_size, chunk_size))
+    return bad
+
+
+def forward_command(remote_file, child, port=None, user=None, ssh_options=()):
+    """在转发主机上执行，把已经收到的文件发给下一层"""
+    cmd = ["ssh", *RELAY_SSH_OPTIONS, *ssh_options]
+    if port:
+        cmd += ["-p", str(port)]
+    if user:
+        cmd += ["-l", user]
+    path = shlex.quote(remote_file)
+    cmd += [child, f"cat > {path}"]
+    return " ".join(shlex.quote(arg) for arg in cmd) + f" < {path}"
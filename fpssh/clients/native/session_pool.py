@@ -0,0 +1,100 @@
+import logging
+import time
+from collections import defaultdict, Counter
+from contextlib import contextmanager
+
+import gevent
+from gevent.lock import RLock
+
+logger = logging.getLogger(__name__)
+
+# 空闲多久关闭会话
+DEFAULT_IDLE_TTL = 300
+
+
+class SessionPool:
+    """
+    按主机缓存已经认证的 SSHClient，多次 run_command 复用同一个连接。
+
+    后台 greenlet 定期给每个空闲的会话发 libssh2 keepalive，并关闭空闲超过 idle_ttl 的会话；
+    keepalive 失败的会话直接丢弃，下次 get() 时重新连接。
+    用 session() 取出的会话和还有输出没读完的会话算在用，不发 keepalive 也不会被关闭，
+    空闲时间从放回或者输出读完时算起。
+    """
+
+    def __init__(self, factory, idle_ttl=DEFAULT_IDLE_TTL, keepalive_seconds=60):
+        # factory(host) -> SSHClient
+        self.factory = factory
+        self.idle_ttl = idle_ttl
+        self.keepalive_seconds = keepalive_seconds
+        self.clients = {}
+        self.last_used = {}
+        # 主机 -> 正在用的次数
+        self.in_use = Counter()
+        # 同一个主机同时只建一个连接
+        self._locks = defaultdict(RLock)
+        self._keepalive = None
+
+    def __len__(self):
+        return len(self.clients)
+
+    def get(self, host):
+        with self._locks[host]:
+            client = self.clients.get(host)
+            if client is None or client.session is None:
+                client = self.factory(host)
+                self.clients[host] = client
+            self.last_used[host] = time.time()
+        if self._keepalive is None or self._keepalive.dead:
+            self._keepalive = gevent.spawn(self._keepalive_loop)
+        return client
+
+    @contextmanager
+    def session(self, host):
+        """取出会话，with 结束时放回"""
+        self.in_use[host] += 1
+        try:
+            yield self.get(host)
+        finally:
+            self.in_use[host] -= 1
+            if not self.in_use[host]:
+                del self.in_use[host]
+            self.last_used[host] = time.time()
+
+    def busy(self, host, client):
+        return self.in_use[host] > 0 or client.busy
+
+    def discard(self, host):
+        client = self.clients.pop(host, None)
+        self.last_used.pop(host, None)
+        if client is not None:
+            client.disconnect()
+
+    def _keepalive_loop(self):
+        interval = min(self.keepalive_seconds or self.idle_ttl, self.idle_ttl)
+        while self.clients:
+            gevent.sleep(interval)
+            now = time.time()
+            for host, client in list(self.clients.items()):
+                if self.busy(host, client):
+                    # 在用的会话不打扰，空闲时间从用完开始算
+                    self.last_used[host] = now
+                    continue
+                if now - self.last_used.get(host, now) > self.idle_ttl:
+                    logger.debug("Closing idle session to %s", host)
+                    self.discard(host)
+                    continue
+                if not self.keepalive_seconds:
+                    continue
+                try:
+                    client.keepalive()
+                except Exception as ex:
+                    logger.debug("Keepalive to %s failed: %s", host, ex)
+                    self.discard(host)
+
+    def close(self):
+        if self._keepalive is not None:
+            self._keepalive.kill()
+            self._keepalive = None
+        for host in list(self.clients):
+            self.discard(host)
@@ -1,70 +1,307 @@
+import codecs
 import logging
 import os
+import posixpath
+import time
+import weakref
+from collections import deque
 
-from ssh2.session import Session
-from gevent import socket, get_hub
+from ssh2.session import Session, LIBSSH2_SESSION_BLOCK_INBOUND, LIBSSH2_SESSION_BLOCK_OUTBOUND, \
+    LIBSSH2_HOSTKEY_TYPE_RSA, LIBSSH2_HOSTKEY_TYPE_DSS, LIBSSH2_HOSTKEY_TYPE_ECDSA_256, \
+    LIBSSH2_HOSTKEY_TYPE_ECDSA_384, LIBSSH2_HOSTKEY_TYPE_ECDSA_521, LIBSSH2_HOSTKEY_TYPE_ED25519
+from gevent import socket
+from gevent.socket import wait_read, wait_write, wait_readwrite
 
 from ...exceptions import SessionError, UnknownHostException, ConnectionErrorException, PKeyFileError, \
-    AuthenticationException
+    AuthenticationException, Timeout
+from .pipeline import default_pipeline
+from .credentials import key_cache
+from ...known_hosts import open_known_hosts, ACCEPT_NEW, DEFAULT_KNOWN_HOSTS
+from .copy import LocalTree, DEFAULT_COPY_DEPTH, SFTP_CHUNK
+from ...output import CommandResult, CopyStats
+from fpslib.inputbuffer import InputBuffer
+from ssh2.sftp import LIBSSH2_FXF_CREAT, LIBSSH2_FXF_TRUNC, LIBSSH2_FXF_WRITE
+from ssh2.exceptions import SFTPProtocolError
 from ssh2.error_codes import LIBSSH2_ERROR_EAGAIN
 from socket import gaierror as sock_gaierror, error as sock_error
 
-THREAD_POOL = get_hub().threadpool
+DEFAULT_PKEY = '~/.ssh/id_rsa'
+# 每次从 channel 读取的最大字节数
+READ_SIZE = 1 << 15
+# libssh2 主机密钥类型对应 known_hosts 里的名字
+HOST_KEY_TYPES = {
+    LIBSSH2_HOSTKEY_TYPE_RSA: "ssh-rsa",
+    LIBSSH2_HOSTKEY_TYPE_DSS: "ssh-dss",
+    LIBSSH2_HOSTKEY_TYPE_ECDSA_256: "ecdsa-sha2-nistp256",
+    LIBSSH2_HOSTKEY_TYPE_ECDSA_384: "ecdsa-sha2-nistp384",
+    LIBSSH2_HOSTKEY_TYPE_ECDSA_521: "ecdsa-sha2-nistp521",
+    LIBSSH2_HOSTKEY_TYPE_ED25519: "ssh-ed25519",
+}
+# 一个会话上同时打开的 channel 数，OpenSSH 默认 MaxSessions 是 10
+DEFAULT_MAX_CHANNELS = 10
 
 
 class SSHClient:
-    def __init__(self, host, user, password, port=22):
+    def __init__(self, host, user, password, port=22, pkey=DEFAULT_PKEY, timeout=None,
+                 keepalive_seconds=60, pipeline=None, known_hosts=DEFAULT_KNOWN_HOSTS,
+                 host_key_policy=ACCEPT_NEW, allow_agent=False, passphrase=""):
         self.session = None
         self.sock = None
-        pkey = os.path.expanduser('~/.ssh/id_rsa')
-        self.pkey = pkey
+        self._sftp = None
+        # execute() 返回的还没读完的输出，SessionPool 据此判断会话是不是在用
+        self._outputs = weakref.WeakSet()
+        self.pkey = os.path.expanduser(pkey)
         self.host = host
         self.port = port
         self.user = user
         self.password = password
-        self.keepalive_seconds = 60
+        # 等待 socket 可读写的超时，None 表示一直等
+        self.timeout = timeout
+        self.keepalive_seconds = keepalive_seconds
+        # known_hosts 是路径或者共享的 KnownHosts，host_key_policy=NO_CHECK 时不检查主机密钥；
+        # 传的是路径时新主机的密钥在 disconnect 时写回，共享的由 ParallelSSHClient 写回
+        self._owns_known_hosts = isinstance(known_hosts, str)
+        self.known_hosts = open_known_hosts(known_hosts, host_key_policy)
+        self.host_key_policy = host_key_policy
+        self.allow_agent = allow_agent
+        self.passphrase = passphrase
+        # 建连的各个阶段在 pipeline 里限流，handshake/auth 放到线程池
+        self.pipeline = pipeline or default_pipeline()
         self._connect(self.host, self.port)
         self._init()
 
-        _auth_thread_pool = True
-
     def __del__(self):
         self.disconnect()
 
-    def __exit__(self):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
         self.disconnect()
 
-    def _connect(self, host, port, retries=1):
-        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    def _connect(self, host, port):
         try:
-            self.sock.connect((host, port))
+            self.sock = self.pipeline.connect(host, port, self.timeout)
         except sock_gaierror as ex:
             raise UnknownHostException(ex)
-
+        except socket.timeout as ex:
+            raise Timeout(ex)
         except sock_error as ex:
             raise ConnectionErrorException(ex)
 
     def _init(self):
         self.session = Session()
-        self.session.handshake(self.sock)
-        self.auth()
+        self.pipeline.handshake(self.session, self.sock, self.timeout)
+        self._check_host_key()
+        self.pipeline.auth(self.session, self.auth, timeout=self.timeout)
+        # 之后都是非阻塞模式，libssh2 返回 EAGAIN 时在 gevent 里等 socket，不会阻塞整个 hub
+        if self.keepalive_seconds:
+            self.session.keepalive_config(False, self.keepalive_seconds)
+
+    def _check_host_key(self):
+        if self.known_hosts is None:
+            return
+        key, key_type = self.session.hostkey()
+        self.known_hosts.check(self.host, self.port, HOST_KEY_TYPES.get(key_type, "unknown"),
+                               key, self.host_key_policy)
+
+    def keepalive(self):
+        """发送 keepalive，返回距离下次需要发送的秒数"""
+        return self._eagain(self.session.keepalive_send)
+
+    def _eagain(self, func, *args, **kwargs):
+        """调用 libssh2 函数，返回 EAGAIN 就等 socket 就绪后重试"""
+        ret = func(*args, **kwargs)
+        while ret == LIBSSH2_ERROR_EAGAIN:
+            self._wait_select()
+            ret = func(*args, **kwargs)
+        return ret
+
+    def _wait_select(self):
+        """按 libssh2 需要的方向等待 socket，让出给其他 greenlet"""
+        directions = self.session.block_directions()
+        if directions == 0:
+            return
+        fd = self.sock.fileno()
+        inbound = directions & LIBSSH2_SESSION_BLOCK_INBOUND
+        outbound = directions & LIBSSH2_SESSION_BLOCK_OUTBOUND
+        try:
+            if inbound and outbound:
+                wait_readwrite(fd, timeout=self.timeout)
+            elif inbound:
+                wait_read(fd, timeout=self.timeout)
+            else:
+                wait_write(fd, timeout=self.timeout)
+        except socket.timeout as ex:
+            raise Timeout(ex)
 
     def open_session(self):
         try:
-            chan = self.session.open_session()
+            chan = self._eagain(self.session.open_session)
         except Exception as ex:
             raise SessionError(ex)
 
         return chan
 
-    def run_command(self, command):
+    def execute(self, command, max_buffer=None):
+        """执行命令，返回可以流式读取 stdout/stderr 的 ChannelOutput"""
         channel = self.open_session()
-        channel.execute(command)
-        return self.read_output_buffer(channel.read), self.read_output_buffer(channel.read_stderr), self.host
+        self._eagain(channel.execute, command)
+        output = ChannelOutput(self, channel, max_buffer)
+        self._outputs.add(output)
+        return output
+
+    @property
+    def busy(self):
+        """还有命令的输出没有读完"""
+        return any(not output.done for output in self._outputs)
+
+    def run_command(self, command, encoding="utf-8", raw=False, max_buffer=None):
+        """
+        返回 (stdout, stderr, host)，stdout/stderr 是边收边产出的迭代器：
+        默认按行产出 str，raw=True 时产出原始 bytes 块。
+        """
+        output = self.execute(command, max_buffer)
+        if raw:
+            return output.chunks(STDOUT), output.chunks(STDERR), self.host
+        return output.lines(STDOUT, encoding), output.lines(STDERR, encoding), self.host
+
+    def run_commands(self, commands, max_channels=DEFAULT_MAX_CHANNELS, encoding="utf-8"):
+        """
+        在同一个会话上用多个 channel 并发执行 commands，最多同时开 max_channels 个，
+        每条命令结束就产出一个 CommandResult，顺序是结束的先后。
+
+        所有 channel 在当前 greenlet 里轮流读，都没有数据时才等 socket；
+        多个 greenlet 各等各的 channel，数据可能已经被别人从 socket 上读走，会一直等下去。
+        """
+        queued = deque(commands)
+        active = []
+        while queued or active:
+            while queued and len(active) < max_channels:
+                command = queued.popleft()
+                active.append((command, time.monotonic(), self.execute(command)))
+            progressed = False
+            for item in list(active):
+                command, start, output = item
+                if output.read_available():
+                    progressed = True
+                if output.done:
+                    active.remove(item)
+                    exit_code = output.close()
+                    yield CommandResult(self.host, command, exit_code,
+                                        output.drain(STDOUT).decode(encoding, "replace"),
+                                        output.drain(STDERR).decode(encoding, "replace"),
+                                        elapsed=time.monotonic() - start)
+            if active and not progressed:
+                self._wait_select()
+
+    def sftp(self):
+        """会话上的 SFTP channel，第一次用到时打开"""
+        if self._sftp is None:
+            try:
+                self._sftp = self._eagain(self.session.sftp_init)
+            except Exception as ex:
+                raise SessionError(ex)
+        return self._sftp
+
+    def mkdir(self, remote_dir, mode=0o755):
+        """目录已经存在不报错"""
+        try:
+            self._eagain(self.sftp().mkdir, remote_dir, mode)
+        except SFTPProtocolError:
+            # 不存在时 stat 会抛出真正的错误
+            self._eagain(self.sftp().stat, remote_dir)
+
+    def copy_file(self, source, remote_file, stats=None, depth=DEFAULT_COPY_DEPTH, mode=None,
+                  ranges=None):
+        """
+        把 source(本地路径或者共享的 InputBuffer)写到远端。
+
+        每次交给 libssh2 depth 个 SFTP 请求大小的数据，它会把这些写请求一起发出去，
+        不用每个请求等一次往返；返回值是已经确认的字节数，从那里接着写。
+        ranges 是 [(offset, length)] 时只重写这些区间，不截断远端文件。
+        """
+        if isinstance(source, str):
+            if mode is None:
+                mode = os.stat(source).st_mode & 0o777
+            source = InputBuffer.open(source)
+        view = source.view
+        if stats is None:
+            stats = CopyStats(self.host, len(view))
+        if stats.start is None:
+            stats.begin()
+        flags = LIBSSH2_FXF_WRITE | LIBSSH2_FXF_CREAT
+        if ranges is None:
+            flags |= LIBSSH2_FXF_TRUNC
+            ranges = [(0, len(view))]
+        handle = self._eagain(self.sftp().open, remote_file, flags,
+                              0o644 if mode is None else mode)
+        window = depth * SFTP_CHUNK
+        try:
+            for start, length in ranges:
+                handle.seek64(start)
+                end = min(start + length, len(view))
+                for offset in range(start, end, window):
+                    # ssh2-python 只接受 bytes，按窗口复制，源文件本身只映射一份
+                    buf = bytes(view[offset:min(offset + window, end)])
+                    while buf:
+                        rc, written = handle.write(buf)
+                        if written:
+                            stats.sent += written
+                            buf = buf[written:]
+                        if rc == LIBSSH2_ERROR_EAGAIN:
+                            self._wait_select()
+        finally:
+            self._eagain(handle.close)
+        stats.files += 1
+        return stats
+
+    def copy_tree(self, local_dir, remote_dir, stats=None, depth=DEFAULT_COPY_DEPTH, tree=None):
+        """复制整个目录，tree 是多台主机共用的 LocalTree"""
+        tree = tree or LocalTree(local_dir)
+        if stats is None:
+            stats = CopyStats(self.host, tree.total)
+        stats.begin()
+        files = iter(tree.files)
+        try:
+            for rel in tree.dirs:
+                self.mkdir(posixpath.join(remote_dir, rel) if rel else remote_dir)
+            for rel, path, mode in files:
+                try:
+                    self.copy_file(tree.source(path), posixpath.join(remote_dir, rel),
+                                   stats, depth, mode)
+                finally:
+                    tree.release(path)
+        finally:
+            # 中途失败也要让出没复制的文件，其他主机用完后才能解除映射
+            for _, path, _ in files:
+                tree.release(path)
+        return stats
 
     def auth(self):
-        #self._password_auth()
-        self.session.userauth_publickey_fromfile(self.user, self.pkey)
+        """
+        pipeline 在线程池里以阻塞模式调用。依次尝试私钥、ssh-agent、密码；
+        私钥从进程内缓存取，不会每个连接都读一次文件。
+        """
+        errors = []
+        if self.pkey and os.path.exists(self.pkey):
+            try:
+                self.session.userauth_publickey_frommemory(
+                    self.user, key_cache.get(self.pkey), self.passphrase)
+                return
+            except Exception as ex:
+                errors.append(ex)
+        if self.allow_agent:
+            try:
+                self.session.agent_auth(self.user)
+                return
+            except Exception as ex:
+                errors.append(ex)
+        if self.password is not None:
+            self._password_auth()
+            return
+        raise AuthenticationException(f"Authentication failed for {self.user}@{self.host}: "
+                                      f"{errors}")
 
     def _pkey_path(self, pkey):
         pkey = os.path.expanduser(pkey)
@@ -75,31 +312,130 @@ class SSHClient:
 
     def _password_auth(self):
         try:
-            self.session.userauth_password(self.user, self.password)
+            self._eagain(self.session.userauth_password, self.user, self.password)
         except Exception:
             raise AuthenticationException("Password authentication failed")
 
-    def read_output_buffer(self, func):
-        buffer = self._read_output(func)
-        for line in buffer:
-            yield line
+    def disconnect(self):
+        self._sftp = None
+        if self.session is not None:
+            try:
+                self._eagain(self.session.disconnect)
+            except Exception:
+                pass
+            self.session = None
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+        if self._owns_known_hosts and self.known_hosts is not None:
+            self.known_hosts.save()
+
 
-    def read_stderr(self, channel):
-        return self._read_output(channel.read_stderr)
+STDOUT = 0
+STDERR = 1
 
-    def read_stdout(self, channel):
-        return self._read_output(channel.read)
 
-    @staticmethod
-    def _read_output(func):
-        encoding = "utf-8"
-        buffer = []
-        size, data = func()
-        while size > 0:
-            buffer.append(data.decode(encoding))
-            size, data = func()
-        return buffer
+class ChannelOutput:
+    """
+    一个 channel 的 stdout/stderr。
 
-    def disconnect(self):
-        self.session.disconnect()
-        self.sock.close()
\ No newline at end of file
+    读任何一个流时两个流都会读，另一个流的数据先放进它自己的队列，
+    所以只读 stdout 也不会因为 stderr 把 channel 窗口占满而卡死。
+    max_buffer 限制另一个流排队的字节数，超过后不再读它，让 SSH 流控挡住远端；
+    这时需要同时消费两个流，或者用 interleaved()。
+    """
+
+    def __init__(self, client, channel, max_buffer=None):
+        self.client = client
+        self.channel = channel
+        self.max_buffer = max_buffer
+        self._read = {STDOUT: channel.read, STDERR: channel.read_stderr}
+        self.pending = {STDOUT: deque(), STDERR: deque()}
+        self.sizes = {STDOUT: 0, STDERR: 0}
+        self.eof = {STDOUT: False, STDERR: False}
+
+    @property
+    def done(self):
+        return self.eof[STDOUT] and self.eof[STDERR]
+
+    def read_available(self, want=None):
+        """
+        两个流各读一次，返回是否读到了数据或 EOF。
+        want 不为空时，另一个流排队超过 max_buffer 就先不读它。
+        """
+        progressed = False
+        for stream in (STDOUT, STDERR):
+            if self.eof[stream]:
+                continue
+            if want is not None and stream != want and self.max_buffer \
+                    and self.sizes[stream] >= self.max_buffer:
+                continue
+            size, data = self._read[stream](READ_SIZE)
+            if size > 0:
+                self.pending[stream].append(data)
+                self.sizes[stream] += size
+                progressed = True
+            elif size == 0:
+                self.eof[stream] = True
+                progressed = True
+            elif size != LIBSSH2_ERROR_EAGAIN:
+                raise SessionError(f"Error reading from channel: {size}")
+        return progressed
+
+    def _pump(self, want):
+        """读到 want 流有数据或者结束为止"""
+        while not self.pending[want] and not self.eof[want]:
+            if not self.read_available(want):
+                self.client._wait_select()
+
+    def drain(self, stream):
+        """取出已经收到的全部数据"""
+        data = b"".join(self.pending[stream])
+        self.pending[stream].clear()
+        self.sizes[stream] = 0
+        return data
+
+    def _pop(self, stream):
+        data = self.pending[stream].popleft()
+        self.sizes[stream] -= len(data)
+        return data
+
+    def chunks(self, stream):
+        """按收到的顺序产出原始 bytes"""
+        while True:
+            self._pump(stream)
+            if self.pending[stream]:
+                yield self._pop(stream)
+            elif self.eof[stream]:
+                return
+
+    def lines(self, stream, encoding="utf-8"):
+        """按行产出 str，保留换行符；跨块的多字节字符用增量解码器拼回来"""
+        decoder = codecs.getincrementaldecoder(encoding)("replace")
+        partial = ""
+        for data in self.chunks(stream):
+            *lines, partial = (partial + decoder.decode(data)).split("\n")
+            for line in lines:
+                yield line + "\n"
+        partial += decoder.decode(b"", final=True)
+        if partial:
+            yield partial
+
+    def interleaved(self):
+        """产出 (stream, bytes)，两个流谁先有数据先产出谁"""
+        while not (self.eof[STDOUT] and self.eof[STDERR]) \
+                or self.pending[STDOUT] or self.pending[STDERR]:
+            for stream in (STDOUT, STDERR):
+                if self.pending[stream]:
+                    yield stream, self._pop(stream)
+            if not self.pending[STDOUT] and not self.pending[STDERR]:
+                want = STDERR if self.eof[STDOUT] else STDOUT
+                if self.eof[want]:
+                    return
+                self._pump(want)
+
+    def close(self):
+        """关闭 channel，返回退出码"""
+        self.client._eagain(self.channel.close)
+        self.client._eagain(self.channel.wait_closed)
+        return self.channel.get_exit_status()
@@ -23,3 +23,18 @@ class SessionError(Exception):
 class PKeyFileError(Exception):
     """Raised on errors finding private key file"""
     pass
+
+
+class Timeout(Exception):
+    """Raised on timeout waiting for the SSH socket"""
+    pass
+
+
+class ChecksumError(Exception):
+    """Raised when a copied file does not match the source checksums"""
+    pass
+
+
+class HostKeyError(Exception):
+    """Raised when a host key is unknown, changed or revoked"""
+    pass
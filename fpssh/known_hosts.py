@@ -0,0 +1,177 @@
+import base64
+import fcntl
+import fnmatch
+import hashlib
+import hmac
+import os
+from collections import defaultdict
+
+from .exceptions import HostKeyError
+
+DEFAULT_KNOWN_HOSTS = "~/.ssh/known_hosts"
+
+# 主机密钥策略：strict 不认识的主机直接拒绝；accept-new 记下新主机，密钥变了才拒绝；
+# no 完全不检查，只能显式指定
+STRICT = "strict"
+ACCEPT_NEW = "accept-new"
+NO_CHECK = "no"
+
+
+class KnownHosts:
+    """
+    known_hosts 读一次，建成索引，每台主机检查密钥不再逐行扫描。
+
+    明文条目按主机名放进字典；哈希条目(|1|salt|hash)按 salt 分组，
+    OpenSSH 写的条目每条一个 salt，查一个主机要对每个 salt 算一次 HMAC，
+    所以哈希条目的匹配结果按主机名缓存，知道主机列表时用 preload() 一次算完。
+    带通配符的条目很少，按行匹配。
+    新主机的密钥先放在内存里，save() 时一次追加到文件，每条一个新的 salt。
+    """
+
+    def __init__(self, path=DEFAULT_KNOWN_HOSTS, hash_hosts=False):
+        self.path = os.path.expanduser(path)
+        self.hash_hosts = hash_hosts
+        # 主机名 -> {密钥类型: 公钥}
+        self.plain = defaultdict(dict)
+        # salt -> {hmac: {密钥类型: 公钥}}
+        self.hashed = defaultdict(lambda: defaultdict(dict))
+        # (模式列表, 密钥类型, 公钥)
+        self.patterns = []
+        self.revoked = set()
+        self.pending = []
+        # 主机名 -> 哈希条目里匹配到的 {密钥类型: 公钥}
+        self._hashed_keys = {}
+        self.load()
+
+    @staticmethod
+    def host_name(host, port=None):
+        """非 22 端口的条目写成 [host]:port"""
+        if port in (None, 22, "22"):
+            return host
+        return f"[{host}]:{port}"
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                for line in f:
+                    self._parse(line)
+        except FileNotFoundError:
+            pass
+
+    def _parse(self, line):
+        fields = line.split()
+        if not fields or fields[0].startswith("#"):
+            return
+        marker = None
+        if fields[0].startswith("@"):
+            marker, fields = fields[0], fields[1:]
+        if len(fields) < 3:
+            return
+        hosts, key_type, key = fields[0], fields[1], fields[2]
+        try:
+            key = base64.b64decode(key)
+        except ValueError:
+            return
+        if marker == "@revoked":
+            self.revoked.add(key)
+            return
+        if marker is not None:
+            # @cert-authority 不支持
+            return
+        if hosts.startswith("|1|"):
+            try:
+                salt, digest = (base64.b64decode(part) for part in hosts[3:].split("|"))
+            except ValueError:
+                return
+            self.hashed[salt][digest][key_type] = key
+            return
+        names = hosts.split(",")
+        if any(c in hosts for c in "*?!"):
+            self.patterns.append((names, key_type, key))
+            return
+        for name in names:
+            self.plain[name][key_type] = key
+
+    def preload(self, hosts):
+        """
+        hosts 是 (host, port) 列表，对哈希条目扫一遍，把这些主机的匹配结果一次算好，
+        之后 lookup() 不再算 HMAC。
+        """
+        names = {self.host_name(host, port) for host, port in hosts} - set(self._hashed_keys)
+        found = {name: {} for name in names}
+        encoded = [(name, name.encode()) for name in names]
+        for salt, entries in self.hashed.items():
+            for name, data in encoded:
+                digest = hmac.new(salt, data, hashlib.sha1).digest()
+                if digest in entries:
+                    found[name].update(entries[digest])
+        self._hashed_keys.update(found)
+
+    def lookup(self, host, port=None):
+        """返回 {密钥类型: 公钥}"""
+        name = self.host_name(host, port)
+        if name not in self._hashed_keys:
+            self.preload([(host, port)])
+        keys = dict(self.plain.get(name, ()))
+        keys.update(self._hashed_keys[name])
+        for names, key_type, key in self.patterns:
+            if _match(name, names):
+                keys.setdefault(key_type, key)
+        return keys
+
+    def check(self, host, port, key_type, key, policy=ACCEPT_NEW):
+        """密钥匹配直接返回；不认识的主机按 policy 处理；密钥不一致抛出 HostKeyError"""
+        if key in self.revoked:
+            raise HostKeyError(f"Host key for {host} is revoked")
+        known = self.lookup(host, port)
+        if key_type in known:
+            if known[key_type] == key:
+                return
+            raise HostKeyError(f"Host key for {host} has changed")
+        if policy == STRICT:
+            raise HostKeyError(f"No {key_type} host key is known for {host}")
+        self.add(host, port, key_type, key)
+
+    def add(self, host, port, key_type, key):
+        name = self.host_name(host, port)
+        self.plain[name][key_type] = key
+        if self.hash_hosts:
+            # 和 OpenSSH 一样每条一个 salt，相同主机名在文件里看不出关联
+            salt = os.urandom(20)
+            digest = hmac.new(salt, name.encode(), hashlib.sha1).digest()
+            name = "|1|%s|%s" % (base64.b64encode(salt).decode(),
+                                 base64.b64encode(digest).decode())
+        self.pending.append(f"{name} {key_type} {base64.b64encode(key).decode()}\n")
+
+    def save(self):
+        """把这次运行新认识的主机一次追加到文件"""
+        if not self.pending:
+            return
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, mode=0o700, exist_ok=True)
+        with open(self.path, "a") as f:
+            # 同时运行的多个进程不会把行写乱
+            fcntl.flock(f, fcntl.LOCK_EX)
+            f.writelines(self.pending)
+        self.pending = []
+
+
+def open_known_hosts(known_hosts, policy):
+    """known_hosts 是路径或者共享的 KnownHosts，policy 为 NO_CHECK 时返回 None"""
+    if policy == NO_CHECK:
+        return None
+    if isinstance(known_hosts, str):
+        return KnownHosts(known_hosts)
+    return known_hosts
+
+
+def _match(name, patterns):
+    matched = False
+    for pattern in patterns:
+        if pattern.startswith("!"):
+            if fnmatch.fnmatchcase(name, pattern[1:]):
+                return False
+        elif fnmatch.fnmatchcase(name, pattern):
+            matched = True
+    return matched
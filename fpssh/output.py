@@ -0,0 +1,52 @@
+import time
+from collections import namedtuple
+
+# 一条命令在一台主机上的结果，各个后端通用；连接失败时 exception 不为 None，输出为空。
+# connect_time 是建连(或者从会话池取连接)的秒数，elapsed 是命令开始到退出的秒数
+CommandResult = namedtuple("CommandResult", "host command exit_code stdout stderr exception "
+                                            "connect_time elapsed")
+CommandResult.__new__.__defaults__ = (None, None, None)
+
+
+class CopyStats:
+    """一台主机上文件复制的进度，复制过程中随时可以读"""
+
+    def __init__(self, host, total=0):
+        self.host = host
+        self.total = total
+        self.sent = 0
+        self.files = 0
+        self.start = None
+        self.end = None
+        self.exception = None
+        # relay 模式下从哪台主机转发过来，None 表示控制端直接发送
+        self.via = None
+        # 校验不一致后从控制端重发的块数
+        self.repaired = 0
+
+    def begin(self):
+        self.start = time.monotonic()
+
+    def finish(self, exception=None):
+        self.end = time.monotonic()
+        self.exception = exception
+
+    @property
+    def elapsed(self):
+        if self.start is None:
+            return 0.0
+        return (self.end or time.monotonic()) - self.start
+
+    @property
+    def progress(self):
+        return self.sent / self.total if self.total else 1.0
+
+    @property
+    def throughput(self):
+        """字节/秒"""
+        elapsed = self.elapsed
+        return self.sent / elapsed if elapsed else 0.0
+
+    def __repr__(self):
+        return (f"<CopyStats {self.host} {self.sent}/{self.total} "
+                f"{self.throughput / (1 << 20):.1f}MiB/s>")
@@ -12,6 +12,9 @@ setup(
         "ssh2-python",
         "gevent",
     ],
+    extras_require={
+        "test": ["paramiko"],
+    },
     packages=find_packages(),
     entry_points={
         "console_scripts": [
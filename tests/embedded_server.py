@@ -0,0 +1,224 @@
+"""
+测试用的进程内 SSH 服务器(paramiko)，在真实线程里运行，接受任何公钥/密码，
+exec 请求用本地 sh 执行，sftp 子系统直接读写本地文件系统。
+"""
+import os
+import socket
+import subprocess
+import tempfile
+import threading
+
+import paramiko
+
+_host_key = None
+
+
+def host_key():
+    global _host_key
+    if _host_key is None:
+        _host_key = paramiko.RSAKey.generate(2048)
+    return _host_key
+
+
+def make_user_key(directory=None):
+    """生成客户端私钥文件(PEM)，返回路径"""
+    directory = directory or tempfile.mkdtemp()
+    path = os.path.join(directory, "id_rsa")
+    paramiko.RSAKey.generate(2048).write_private_key_file(path)
+    return path
+
+
+class _Server(paramiko.ServerInterface):
+
+    def __init__(self, home=None):
+        self.commands = {}
+        # 命令的工作目录，sftp 相对路径也相对它
+        self.home = home
+
+    def get_allowed_auths(self, username):
+        return "publickey,password"
+
+    def check_auth_publickey(self, username, key):
+        return paramiko.AUTH_SUCCESSFUL
+
+    def check_auth_password(self, username, password):
+        return paramiko.AUTH_SUCCESSFUL
+
+    def check_channel_request(self, kind, chanid):
+        if kind == "session":
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+    def check_channel_exec_request(self, channel, command):
+        threading.Thread(target=_execute, args=(channel, command, self.home),
+                         daemon=True).start()
+        return True
+
+
+def _pump(src, write):
+    for data in iter(lambda: src.read1(1 << 15), b""):
+        write(data)
+
+
+def _execute(channel, command, cwd=None):
+    proc = subprocess.Popen(command.decode(), shell=True, cwd=cwd, stdin=subprocess.PIPE,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    threads = [threading.Thread(target=_pump, args=(proc.stdout, channel.sendall)),
+               threading.Thread(target=_pump, args=(proc.stderr, channel.sendall_stderr))]
+    for t in threads:
+        t.start()
+
+    def feed():
+        try:
+            for data in iter(lambda: channel.recv(1 << 15), b""):
+                proc.stdin.write(data)
+            proc.stdin.close()
+        except (OSError, EOFError):
+            pass
+
+    threading.Thread(target=feed, daemon=True).start()
+    for t in threads:
+        t.join()
+    channel.send_exit_status(proc.wait())
+    channel.shutdown_write()
+    channel.close()
+
+
+class _SFTPHandle(paramiko.SFTPHandle):
+
+    def stat(self):
+        try:
+            return paramiko.SFTPAttributes.from_stat(os.fstat(self.readfile.fileno()))
+        except OSError as ex:
+            return paramiko.SFTPServer.convert_errno(ex.errno)
+
+
+class _SFTPServer(paramiko.SFTPServerInterface):
+    """路径对应本地路径，相对路径相对 home"""
+
+    def __init__(self, server, *args, **kwargs):
+        super().__init__(server, *args, **kwargs)
+        self.home = server.home
+
+    def _local(self, path):
+        return os.path.join(self.home, path) if self.home else path
+
+    def canonicalize(self, path):
+        return self._local(path)
+
+    def _attrs(self, func, path):
+        try:
+            return paramiko.SFTPAttributes.from_stat(func(self._local(path)))
+        except OSError as ex:
+            return paramiko.SFTPServer.convert_errno(ex.errno)
+
+    def stat(self, path):
+        return self._attrs(os.stat, path)
+
+    def lstat(self, path):
+        return self._attrs(os.lstat, path)
+
+    def list_folder(self, path):
+        path = self._local(path)
+        try:
+            return [paramiko.SFTPAttributes.from_stat(os.lstat(os.path.join(path, name)), name)
+                    for name in os.listdir(path)]
+        except OSError as ex:
+            return paramiko.SFTPServer.convert_errno(ex.errno)
+
+    def open(self, path, flags, attr):
+        path = self._local(path)
+        try:
+            mode = attr.st_mode if attr.st_mode is not None else 0o666
+            fd = os.open(path, flags, mode & 0o7777)
+        except OSError as ex:
+            return paramiko.SFTPServer.convert_errno(ex.errno)
+        if flags & os.O_WRONLY:
+            fmode = "ab" if flags & os.O_APPEND else "wb"
+        elif flags & os.O_RDWR:
+            fmode = "a+b" if flags & os.O_APPEND else "r+b"
+        else:
+            fmode = "rb"
+        handle = _SFTPHandle(flags)
+        handle.filename = path
+        handle.readfile = handle.writefile = os.fdopen(fd, fmode)
+        return handle
+
+    def _call(self, func, *args):
+        try:
+            func(*args)
+        except OSError as ex:
+            return paramiko.SFTPServer.convert_errno(ex.errno)
+        return paramiko.SFTP_OK
+
+    def remove(self, path):
+        return self._call(os.remove, self._local(path))
+
+    def rename(self, oldpath, newpath):
+        return self._call(os.rename, self._local(oldpath), self._local(newpath))
+
+    def posix_rename(self, oldpath, newpath):
+        return self._call(os.replace, self._local(oldpath), self._local(newpath))
+
+    def mkdir(self, path, attr):
+        mode = attr.st_mode if attr.st_mode is not None else 0o777
+        return self._call(os.mkdir, self._local(path), mode & 0o7777)
+
+    def rmdir(self, path):
+        return self._call(os.rmdir, self._local(path))
+
+    def chattr(self, path, attr):
+        if attr.st_mode is not None:
+            return self._call(os.chmod, self._local(path), attr.st_mode & 0o7777)
+        return paramiko.SFTP_OK
+
+
+def _negotiate(transport, home):
+    try:
+        transport.start_server(server=_Server(home))
+    except (paramiko.SSHException, EOFError, OSError):
+        pass
+
+
+class EmbeddedServer:
+    """在 127.0.0.1 的随机端口上监听，start() 之后用 self.port 连接"""
+
+    def __init__(self, host="127.0.0.1", port=0, homes=None):
+        # homes 不为空时，每个本地地址(127.0.0.x)一个目录，模拟多台主机
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((host, port))
+        self.sock.listen(128)
+        self.host, self.port = self.sock.getsockname()
+        self.homes = homes
+        self.transports = []
+        self._thread = None
+        self._stopped = False
+
+    def start(self):
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+        self._thread.start()
+        return self
+
+    def _serve(self):
+        while not self._stopped:
+            try:
+                conn, _ = self.sock.accept()
+            except OSError:
+                return
+            transport = paramiko.Transport(conn)
+            transport.add_server_key(host_key())
+            transport.set_subsystem_handler("sftp", paramiko.SFTPServer, _SFTPServer)
+            self.transports.append(transport)
+            # start_server 会等到协商结束，放到单独线程里，握手之间不互相排队
+            home = None
+            if self.homes:
+                home = os.path.join(self.homes, conn.getsockname()[0])
+                os.makedirs(home, exist_ok=True)
+            threading.Thread(target=_negotiate, args=(transport, home), daemon=True).start()
+
+    def stop(self):
+        self._stopped = True
+        self.sock.close()
+        for transport in self.transports:
+            transport.close()
@@ -0,0 +1,52 @@
+import unittest
+
+from embedded_server import EmbeddedServer, make_user_key
+from fpssh.backends import BACKENDS, get_backend
+from fpssh.known_hosts import NO_CHECK
+
+SSH_OPTIONS = ("-o", "StrictHostKeyChecking=no", "-o", "UserKnownHostsFile=/dev/null",
+               "-o", "LogLevel=ERROR")
+
+
+class BackendTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = EmbeddedServer().start()
+        cls.pkey = make_user_key()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+
+    def make(self, name, hosts=("127.0.0.1", "localhost"), port=None):
+        return get_backend(name)(list(hosts), "foo", "foo", port or self.server.port,
+                                 pkey=self.pkey, timeout=10, ssh_options=SSH_OPTIONS,
+                                 host_key_policy=NO_CHECK)
+
+    def test_same_results(self):
+        for name in BACKENDS:
+            with self.subTest(backend=name), self.make(name) as backend:
+                results = list(backend.run("echo foo; echo bar >&2; exit 3"))
+                self.assertEqual({"127.0.0.1", "localhost"}, {r.host for r in results})
+                for result in results:
+                    self.assertIsNone(result.exception)
+                    self.assertEqual(3, result.exit_code)
+                    self.assertEqual("foo\n", result.stdout)
+                    self.assertEqual("bar\n", result.stderr)
+                    self.assertGreater(result.elapsed, 0)
+
+    def test_unreachable(self):
+        for name in ("native", "paramiko"):
+            with self.subTest(backend=name), self.make(name, ["127.0.0.1"], 1) as backend:
+                result, = backend.run("true")
+                self.assertIsNotNone(result.exception)
+                self.assertIsNone(result.exit_code)
+
+    def test_unknown_backend(self):
+        with self.assertRaises(ValueError):
+            get_backend("telnet")
+
+
+if "__main__" == __name__:
+    unittest.main(verbosity=2)
@@ -0,0 +1,29 @@
+import os
+import subprocess
+import sys
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CLI = os.path.join(ROOT, "bin", "fpssh_cli.py")
+
+
+class StartupTest(unittest.TestCase):
+
+    def test_no_heavy_imports(self):
+        # 默认的 ssh 子进程路径不导入 native/paramiko 后端和只在某些选项下用到的模块
+        check = ("import runpy, sys; sys.argv = ['fpssh', '--help']\n"
+                 "try:\n"
+                 "    runpy.run_path(%r, run_name='__main__')\n"
+                 "except SystemExit:\n"
+                 "    pass\n"
+                 "sys.stderr.write(' '.join(sys.modules))" % CLI)
+        modules = subprocess.run([sys.executable, "-c", check], stdout=subprocess.DEVNULL,
+                                 stderr=subprocess.PIPE, env=dict(os.environ, PYTHONPATH=ROOT),
+                                 check=True).stderr.decode().split()
+        for name in ("gevent", "ssh2.session", "paramiko", "sqlite3",
+                     "concurrent.futures", "fpslib.askpass_server"):
+            self.assertNotIn(name, modules)
+
+
+if "__main__" == __name__:
+    unittest.main(verbosity=2)
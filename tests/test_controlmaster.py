@@ -0,0 +1,77 @@
+import os
+import tempfile
+import unittest
+
+from fpslib.controlmaster import ControlMasterCache
+
+
+def hosts(*names):
+    return [(name, None, "root", {}) for name in names]
+
+
+class ControlMasterCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = os.path.join(tempfile.mkdtemp(), "cm")
+        self.closed = []
+
+    def make_cache(self, max_masters=10):
+        cache = ControlMasterCache(self.dir, persist=60, max_masters=max_masters)
+        # 不真的去执行 ssh -O exit
+        cache.close = self.close(cache)
+        return cache
+
+    def close(self, cache):
+        def close(keys):
+            self.closed.extend(keys)
+            for key in keys:
+                del cache.index[key]
+        return close
+
+    def touch_sockets(self, cache):
+        for entry in cache.index.values():
+            open(entry["path"], "w").close()
+
+    def test_private_dir(self):
+        self.make_cache()
+        self.assertEqual(0o700, os.stat(self.dir).st_mode & 0o777)
+
+    def test_ssh_options(self):
+        with self.make_cache() as cache:
+            allowed = cache.reserve(hosts("web1"))
+        opts = cache.ssh_options("root", "web1", None, allowed)
+        self.assertIn("ControlMaster=auto", opts)
+        self.assertIn("ControlPersist=60", opts)
+        self.assertIn("ControlPath=" + cache.socket_path("root", "web1", "22"), opts)
+        self.assertIn("ControlMaster=no", cache.ssh_options("root", "web2", None, allowed))
+
+    def test_reuse_across_runs(self):
+        with self.make_cache() as cache:
+            cache.reserve(hosts("web1", "web2"))
+            self.touch_sockets(cache)
+        with self.make_cache() as cache:
+            self.assertEqual({"root@web1:22", "root@web2:22"}, set(cache.index))
+            os.remove(cache.index["root@web1:22"]["path"])
+        # master 空闲退出后 socket 消失，条目被清掉
+        with self.make_cache() as cache:
+            self.assertEqual({"root@web2:22"}, set(cache.index))
+
+    def test_evict_lru(self):
+        with self.make_cache(max_masters=2) as cache:
+            cache.reserve(hosts("old"))
+            cache.index["root@old:22"]["last_used"] -= 100
+            cache.reserve(hosts("recent"))
+            allowed = cache.reserve(hosts("new"))
+        self.assertEqual(["root@old:22"], self.closed)
+        self.assertEqual({"root@new:22"}, allowed)
+        self.assertEqual({"root@recent:22", "root@new:22"}, set(cache.index))
+
+    def test_over_cap_connects_directly(self):
+        with self.make_cache(max_masters=2) as cache:
+            allowed = cache.reserve(hosts("a", "b", "c"))
+        self.assertEqual({"root@a:22", "root@b:22"}, allowed)
+        self.assertEqual([], self.closed)
+
+
+if "__main__" == __name__:
+    unittest.main(verbosity=2)
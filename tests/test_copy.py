@@ -0,0 +1,120 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from embedded_server import EmbeddedServer, make_user_key
+from fpssh.clients.native.copy import LocalTree
+from fpssh.clients.native.parallel import ParallelSSHClient
+from fpssh.clients.native.single import SSHClient
+from fpssh.known_hosts import NO_CHECK
+
+
+class CopyTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = EmbeddedServer().start()
+        cls.pkey = make_user_key()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.data = os.urandom(1 << 20) + b"tail"
+        self.source = os.path.join(self.tmp, "source")
+        with open(self.source, "wb") as f:
+            f.write(self.data)
+        os.chmod(self.source, 0o640)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def read(self, *parts):
+        with open(os.path.join(self.tmp, *parts), "rb") as f:
+            return f.read()
+
+    def test_copy_file(self):
+        client = SSHClient("127.0.0.1", "foo", "foo", self.server.port, pkey=self.pkey,
+                           host_key_policy=NO_CHECK)
+        try:
+            # 比一个窗口小的 depth，走多轮写
+            stats = client.copy_file(self.source, os.path.join(self.tmp, "dest"), depth=4)
+        finally:
+            client.disconnect()
+        self.assertEqual(self.data, self.read("dest"))
+        self.assertEqual(0o640, os.stat(os.path.join(self.tmp, "dest")).st_mode & 0o777)
+        self.assertEqual(len(self.data), stats.sent)
+        self.assertEqual(1.0, stats.progress)
+
+    def test_parallel_copy_file(self):
+        hosts = ["127.0.0.1", "localhost"]
+        client = ParallelSSHClient(hosts, "foo", "foo", self.server.port, pkey=self.pkey,
+                                   host_key_policy=NO_CHECK)
+        try:
+            # 两台"主机"其实是同一台，写到同一个文件
+            stats = client.copy_file(self.source, os.path.join(self.tmp, "dest"))
+        finally:
+            client.disconnect()
+        self.assertEqual(set(hosts), set(stats))
+        for host_stats in stats.values():
+            self.assertIsNone(host_stats.exception)
+            self.assertEqual(len(self.data), host_stats.sent)
+            self.assertGreater(host_stats.throughput, 0)
+        self.assertEqual(self.data, self.read("dest"))
+
+    def test_copy_tree(self):
+        src = os.path.join(self.tmp, "tree")
+        os.makedirs(os.path.join(src, "a", "b"))
+        os.makedirs(os.path.join(src, "empty"))
+        files = {"top": b"1", os.path.join("a", "mid"): b"22",
+                 os.path.join("a", "b", "leaf"): self.data, "zero": b""}
+        for name, data in files.items():
+            with open(os.path.join(src, name), "wb") as f:
+                f.write(data)
+        client = ParallelSSHClient(["127.0.0.1"], "foo", "foo", self.server.port,
+                                   pkey=self.pkey, host_key_policy=NO_CHECK)
+        try:
+            stats = client.copy_tree(src, os.path.join(self.tmp, "dest"))
+        finally:
+            client.disconnect()
+        host_stats = stats["127.0.0.1"]
+        self.assertIsNone(host_stats.exception)
+        self.assertEqual(len(files), host_stats.files)
+        for name, data in files.items():
+            self.assertEqual(data, self.read("dest", name))
+        self.assertTrue(os.path.isdir(os.path.join(self.tmp, "dest", "empty")))
+
+    def test_copy_unreachable(self):
+        client = ParallelSSHClient(["127.0.0.1"], "foo", "foo", 1, pkey=self.pkey,
+                                   host_key_policy=NO_CHECK)
+        stats = client.copy_file(self.source, os.path.join(self.tmp, "dest"))
+        self.assertIsNotNone(stats["127.0.0.1"].exception)
+        self.assertFalse(os.path.exists(os.path.join(self.tmp, "dest")))
+
+
+class LocalTreeTest(unittest.TestCase):
+
+    def test_release(self):
+        tmp = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmp, "f")
+            with open(path, "wb") as f:
+                f.write(b"data")
+            tree = LocalTree(tmp, users=2)
+            self.assertEqual([("f", path, os.stat(path).st_mode & 0o777)], tree.files)
+            self.assertEqual(4, tree.total)
+            first = tree.source(path)
+            self.assertIs(first, tree.source(path))
+            tree.release(path)
+            self.assertIs(first, tree.source(path))
+            tree.release(path)
+            self.assertIsNot(first, tree.source(path))
+        finally:
+            shutil.rmtree(tmp)
+
+
+if "__main__" == __name__:
+    unittest.main(verbosity=2)
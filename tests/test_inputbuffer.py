@@ -0,0 +1,36 @@
+import os
+import tempfile
+import unittest
+
+from fpslib.inputbuffer import InputBuffer
+
+
+class InputBufferTest(unittest.TestCase):
+
+    def test_regular_file(self):
+        with tempfile.NamedTemporaryFile() as f:
+            f.write(b"foobar")
+            f.flush()
+            buffer = InputBuffer.open(f.name)
+            self.assertEqual(6, len(buffer))
+            self.assertIsNotNone(buffer.fd)
+            self.assertEqual(b"bar", bytes(buffer.view[3:]))
+
+    def test_pipe(self):
+        r, w = os.pipe()
+        os.write(w, b"piped data")
+        os.close(w)
+        with os.fdopen(r, "rb") as f:
+            buffer = InputBuffer.from_file(f)
+        self.assertEqual(b"piped data", bytes(buffer.view))
+        self.assertEqual(b"piped", os.pread(buffer.fd, 5, 0))
+
+    def test_empty(self):
+        with tempfile.TemporaryFile() as f:
+            buffer = InputBuffer.from_file(f)
+        self.assertEqual(0, len(buffer))
+        self.assertIsNone(buffer.fd)
+
+
+if "__main__" == __name__:
+    unittest.main(verbosity=2)
@@ -0,0 +1,62 @@
+import os
+import tempfile
+import unittest
+
+from fpslib.inventory import Inventory, parse_select
+
+
+class InventoryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "hosts")
+        self.write_hosts(
+            "# fleet\n"
+            "db1 role=db dc=fra\n"
+            "bob@db2:2222 role=db dc=ams timeout=30\n"
+            "web[1-3] role=web dc=fra\n"
+            "lb1\n")
+
+    def write_hosts(self, content):
+        with open(self.path, "w") as f:
+            f.write(content)
+
+    def make_inventory(self):
+        return Inventory([self.path], os.path.join(self.dir, "index"))
+
+    def test_select(self):
+        inventory = self.make_inventory()
+        self.assertEqual(["db1", "db2", "web1", "web2", "web3", "lb1"],
+                         [h[0] for h in inventory.hosts()])
+        self.assertEqual([("db1", None, "root", {"role": "db", "dc": "fra"})],
+                         list(inventory.hosts("role=db,dc=fra", default_user="root")))
+        self.assertEqual([("db2", "2222", "bob", {"role": "db", "dc": "ams",
+                                                 "timeout": "30"})],
+                         list(inventory.hosts("dc=ams")))
+        self.assertEqual(["db1", "web1", "web2", "web3"],
+                         [h[0] for h in inventory.hosts("dc=fra|nyc")])
+        self.assertEqual(["web1", "web3"],
+                         [h[0] for h in inventory.hosts("dc=fra", "web*,!web2")])
+        self.assertEqual([], list(inventory.hosts("role=db,dc=nyc")))
+
+    def test_rebuild_on_change(self):
+        inventory = self.make_inventory()
+        self.assertEqual(2, len(list(inventory.hosts("role=db"))))
+        built = os.stat(inventory.index_path).st_mtime_ns
+        # 没变不重建
+        self.assertEqual(2, len(list(self.make_inventory().hosts("role=db"))))
+        self.assertEqual(built, os.stat(inventory.index_path).st_mtime_ns)
+
+        self.write_hosts("db9 role=db\n")
+        self.assertEqual(["db9"], [h[0] for h in inventory.hosts("role=db")])
+
+    def test_errors(self):
+        for bad in ("role", "role=", "=db", "role=db,"):
+            with self.assertRaises(ValueError):
+                parse_select(bad)
+        with self.assertRaises(IOError):
+            Inventory([self.path + ".missing"], self.dir).hosts()
+
+
+if "__main__" == __name__:
+    unittest.main(verbosity=2)
@@ -0,0 +1,83 @@
+import os
+import select
+import socket
+import unittest
+
+from fpslib.manager import IOMap, PollIOMap, EpollIOMap, make_iomap
+
+
+class IOMapTest(unittest.TestCase):
+    iomap_cls = IOMap
+
+    def setUp(self):
+        self.iomap = self.iomap_cls()
+        self.events = []
+
+    def handler(self, fd, iomap):
+        data = os.read(fd, 1024)
+        self.events.append((fd, data))
+        if not data:
+            iomap.unregister(fd)
+
+    def test_read(self):
+        r, w = os.pipe()
+        self.iomap.register_read(r, self.handler)
+        os.write(w, b"foo")
+        self.iomap.poll(1)
+        self.assertEqual([(r, b"foo")], self.events)
+        os.close(w)
+        self.iomap.poll(1)
+        self.assertEqual((r, b""), self.events[-1])
+        self.assertNotIn(r, self.iomap.readmap)
+        os.close(r)
+
+    def test_write_hup(self):
+        r, w = os.pipe()
+        written = []
+
+        def write_handler(fd, iomap):
+            try:
+                written.append(os.write(fd, b"x"))
+            except BrokenPipeError:
+                iomap.unregister(fd)
+
+        self.iomap.register_write(w, write_handler)
+        os.close(r)
+        self.iomap.poll(1)
+        self.assertNotIn(w, self.iomap.writemap)
+        self.assertEqual([], written)
+        os.close(w)
+
+
+class PollIOMapTest(IOMapTest):
+    iomap_cls = PollIOMap
+
+
+@unittest.skipUnless(hasattr(select, "epoll"), "epoll not available")
+class EpollIOMapTest(IOMapTest):
+    iomap_cls = EpollIOMap
+
+    def test_read_write_same_fd(self):
+        s1, s2 = socket.socketpair()
+        fd = s1.fileno()
+        written = []
+
+        def write_handler(fd, iomap):
+            written.append(os.write(fd, b"x"))
+            iomap.unregister(fd)
+
+        self.iomap.register_read(fd, self.handler)
+        self.iomap.register_write(fd, write_handler)
+        s2.send(b"bar")
+        self.iomap.poll(1)
+        self.assertEqual([(fd, b"bar")], self.events)
+        self.assertEqual([1], written)
+        s1.close()
+        s2.close()
+
+    def test_make_iomap(self):
+        self.assertIsInstance(make_iomap(), EpollIOMap)
+
+
+if "__main__" == __name__:
+    unittest.main(verbosity=2)
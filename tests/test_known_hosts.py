@@ -0,0 +1,197 @@
+import base64
+import hashlib
+import hmac
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from embedded_server import EmbeddedServer, make_user_key, host_key
+from fpssh.exceptions import HostKeyError
+from fpssh.known_hosts import KnownHosts, STRICT, NO_CHECK
+from fpssh.clients.miko.single import SSHClient as MikoSSHClient
+from fpssh.clients.native.credentials import KeyCache
+from fpssh.clients.native.parallel import ParallelSSHClient
+from fpssh.clients.native.single import SSHClient
+
+KEY_A = b"key-a"
+KEY_B = b"key-b"
+
+
+def b64(data):
+    return base64.b64encode(data).decode()
+
+
+def hashed(name, salt=b"s" * 20):
+    digest = hmac.new(salt, name.encode(), hashlib.sha1).digest()
+    return "|1|%s|%s" % (b64(salt), b64(digest))
+
+
+class KnownHostsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, "known_hosts")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def write(self, *lines):
+        with open(self.path, "w") as f:
+            f.write("\n".join(lines) + "\n")
+
+    def test_lookup(self):
+        self.write("# comment",
+                   "web1,10.0.0.1 ssh-rsa %s" % b64(KEY_A),
+                   "[web2]:2222 ssh-ed25519 %s" % b64(KEY_B),
+                   "%s ssh-rsa %s" % (hashed("db1"), b64(KEY_B)),
+                   "*.dc1,!bad.dc1 ssh-rsa %s" % b64(KEY_A),
+                   "@revoked old ssh-rsa %s" % b64(b"revoked"))
+        known = KnownHosts(self.path)
+        self.assertEqual({"ssh-rsa": KEY_A}, known.lookup("10.0.0.1"))
+        self.assertEqual({"ssh-ed25519": KEY_B}, known.lookup("web2", 2222))
+        self.assertEqual({}, known.lookup("web2"))
+        self.assertEqual({"ssh-rsa": KEY_B}, known.lookup("db1", 22))
+        self.assertEqual({"ssh-rsa": KEY_A}, known.lookup("x.dc1"))
+        self.assertEqual({}, known.lookup("bad.dc1"))
+        with self.assertRaises(HostKeyError):
+            known.check("anything", 22, "ssh-rsa", b"revoked")
+
+    def test_check(self):
+        self.write("web1 ssh-rsa %s" % b64(KEY_A))
+        known = KnownHosts(self.path)
+        known.check("web1", 22, "ssh-rsa", KEY_A)
+        with self.assertRaises(HostKeyError):
+            known.check("web1", 22, "ssh-rsa", KEY_B)
+        with self.assertRaises(HostKeyError):
+            known.check("web2", 22, "ssh-rsa", KEY_A, STRICT)
+        self.assertEqual([], known.pending)
+
+    def test_batched_write_back(self):
+        known = KnownHosts(self.path, hash_hosts=True)
+        known.check("new1", 22, "ssh-rsa", KEY_A)
+        known.check("new2", 2222, "ssh-rsa", KEY_B)
+        # 同一次运行里再遇到不重复记录
+        known.check("new1", 22, "ssh-rsa", KEY_A)
+        self.assertFalse(os.path.exists(self.path))
+        known.save()
+        with open(self.path) as f:
+            lines = f.read().splitlines()
+        self.assertEqual(2, len(lines))
+        # 每条一个 salt
+        self.assertEqual(2, len({line.split("|")[2] for line in lines}))
+        reloaded = KnownHosts(self.path)
+        self.assertEqual({"ssh-rsa": KEY_A}, reloaded.lookup("new1"))
+        self.assertEqual({"ssh-rsa": KEY_B}, reloaded.lookup("new2", 2222))
+        self.assertEqual(2, len(reloaded.hashed))
+
+    def test_hashed_lookup_memoized(self):
+        self.write(*("%s ssh-rsa %s" % (hashed(f"h{i}", salt=b"%020d" % i), b64(KEY_A))
+                     for i in range(50)))
+        known = KnownHosts(self.path)
+        calls = []
+        real_new = hmac.new
+
+        def counting_new(*args, **kwargs):
+            calls.append(1)
+            return real_new(*args, **kwargs)
+
+        with mock.patch("fpssh.known_hosts.hmac.new", counting_new):
+            known.preload([("h1", 22), ("h7", None), ("missing", 22)])
+            self.assertEqual(150, len(calls))
+            self.assertEqual({"ssh-rsa": KEY_A}, known.lookup("h1"))
+            self.assertEqual({"ssh-rsa": KEY_A}, known.lookup("h7", 22))
+            self.assertEqual({}, known.lookup("missing"))
+            # preload 过的主机不再算 HMAC，没 preload 的第一次查时算一遍
+            self.assertEqual(150, len(calls))
+            self.assertEqual({"ssh-rsa": KEY_A}, known.lookup("h9"))
+            known.lookup("h9")
+            self.assertEqual(200, len(calls))
+
+
+class KeyCacheTest(unittest.TestCase):
+
+    def test_read_once(self):
+        tmp = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmp, "id")
+            with open(path, "wb") as f:
+                f.write(b"first")
+            cache = KeyCache()
+            self.assertEqual(b"first", cache.get(path))
+            with open(path, "wb") as f:
+                f.write(b"second")
+            self.assertEqual(b"first", cache.get(path))
+        finally:
+            shutil.rmtree(tmp)
+
+
+class HostKeyVerificationTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = EmbeddedServer().start()
+        cls.pkey = make_user_key()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, "known_hosts")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_accept_new_then_verify(self):
+        client = ParallelSSHClient(["127.0.0.1", "localhost"], "foo", "foo", self.server.port,
+                                   pkey=self.pkey, known_hosts=self.path)
+        try:
+            for stdout, _ in client.run_command("echo foo").values():
+                self.assertEqual(["foo\n"], list(stdout))
+        finally:
+            client.disconnect()
+        known = KnownHosts(self.path)
+        server_key = host_key().asbytes()
+        self.assertEqual({"ssh-rsa": server_key}, known.lookup("127.0.0.1", self.server.port))
+        self.assertEqual({"ssh-rsa": server_key}, known.lookup("localhost", self.server.port))
+        # 已经认识了，strict 也能连
+        SSHClient("127.0.0.1", "foo", "foo", self.server.port, pkey=self.pkey,
+                  known_hosts=known, host_key_policy=STRICT).disconnect()
+
+    def test_default_known_hosts(self):
+        # 不传 known_hosts 时检查 ~/.ssh/known_hosts，新主机断开时写回
+        with mock.patch.dict(os.environ, HOME=self.tmp):
+            SSHClient("127.0.0.1", "foo", "foo", self.server.port,
+                      pkey=self.pkey).disconnect()
+        known = KnownHosts(os.path.join(self.tmp, ".ssh", "known_hosts"))
+        self.assertEqual({"ssh-rsa": host_key().asbytes()},
+                         known.lookup("127.0.0.1", self.server.port))
+
+    def test_changed_key(self):
+        name = KnownHosts.host_name("127.0.0.1", self.server.port)
+        with open(self.path, "w") as f:
+            f.write("%s ssh-rsa %s\n" % (name, b64(KEY_A)))
+        for client_cls in (SSHClient, MikoSSHClient):
+            with self.subTest(client=client_cls.__module__), \
+                    self.assertRaises(HostKeyError):
+                client_cls("127.0.0.1", "foo", "foo", self.server.port, pkey=self.pkey,
+                           known_hosts=self.path)
+        # 关掉检查要显式指定
+        SSHClient("127.0.0.1", "foo", "foo", self.server.port, pkey=self.pkey,
+                  known_hosts=self.path, host_key_policy=NO_CHECK).disconnect()
+
+    def test_paramiko_accept_new(self):
+        client = MikoSSHClient("127.0.0.1", "foo", "foo", self.server.port, pkey=self.pkey,
+                               known_hosts=self.path)
+        client.disconnect()
+        self.assertEqual({"ssh-rsa": host_key().asbytes()},
+                         KnownHosts(self.path).lookup("127.0.0.1", self.server.port))
+        MikoSSHClient("127.0.0.1", "foo", "foo", self.server.port, pkey=self.pkey,
+                      known_hosts=self.path, host_key_policy=STRICT).disconnect()
+
+
+if "__main__" == __name__:
+    unittest.main(verbosity=2)
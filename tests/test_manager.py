@@ -0,0 +1,319 @@
+import asyncio
+import contextlib
+import hashlib
+import io
+import os
+import signal
+import tempfile
+import threading
+import time
+import unittest
+from types import SimpleNamespace
+
+from fpslib.aiomanager import AsyncManager
+from fpslib.inputbuffer import InputBuffer
+from fpslib.manager import Manager, Writer
+from fpslib.task import Task
+
+
+def make_opts(**kwargs):
+    opts = dict(par=4, timeout=0, outdir=None, errdir=None, verbose=False,
+                user=None, inline=False, inline_stdout=False, print_out=False)
+    opts.update(kwargs)
+    return SimpleNamespace(**opts)
+
+
+def sh_task(host, script, opts, stdin=None, host_opts=None):
+    return Task(host, None, None, ["sh", "-c", script], opts, stdin, host_opts)
+
+
+@contextlib.contextmanager
+def captured_stdout():
+    """Task.report 写的是 sys.stdout.buffer"""
+    out = io.TextIOWrapper(io.BytesIO())
+    with contextlib.redirect_stdout(out):
+        yield out.buffer
+    out.flush()
+    out.detach()
+
+
+class ManagerTest(unittest.TestCase):
+    manager_cls = Manager
+
+    def run_manager(self, manager, scripts, opts):
+        for i, script in enumerate(scripts):
+            manager.add_task(sh_task(f"host{i}", script, opts))
+        return manager.run()
+
+    def test_exit_codes(self):
+        opts = make_opts()
+        manager = self.manager_cls(opts)
+        statuses = self.run_manager(manager, [f"exit {i}" for i in range(10)], opts)
+        self.assertEqual(list(range(10)), sorted(statuses))
+
+    def test_add_tasks(self):
+        opts = make_opts(par=1)
+        manager = self.manager_cls(opts)
+        started = []
+
+        def feed():
+            for i in range(5):
+                # 后面的 Task 还没产出时，前面的已经跑完了
+                started.append(len(manager.done))
+                yield sh_task(f"host{i}", f"exit {i}", opts)
+
+        manager.add_tasks(feed())
+        statuses = manager.run()
+        self.assertEqual(list(range(5)), sorted(statuses))
+        self.assertEqual(0, started[0])
+        self.assertGreater(started[-1], 0)
+        self.assertEqual(5, manager.node_count)
+
+    def test_batches(self):
+        opts = make_opts(batch_size=(2, False))
+        manager = self.manager_cls(opts)
+        started = []
+
+        def feed():
+            for i in range(5):
+                started.append(len(manager.done))
+                yield sh_task(f"host{i}", "sleep 0.05", opts)
+
+        manager.add_tasks(feed())
+        self.assertEqual([0] * 5, manager.run())
+        # 每一批都等上一批全部结束才开始
+        self.assertEqual([0, 0, 2, 2, 4], started)
+
+    def test_max_fail(self):
+        opts = make_opts(par=1, max_fail=(1, False))
+        manager = self.manager_cls(opts)
+        with contextlib.redirect_stderr(io.StringIO()) as err:
+            statuses = self.run_manager(manager, ["exit 1", "exit 2", "exit 0", "exit 0"],
+                                        opts)
+        self.assertEqual([1, 2, None, None], statuses)
+        self.assertEqual(["Canceled"], manager.done[-1].failures)
+        self.assertIn("Aborting: 2 hosts failed", err.getvalue())
+
+    def test_max_fail_in_feed(self):
+        # 和 --probe 一样，feed 里直接 fail_task 不可达的主机
+        opts = make_opts(par=1, max_fail=(0, False))
+        manager = self.manager_cls(opts)
+
+        def feed():
+            for i in range(4):
+                task = sh_task(f"host{i}", "exit 0", opts)
+                if i == 1:
+                    manager.fail_task(task, "Unreachable: refused")
+                    continue
+                yield task
+
+        manager.add_tasks(feed())
+        with contextlib.redirect_stderr(io.StringIO()), captured_stdout():
+            statuses = manager.run()
+        self.assertEqual([0, 255, None, None], statuses)
+        self.assertEqual(["Canceled"], manager.done[-1].failures)
+
+    def test_canary(self):
+        opts = make_opts(canary=(1, False), max_fail=(50, True))
+        manager = self.manager_cls(opts)
+        with contextlib.redirect_stderr(io.StringIO()):
+            statuses = self.run_manager(manager, ["exit 3", "exit 0", "exit 0"], opts)
+        self.assertEqual([3, None, None], statuses)
+
+        manager = self.manager_cls(opts)
+        statuses = self.run_manager(manager, ["exit 0", "exit 3", "exit 0"], opts)
+        self.assertEqual([0, 0, 3], sorted(statuses))
+
+    def test_abort_kill(self):
+        opts = make_opts(par=2, max_fail=(0, False), abort_kill=True)
+        manager = self.manager_cls(opts)
+        start = time.time()
+        with contextlib.redirect_stderr(io.StringIO()):
+            statuses = self.run_manager(manager, ["exit 1", "sleep 5", "exit 0"], opts)
+        self.assertLess(time.time() - start, 3)
+        # 排队的先取消，被杀的随后回收
+        self.assertEqual([1, None, -9], statuses)
+        self.assertIn("Aborted", manager.done[2].failures)
+
+    def test_fail_task(self):
+        opts = make_opts()
+        manager = self.manager_cls(opts)
+        with captured_stdout() as out:
+            manager.fail_task(sh_task("dead", "exit 0", opts), "Unreachable: refused")
+            statuses = self.run_manager(manager, ["exit 0"], opts)
+        self.assertEqual([255, 0], statuses)
+        self.assertIn(b"[1]", out.getvalue())
+        self.assertIn(b"Unreachable: refused", out.getvalue())
+
+    def test_sigchld_fallback(self):
+        opts = make_opts()
+        manager = Manager(opts)
+        manager.reaper = None
+        statuses = self.run_manager(manager, ["echo foo", "exit 3"], opts)
+        self.assertEqual([0, 3], sorted(statuses))
+
+    def test_exit_before_output_drained(self):
+        opts = make_opts(inline=True)
+        manager = self.manager_cls(opts)
+        # 后台进程持有 stdout，父进程先退出
+        with captured_stdout() as out:
+            self.run_manager(manager, ["(sleep 0.2; echo late) & exit 0"], opts)
+        self.assertTrue(out.getvalue().endswith(b"late\n"))
+
+    def test_total_timeout(self):
+        opts = make_opts(timeout=0.3)
+        manager = self.manager_cls(opts)
+        statuses = self.run_manager(manager, ["sleep 5", "exit 0"], opts)
+        self.assertEqual([-9, 0], sorted(statuses))
+        timed_out = [t for t in manager.done if t.failures]
+        self.assertIn("Timed out", timed_out[0].failures)
+
+    def test_idle_timeout(self):
+        opts = make_opts(idle_timeout=0.4)
+        manager = self.manager_cls(opts)
+        chatty = "for i in 1 2 3 4 5 6; do echo $i; sleep 0.1; done"
+        statuses = self.run_manager(manager, [chatty, "echo a; sleep 5"], opts)
+        self.assertEqual([-9, 0], sorted(statuses))
+        idle = [t for t in manager.done if t.failures]
+        self.assertIn("Idle timeout", idle[0].failures)
+
+    def test_host_timeout_override(self):
+        opts = make_opts(timeout=10)
+        manager = self.manager_cls(opts)
+        manager.add_task(sh_task("slow", "sleep 5", opts, host_opts={"timeout": "0.2"}))
+        self.assertEqual([-9], manager.run())
+
+    def test_stdin(self):
+        opts = make_opts(inline=True)
+        manager = self.manager_cls(opts)
+        data = b"x" * (1 << 20)
+        manager.add_task(sh_task("host", "wc -c", opts, stdin=data))
+        manager.add_task(sh_task("deaf", "exit 0", opts, stdin=data))
+        with captured_stdout() as out:
+            self.assertEqual([0, 0], manager.run())
+        self.assertIn(b"%d\n" % len(data), out.getvalue())
+
+    def test_stdin_broken_pipe(self):
+        opts = make_opts(inline=True)
+        manager = self.manager_cls(opts)
+        # 远远超过管道缓冲区，远端不读就退出时一定会写到 EPIPE
+        manager.add_task(sh_task("deaf", "exit 0", opts, stdin=b"x" * (8 << 20)))
+        with captured_stdout():
+            self.assertEqual([0], manager.run())
+        failures = manager.done[0].failures
+        self.assertEqual(1, len(failures))
+        self.assertTrue(failures[0].startswith("Exception: "), failures)
+
+    def test_shared_input_file(self):
+        data = os.urandom(1 << 20)
+        with tempfile.TemporaryFile() as f:
+            f.write(data)
+            f.flush()
+            f.seek(0)
+            stdin = InputBuffer.from_file(f)
+            opts = make_opts(inline=True)
+            manager = self.manager_cls(opts)
+            for i in range(3):
+                manager.add_task(sh_task(f"host{i}", "md5sum", opts, stdin=stdin))
+            with captured_stdout() as out:
+                self.assertEqual([0, 0, 0], manager.run())
+        digest = hashlib.md5(data).hexdigest().encode()
+        self.assertEqual(3, out.getvalue().count(digest))
+
+    def test_outdir(self):
+        outdir = tempfile.mkdtemp()
+        errdir = tempfile.mkdtemp()
+        opts = make_opts(outdir=outdir, errdir=errdir)
+        manager = self.manager_cls(opts)
+        manager.add_task(sh_task("foo", "echo out; echo err >&2", opts))
+        manager.add_task(sh_task("bar", "true", opts))
+        self.assertEqual([0, 0], manager.run())
+        with open(os.path.join(outdir, "foo"), "rb") as f:
+            self.assertEqual(b"out\n", f.read())
+        with open(os.path.join(errdir, "foo"), "rb") as f:
+            self.assertEqual(b"err\n", f.read())
+        self.assertEqual(0, os.path.getsize(os.path.join(outdir, "bar")))
+
+    def test_interrupt_with_outdir(self):
+        opts = make_opts(outdir=tempfile.mkdtemp())
+        manager = self.manager_cls(opts)
+        timer = threading.Timer(0.3, os.kill, (os.getpid(), signal.SIGINT))
+        start = time.time()
+        timer.start()
+        with captured_stdout(), contextlib.redirect_stderr(io.StringIO()):
+            statuses = self.run_manager(manager, ["sleep 5", "sleep 5"], opts)
+        timer.join()
+        self.assertLess(time.time() - start, 3)
+        self.assertEqual(2, len(statuses))
+        self.assertIn("Interrupted", manager.done[0].failures)
+        # Writer 不是 daemon 线程，没退出的话进程结束不了
+        self.assertFalse([t for t in threading.enumerate() if isinstance(t, Writer)])
+
+    def test_inline_spill(self):
+        opts = make_opts(inline=True, max_host_buffer=1000)
+        manager = self.manager_cls(opts)
+        manager.add_task(sh_task("big", "head -c 100000 /dev/zero", opts))
+        manager.add_task(sh_task("small", "echo small", opts))
+        with captured_stdout() as out:
+            manager.run()
+        self.assertEqual(100000, out.getvalue().count(b"\0"))
+        self.assertIn(b"small\n", out.getvalue())
+        self.assertEqual(0, manager.budget.used)
+
+    def test_print_out(self):
+        opts = make_opts(print_out=True)
+        manager = self.manager_cls(opts)
+        manager.add_task(sh_task("foo", "printf 'a'; sleep 0.1; printf 'b\\nc'", opts))
+        with captured_stdout() as out:
+            manager.run()
+        lines = out.getvalue().splitlines()
+        self.assertEqual([b"foo: ab", b"foo: c"], lines[:2])
+
+    def test_print_out_same_host(self):
+        # 同一台主机的不同端口、不同用户，前缀要能区分开
+        opts = make_opts(print_out=True)
+        manager = self.manager_cls(opts)
+        for port, user, word in (("22", None, "a"), ("2222", None, "b"), ("22", "bob", "c")):
+            manager.add_task(Task("web", port, user, ["echo", word], opts))
+        with captured_stdout() as out:
+            manager.run()
+        lines = set(out.getvalue().splitlines())
+        self.assertLessEqual({b"web:22: a", b"web:2222: b", b"bob@web:22: c"}, lines)
+
+
+class AsyncManagerTest(ManagerTest):
+    manager_cls = AsyncManager
+
+    def test_run_async(self):
+        opts = make_opts(inline=True)
+        manager = AsyncManager(opts)
+        manager.add_task(sh_task("host", "echo foo", opts))
+        with captured_stdout() as out:
+            self.assertEqual([0], asyncio.run(manager.run_async()))
+        self.assertTrue(out.getvalue().endswith(b"foo\n"))
+
+
+class WriterTest(unittest.TestCase):
+
+    def test_lru_reopen(self):
+        outdir = tempfile.mkdtemp()
+        writer = Writer(outdir, None, max_open=2)
+        writer.start()
+        files = [writer.open_files(f"host{i}")[0] for i in range(5)]
+        for n in range(3):
+            for file in files:
+                writer.write(file, b"%d" % n)
+            # 让每一轮单独成为一批，被 LRU 关掉的文件要追加打开
+            time.sleep(0.05)
+        for file in files:
+            writer.close(file)
+        writer.signal_quit()
+        writer.join()
+        self.assertLessEqual(len(writer.files), 2)
+        for file in files:
+            with open(file, "rb") as f:
+                self.assertEqual(b"012", f.read())
+
+
+if "__main__" == __name__:
+    unittest.main(verbosity=2)
@@ -0,0 +1,82 @@
+import contextlib
+import io
+import unittest
+
+from fpslib.output import LinePrinter, MemoryBudget, OutputBuffer, MAX_LINE
+
+
+class OutputBufferTest(unittest.TestCase):
+
+    def test_memory(self):
+        buffer = OutputBuffer(max_memory=100)
+        buffer.append(b"foo")
+        buffer.append(b"bar")
+        self.assertIsNone(buffer.spill)
+        self.assertEqual(6, len(buffer))
+        self.assertEqual(b"foobar", buffer.getvalue())
+
+    def test_host_limit_spill(self):
+        buffer = OutputBuffer(max_memory=4)
+        buffer.append(b"foo")
+        buffer.append(b"bar")
+        buffer.append(b"baz")
+        self.assertIsNotNone(buffer.spill)
+        self.assertEqual([], buffer.chunks)
+        out = io.BytesIO()
+        buffer.write_to(out)
+        self.assertEqual(b"foobarbaz", out.getvalue())
+        buffer.close()
+        self.assertFalse(buffer)
+
+    def test_budget(self):
+        budget = MemoryBudget(5)
+        first = OutputBuffer(budget=budget)
+        second = OutputBuffer(budget=budget)
+        first.append(b"abcd")
+        second.append(b"efgh")
+        self.assertIsNone(first.spill)
+        self.assertIsNotNone(second.spill)
+        self.assertEqual(4, budget.used)
+        first.close()
+        self.assertEqual(0, budget.used)
+        self.assertEqual(b"efgh", second.getvalue())
+
+
+class LinePrinterTest(unittest.TestCase):
+
+    def flush(self, printer):
+        out = io.TextIOWrapper(io.BytesIO())
+        with contextlib.redirect_stdout(out):
+            printer.flush()
+        out.flush()
+        return out.detach().getvalue()
+
+    def test_reassemble(self):
+        printer = LinePrinter()
+        a, b = object(), object()
+        printer.feed(a, "a", b"one\ntw")
+        printer.feed(b, "b", b"x")
+        self.assertEqual(b"a: one\n", self.flush(printer))
+        printer.feed(a, "a", b"o\nthree")
+        printer.feed(b, "b", b"y\n")
+        printer.finish(a, "a")
+        self.assertEqual(b"a: two\nb: xy\na: three\n", self.flush(printer))
+        self.assertEqual(b"", self.flush(printer))
+
+    def test_long_line(self):
+        printer = LinePrinter()
+        task = object()
+        printer.feed(task, "h", b"x" * (MAX_LINE - 1))
+        printer.feed(task, "h", b"xx")
+        self.assertEqual(b"h: " + b"x" * (MAX_LINE + 1) + b"\n", self.flush(printer))
+
+    def test_colors(self):
+        printer = LinePrinter(colors=True)
+        printer.feed(object(), "h", b"line\n")
+        out = self.flush(printer)
+        self.assertTrue(out.startswith(b"\x1b["))
+        self.assertTrue(out.endswith(b"line\n"))
+
+
+if "__main__" == __name__:
+    unittest.main(verbosity=2)
@@ -1,19 +1,116 @@
+import time
 import unittest
+
+import gevent
+
+from embedded_server import EmbeddedServer, make_user_key
 from fpssh.clients.native.parallel import ParallelSSHClient
+from fpssh.known_hosts import NO_CHECK
 
 
 class ParallelSSHClientTest(unittest.TestCase):
 
+    @classmethod
+    def setUpClass(cls):
+        cls.server = EmbeddedServer().start()
+        cls.pkey = make_user_key()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+
     def setUp(self):
         self.fake_cmd = "echo foo"
         self.fake_res = "foo\n"
-        self.hosts = ["127.0.0.1", "127.0.0.1"]
-        self.port = 2222
+        self.hosts = ["127.0.0.1", "localhost"]
+        self.port = self.server.port
         self.user = "foo"
         self.password = "foo"
-        self.client = ParallelSSHClient()
+        self.client = ParallelSSHClient(self.hosts, self.user, self.password, self.port,
+                                        pkey=self.pkey, host_key_policy=NO_CHECK)
 
     def test_run_command(self):
         outputs = self.client.run_command(self.fake_cmd)
+        self.assertEqual(set(self.hosts), set(outputs))
         for host, output in outputs.items():
-            print(host, output[0])
\ No newline at end of file
+            self.assertEqual([self.fake_res], list(output[0]))
+
+    def test_concurrent(self):
+        start = time.time()
+        outputs = self.client.run_command("sleep 1; echo done")
+        for host, output in outputs.items():
+            self.assertEqual(["done\n"], list(output[0]))
+        self.assertLess(time.time() - start, 1.8)
+
+    def test_pool_size(self):
+        client = ParallelSSHClient(self.hosts, self.user, self.password, self.port,
+                                   pool_size=1, pkey=self.pkey, host_key_policy=NO_CHECK)
+        self.assertEqual(1, client.pool.size)
+
+    def test_session_reuse(self):
+        list(self.client.run_command(self.fake_cmd)["localhost"][0])
+        first = self.client.host_clients["localhost"]
+        outputs = self.client.run_command(self.fake_cmd)
+        self.assertEqual([self.fake_res], list(outputs["localhost"][0]))
+        self.assertIs(first, self.client.host_clients["localhost"])
+
+    def test_reconnect(self):
+        list(self.client.run_command(self.fake_cmd)["localhost"][0])
+        first = self.client.host_clients["localhost"]
+        # 模拟服务端断开连接
+        for transport in self.server.transports:
+            transport.close()
+        outputs = self.client.run_command(self.fake_cmd)
+        self.assertEqual([self.fake_res], list(outputs["localhost"][0]))
+        self.assertIsNot(first, self.client.host_clients["localhost"])
+
+    def test_idle_eviction(self):
+        client = ParallelSSHClient(["localhost"], self.user, self.password, self.port,
+                                   pkey=self.pkey, idle_ttl=0.2, host_key_policy=NO_CHECK)
+        list(client.run_command(self.fake_cmd)["localhost"][0])
+        self.assertEqual(1, len(client.sessions))
+        gevent.sleep(0.5)
+        self.assertEqual(0, len(client.sessions))
+
+    def test_long_command_outlives_idle_ttl(self):
+        client = ParallelSSHClient(["localhost"], self.user, self.password, self.port,
+                                   pkey=self.pkey, idle_ttl=0.2, host_key_policy=NO_CHECK)
+        self.addCleanup(client.disconnect)
+        result, = client.run_commands(["sleep 1; echo done"])
+        self.assertIsNone(result.exception)
+        self.assertEqual("done\n", result.stdout)
+        first = client.host_clients["localhost"]
+        # run_command 的输出边读边产出，读完之前会话也算在用
+        stdout, _ = client.run_command("sleep 1; echo done")["localhost"]
+        self.assertEqual(["done\n"], list(stdout))
+        self.assertIs(first, client.host_clients["localhost"])
+        # 用完之后照常按 idle_ttl 关闭
+        gevent.sleep(0.6)
+        self.assertEqual(0, len(client.sessions))
+
+    def test_run_commands(self):
+        commands = ["echo a", "echo b >&2; exit 1"]
+        results = list(self.client.run_commands(commands))
+        self.assertEqual(len(self.hosts) * len(commands), len(results))
+        by_key = {(r.host, r.command): r for r in results}
+        for host in self.hosts:
+            self.assertEqual("a\n", by_key[host, "echo a"].stdout)
+            self.assertEqual(0, by_key[host, "echo a"].exit_code)
+            self.assertEqual("b\n", by_key[host, commands[1]].stderr)
+            self.assertEqual(1, by_key[host, commands[1]].exit_code)
+
+    def test_run_commands_unreachable(self):
+        client = ParallelSSHClient(["127.0.0.1"], self.user, self.password, 1,
+                                   pkey=self.pkey, host_key_policy=NO_CHECK)
+        results = list(client.run_commands(["true", "true"]))
+        self.assertEqual(2, len(results))
+        for result in results:
+            self.assertIsNotNone(result.exception)
+            self.assertIsNone(result.exit_code)
+
+    def tearDown(self):
+        self.client.disconnect()
+
+
+if "__main__" == __name__:
+    unittest.main(verbosity=2)
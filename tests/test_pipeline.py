@@ -0,0 +1,79 @@
+import unittest
+
+import gevent
+
+from embedded_server import EmbeddedServer, make_user_key
+from fpssh.clients.native.parallel import ParallelSSHClient
+from fpssh.clients.native.pipeline import ConnectPipeline, Stage
+from fpssh.known_hosts import NO_CHECK
+
+
+class StageTest(unittest.TestCase):
+
+    def test_limit(self):
+        stage = Stage("test", 2)
+        running = []
+        peak = []
+
+        def work():
+            with stage.use():
+                running.append(1)
+                peak.append(len(running))
+                gevent.sleep(0.05)
+                running.pop()
+
+        gevent.joinall([gevent.spawn(work) for _ in range(6)])
+        self.assertEqual(2, max(peak))
+        stats = stage.stats()
+        self.assertEqual(6, stats["count"])
+        self.assertGreater(stats["wait_time"], 0)
+
+    def test_run_time_concurrent(self):
+        stage = Stage("test", 2)
+
+        def work(delay):
+            gevent.sleep(delay)
+            with stage.use():
+                gevent.sleep(0.2)
+
+        # 两次使用有重叠，各自按自己的开始时间计时
+        gevent.joinall([gevent.spawn(work, 0), gevent.spawn(work, 0.1)])
+        stats = stage.stats()
+        self.assertAlmostEqual(0.4, stats["run_time"], delta=0.05)
+        self.assertAlmostEqual(0.2, stats["max_time"], delta=0.05)
+
+
+class ConnectPipelineTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = EmbeddedServer().start()
+        cls.pkey = make_user_key()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+
+    def test_dns_cache(self):
+        pipeline = ConnectPipeline()
+        first = pipeline.resolve("localhost", 22)
+        self.assertIs(first, pipeline.resolve("localhost", 22))
+        self.assertEqual(1, pipeline.stats()["dns"]["count"])
+
+    def test_stage_stats(self):
+        hosts = ["127.0.0.1", "localhost"]
+        client = ParallelSSHClient(hosts, "foo", "foo", self.server.port, pkey=self.pkey,
+                                   host_key_policy=NO_CHECK)
+        try:
+            for stdout, _ in client.run_command("echo foo").values():
+                self.assertEqual(["foo\n"], list(stdout))
+            stats = client.pipeline.stats()
+            for stage in ("dns", "connect", "handshake", "auth"):
+                self.assertEqual(2, stats[stage]["count"], stage)
+                self.assertEqual(0, stats[stage]["errors"], stage)
+        finally:
+            client.disconnect()
+
+
+if "__main__" == __name__:
+    unittest.main(verbosity=2)
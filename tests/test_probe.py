@@ -0,0 +1,46 @@
+import socket
+import unittest
+
+from fpslib.probe import probe_hosts, probe_key, resolve_all
+
+
+class ProbeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.listener = socket.socket()
+        self.listener.bind(("127.0.0.1", 0))
+        self.listener.listen(16)
+        self.port = str(self.listener.getsockname()[1])
+        # 拿一个没人监听的端口
+        closed = socket.socket()
+        closed.bind(("127.0.0.1", 0))
+        self.closed_port = str(closed.getsockname()[1])
+        closed.close()
+
+    def tearDown(self):
+        self.listener.close()
+
+    def test_probe(self):
+        hosts = [("127.0.0.1", self.port, None, {}),
+                 ("localhost", self.port, None, {}),
+                 ("127.0.0.1", self.closed_port, None, {}),
+                 ("nonexistent.invalid", None, None, {})]
+        dead = probe_hosts(hosts, timeout=1)
+        self.assertEqual({probe_key("127.0.0.1", self.closed_port),
+                          probe_key("nonexistent.invalid", None)}, set(dead))
+        self.assertIn("refused", dead[probe_key("127.0.0.1", self.closed_port)])
+        self.assertIn("DNS", dead[probe_key("nonexistent.invalid", None)])
+
+    def test_limit(self):
+        hosts = [("127.0.0.1", self.port, None, {"n": i}) for i in range(20)]
+        hosts += [("127.0.0.1", self.closed_port, None, {})]
+        dead = probe_hosts(hosts, timeout=1, limit=1)
+        self.assertEqual([probe_key("127.0.0.1", self.closed_port)], list(dead))
+
+    def test_dns_cache(self):
+        first = resolve_all(["localhost"])["localhost"]
+        self.assertIs(first, resolve_all(["localhost"])["localhost"])
+
+
+if "__main__" == __name__:
+    unittest.main(verbosity=2)
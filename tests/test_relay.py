@@ -0,0 +1,121 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from embedded_server import EmbeddedServer, make_user_key
+from fpslib.inputbuffer import InputBuffer
+from fpssh.clients.native.copy import DEFAULT_COPY_DEPTH
+from fpssh.clients.native.parallel import ParallelSSHClient
+from fpssh.clients.native.relay import relay_tree, chunk_checksums, parse_verify
+from fpssh.output import CopyStats
+from fpssh.known_hosts import NO_CHECK
+
+# 转发用系统的 ssh 连测试服务器
+SSH_OPTIONS = ("-o", "StrictHostKeyChecking=no", "-o", "UserKnownHostsFile=/dev/null",
+               "-o", "LogLevel=ERROR")
+
+
+class RelayTreeTest(unittest.TestCase):
+
+    def test_tree(self):
+        hosts = ["h%d" % i for i in range(7)]
+        tree = relay_tree(hosts, 2)
+        self.assertEqual(["h0", "h1"], tree[None])
+        self.assertEqual(["h2", "h3"], tree["h0"])
+        self.assertEqual(["h4", "h5"], tree["h1"])
+        self.assertEqual(["h6"], tree["h2"])
+        self.assertEqual([], tree["h6"])
+        # 每台主机恰好有一个来源
+        children = [host for parent in tree for host in tree[parent]]
+        self.assertEqual(sorted(hosts), sorted(children))
+
+    def test_parse_verify(self):
+        data = b"a" * 10 + b"b" * 10 + b"c" * 5
+        checksums = chunk_checksums(memoryview(data), 10)
+        self.assertEqual(3, len(checksums))
+        stdout = "25\n" + "\n".join(checksums) + "\n"
+        self.assertEqual([], parse_verify(stdout, 25, checksums, 10))
+        broken = "25\n%s\nbad\n%s\n" % (checksums[0], checksums[2])
+        self.assertEqual([(10, 10)], parse_verify(broken, 25, checksums, 10))
+        self.assertEqual([(10, 10), (20, 10)],
+                         parse_verify("25\n" + checksums[0], 25, checksums, 10))
+        self.assertIsNone(parse_verify("24\n", 25, checksums, 10))
+        self.assertIsNone(parse_verify("", 25, checksums, 10))
+
+
+class RelayTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.homes = tempfile.mkdtemp()
+        # 每个 127.0.0.x 地址一个目录，当作不同的主机
+        cls.server = EmbeddedServer(host="0.0.0.0", homes=cls.homes).start()
+        cls.pkey = make_user_key()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+        shutil.rmtree(cls.homes)
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.data = os.urandom(300000)
+        self.source = os.path.join(self.tmp, "artifact")
+        with open(self.source, "wb") as f:
+            f.write(self.data)
+        self.hosts = ["127.0.0.%d" % i for i in range(2, 9)]
+        self.client = ParallelSSHClient(self.hosts, "foo", "foo", self.server.port,
+                                        pkey=self.pkey, host_key_policy=NO_CHECK)
+
+    def tearDown(self):
+        self.client.disconnect()
+        shutil.rmtree(self.tmp)
+
+    def remote(self, host, name="artifact"):
+        return os.path.join(self.homes, host, name)
+
+    def relay(self, **kwargs):
+        return self.client.relay_file(self.source, "artifact", fanout=2, chunk_size=65536,
+                                      ssh_options=SSH_OPTIONS + ("-i", self.pkey), **kwargs)
+
+    def test_relay(self):
+        stats = self.relay()
+        tree = relay_tree(self.hosts, 2)
+        for parent, children in tree.items():
+            for host in children:
+                self.assertIsNone(stats[host].exception, host)
+                self.assertEqual(parent, stats[host].via, host)
+                with open(self.remote(host), "rb") as f:
+                    self.assertEqual(self.data, f.read(), host)
+
+    def test_failed_relay_falls_back_to_direct(self):
+        # 转发用的 ssh 认证失败，所有下一层都改成控制端直接发
+        stats = self.client.relay_file(self.source, "artifact", fanout=2,
+                                       ssh_options=("-o", "IdentitiesOnly=yes",
+                                                    "-i", "/nonexistent"))
+        for host in self.hosts:
+            self.assertIsNone(stats[host].exception, host)
+            self.assertIsNone(stats[host].via, host)
+            with open(self.remote(host), "rb") as f:
+                self.assertEqual(self.data, f.read(), host)
+
+    def test_repair_bad_chunks(self):
+        self.relay()
+        host = self.hosts[0]
+        # 改坏第二块，校验时只补发这一块
+        with open(self.remote(host), "r+b") as f:
+            f.seek(70000)
+            f.write(b"corrupt")
+        source = InputBuffer.open(self.source)
+        stats = CopyStats(host, len(source))
+        self.client._verify(host, source, "artifact", chunk_checksums(source.view, 65536),
+                            65536, stats, DEFAULT_COPY_DEPTH)
+        self.assertEqual(1, stats.repaired)
+        self.assertEqual(65536, stats.sent)
+        with open(self.remote(host), "rb") as f:
+            self.assertEqual(self.data, f.read())
+
+
+if "__main__" == __name__:
+    unittest.main(verbosity=2)
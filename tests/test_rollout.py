@@ -0,0 +1,55 @@
+import unittest
+from fpslib.rollout import Rollout, parse_count
+
+
+class finished:
+    """只有 Rollout 用到的 Task 属性"""
+
+    def __init__(self, exit_code):
+        self.exit_code = exit_code
+        self.failures = []
+
+
+class RolloutTest(unittest.TestCase):
+
+    def test_parse_count(self):
+        self.assertEqual((10, False), parse_count("10"))
+        self.assertEqual((12.5, True), parse_count("12.5%"))
+        for bad in ("-1", "x", "101%", "5.5"):
+            with self.assertRaises(ValueError):
+                parse_count(bad)
+
+    def test_percent(self):
+        rollout = Rollout(batch_size=(10, True), canary=(1, True), max_fail=(5, True))
+        self.assertTrue(rollout.needs_total)
+        rollout.resolve(95)
+        self.assertEqual((10, 1, 4.75), (rollout.batch, rollout.canary, rollout.threshold))
+        self.assertFalse(Rollout(batch_size=(10, False)).needs_total)
+
+    def test_batches(self):
+        rollout = Rollout(batch_size=(2, False), canary=(1, False))
+        rollout.resolve()
+        sizes = []
+        for _ in range(3):
+            size = 0
+            while rollout.allow(running=size):
+                rollout.start(finished(0))
+                size += 1
+            sizes.append(size)
+            self.assertFalse(rollout.allow(running=1))
+        self.assertEqual([1, 2, 2], sizes)
+
+    def test_threshold(self):
+        rollout = Rollout(max_fail=(2, False))
+        rollout.resolve()
+        self.assertFalse(rollout.record(finished(0)))
+        self.assertFalse(rollout.record(finished(1)))
+        self.assertFalse(rollout.record(finished(None)))
+        self.assertTrue(rollout.record(finished(255)))
+        self.assertFalse(rollout.allow(running=0))
+        # 只在触发的那一次返回 True
+        self.assertFalse(rollout.record(finished(1)))
+
+
+if "__main__" == __name__:
+    unittest.main(verbosity=2)
@@ -1,24 +1,96 @@
+import time
 import unittest
-from fpssh.clients.native.single import SSHClient
+
+from embedded_server import EmbeddedServer, make_user_key
+from fpssh.clients.native.single import SSHClient, STDOUT, STDERR
+from fpssh.known_hosts import NO_CHECK
 
 
 class SSHClientTest(unittest.TestCase):
 
+    @classmethod
+    def setUpClass(cls):
+        cls.server = EmbeddedServer().start()
+        cls.pkey = make_user_key()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+
     def setUp(self):
         self.fake_cmd = "echo foo"
         self.fake_res = "foo\n"
         self.host = "127.0.0.1"
-        self.port = 2222
+        self.port = self.server.port
         self.user = "foo"
         self.password = "foo"
-        self.client = SSHClient(self.host, self.user, self.password, self.port)
+        self.client = SSHClient(self.host, self.user, self.password, self.port,
+                                pkey=self.pkey, host_key_policy=NO_CHECK)
+
+    def tearDown(self):
+        self.client.disconnect()
 
     def test_execute(self):
-        stdout, stderr = self.client.run_command(self.fake_cmd)
+        stdout, stderr, host = self.client.run_command(self.fake_cmd)
 
         out = list(stdout)
 
         self.assertEqual([self.fake_res], out)
+        self.assertEqual(self.host, host)
+
+    def test_stderr(self):
+        stdout, stderr, _ = self.client.run_command("echo bar >&2")
+        self.assertEqual([], list(stdout))
+        self.assertEqual(["bar\n"], list(stderr))
+
+    def test_multibyte_split_across_chunks(self):
+        # 先输出 "你" 的前两个字节，过一会儿再输出剩下的
+        cmd = r"printf '\344\275'; sleep 0.1; printf '\240\345\245\275\n'"
+        stdout, _, _ = self.client.run_command(cmd)
+        self.assertEqual(["你好\n"], list(stdout))
+
+    def test_large_stderr_small_stdout(self):
+        # stderr 远大于 channel 窗口，只读 stdout 也不能卡住
+        stdout, stderr, _ = self.client.run_command(
+            "head -c 4000000 /dev/zero >&2; echo done")
+        self.assertEqual(["done\n"], list(stdout))
+        self.assertEqual(4000000, sum(len(line) for line in stderr))
+
+    def test_raw_chunks(self):
+        stdout, _, _ = self.client.run_command("printf 'a\\nb'", raw=True)
+        self.assertEqual(b"a\nb", b"".join(stdout))
+
+    def test_interleaved_and_exit_code(self):
+        output = self.client.execute("echo out; echo err >&2; exit 3")
+        got = {STDOUT: b"", STDERR: b""}
+        for stream, data in output.interleaved():
+            got[stream] += data
+        self.assertEqual({STDOUT: b"out\n", STDERR: b"err\n"}, got)
+        self.assertEqual(3, output.close())
+
+    def test_run_commands(self):
+        start = time.time()
+        commands = ["sleep 0.5; echo %d; exit %d" % (i, i) for i in range(6)]
+        results = list(self.client.run_commands(commands, max_channels=3))
+        # 两轮，每轮 3 个 channel 同时跑
+        self.assertLess(time.time() - start, 1.5)
+        self.assertEqual(sorted(commands), sorted(r.command for r in results))
+        for result in results:
+            i = commands.index(result.command)
+            self.assertEqual(i, result.exit_code)
+            self.assertEqual("%d\n" % i, result.stdout)
+            self.assertEqual("", result.stderr)
+            self.assertEqual(self.host, result.host)
+
+    def test_run_commands_finish_order(self):
+        results = self.client.run_commands(["sleep 0.3; echo slow", "echo fast"])
+        self.assertEqual(["fast\n", "slow\n"], [r.stdout for r in results])
+
+    def test_non_blocking(self):
+        self.assertFalse(self.client.session.get_blocking())
+
+    def test_keepalive(self):
+        self.assertGreater(self.client.keepalive(), 0)
 
 
 if "__main__" == __name__:
@@ -0,0 +1,54 @@
+import os
+import time
+import unittest
+
+from fpslib import spawn
+
+
+class SpawnTest(unittest.TestCase):
+
+    def wait(self, proc):
+        while proc.poll() is None:
+            time.sleep(0.01)
+        return proc.returncode
+
+    @unittest.skipUnless(spawn.use_posix_spawn, "posix_spawn not available")
+    def test_posix_spawn(self):
+        env = spawn.base_environ().copy()
+        env["PSSH_HOST"] = "foo"
+        proc = spawn.posix_spawn(["sh", "-c", "echo $PSSH_HOST; cat >&2; exit 3"], env)
+        self.assertEqual(proc.pid, os.getsid(proc.pid))
+        proc.stdin.write(b"err")
+        proc.stdin.close()
+        self.assertEqual(b"foo\n", proc.stdout.read())
+        self.assertEqual(b"err", proc.stderr.read())
+        self.assertEqual(3, self.wait(proc))
+        for f in (proc.stdout, proc.stderr):
+            f.close()
+
+    @unittest.skipUnless(os.path.exists("/proc/self/status"), "needs /proc")
+    def test_signal_dispositions(self):
+        # 和 Popen(restore_signals=True) 一样，子进程不继承 Python 忽略的 SIGPIPE/SIGXFSZ
+        for start in (spawn.spawn, lambda cmd, env: spawn.Popen(
+                cmd, stdin=spawn.PIPE, stdout=spawn.PIPE, stderr=spawn.PIPE)):
+            proc = start(["sh", "-c", "grep SigIgn /proc/$$/status"], spawn.base_environ())
+            proc.stdin.close()
+            ignored = int(proc.stdout.read().split()[1], 16)
+            self.wait(proc)
+            proc.stdout.close()
+            proc.stderr.close()
+            for sig in spawn.RESTORE_SIGNALS:
+                self.assertFalse(ignored & (1 << (sig - 1)), sig)
+
+    def test_missing_command(self):
+        with self.assertRaises(FileNotFoundError):
+            spawn.spawn(["/nonexistent/ssh"], spawn.base_environ())
+
+    def test_base_environ(self):
+        env = spawn.base_environ()
+        self.assertIs(env, spawn.base_environ())
+        self.assertIn("DISPLAY", env)
+
+
+if "__main__" == __name__:
+    unittest.main(verbosity=2)
@@ -0,0 +1,120 @@
+import contextlib
+import io
+import os
+import tempfile
+import unittest
+
+from fpslib import util
+
+
+class HostFileTest(unittest.TestCase):
+
+    def write_hosts(self, content):
+        fd, path = tempfile.mkstemp()
+        with os.fdopen(fd, "w") as f:
+            f.write(content)
+        self.addCleanup(os.remove, path)
+        return path
+
+    def test_read_host_file(self):
+        path = self.write_hosts(
+            "# comment\n"
+            "foo\n"
+            "bar@web1:2222  # trailing\n"
+            "web2 baz timeout=30 idle_timeout=5\n"
+            "\n")
+        hosts = util.read_host_file(path, None, default_user="root")
+        self.assertEqual([
+            ("foo", None, "root", {}),
+            ("web1", "2222", "bar", {}),
+            ("web2", None, "baz", {"timeout": "30", "idle_timeout": "5"}),
+        ], hosts)
+
+    def test_bad_numeric_opts(self):
+        path = self.write_hosts("web1 timeout=abc\n"
+                                "web2 idle_timeout=-1\n"
+                                "web3 connect_timeout=1.5\n"
+                                "web4 timeout=nan\n"
+                                "web5 idle_timeout=inf\n"
+                                "web6 timeout=0.5 connect_timeout=3 role=db\n")
+        with contextlib.redirect_stderr(io.StringIO()) as err:
+            hosts = util.read_host_file(path, None)
+        self.assertEqual([("web6", None, None,
+                           {"timeout": "0.5", "connect_timeout": "3", "role": "db"})], hosts)
+        self.assertIn("Bad line web1 timeout=abc. timeout should be a non-negative finite number",
+                      err.getvalue())
+        for bad in ("web2", "web4 timeout=nan", "web5 idle_timeout=inf"):
+            self.assertIn(f"Bad line {bad}", err.getvalue())
+        self.assertIn("connect_timeout should be a non-negative integer", err.getvalue())
+
+    def test_host_glob(self):
+        path = self.write_hosts("web1\ndb1\nweb2\n")
+        hosts = util.read_host_file(path, "web*")
+        self.assertEqual(["web1", "web2"], [h[0] for h in hosts])
+
+    def test_host_glob_patterns(self):
+        path = self.write_hosts("web1\nweb1-old\ndb1\ncache1\nweb2\n")
+        hosts = util.read_host_file(path, "web*,db? !*-old")
+        self.assertEqual(["web1", "db1", "web2"], [h[0] for h in hosts])
+        hosts = util.read_host_file(path, "!web*")
+        self.assertEqual(["db1", "cache1"], [h[0] for h in hosts])
+
+    def test_unique_hosts(self):
+        first = self.write_hosts("web1\nroot@web1:22\nweb1 timeout=5\nbob@web1\n")
+        second = self.write_hosts("web1:2222\nweb1\n")
+        hosts = util.read_host_files([first, second], None, default_user="root")
+        self.assertEqual([("web1", None, "root", {}), ("web1", None, "bob", {}),
+                          ("web1", "2222", "root", {})], hosts)
+
+    def test_iter_host_files(self):
+        path = self.write_hosts("".join(f"web{i}\n" for i in range(1000)))
+        hosts = util.iter_host_files([path], None)
+        # 生成器，取多少解析多少
+        self.assertEqual(("web0", None, None, {}), next(hosts))
+        self.assertEqual(("web1", None, None, {}), next(hosts))
+        self.assertEqual(998, sum(1 for _ in hosts))
+        with self.assertRaises(IOError):
+            util.iter_host_files([path, path + ".missing"], None)
+
+    def test_expand_host(self):
+        self.assertEqual(["web"], list(util.expand_host("web")))
+        self.assertEqual(["web08.dc1", "web08.dc3", "web09.dc1", "web09.dc3",
+                          "web10.dc1", "web10.dc3"],
+                         list(util.expand_host("web[08-10].dc[1,3]")))
+        self.assertEqual(["h1", "h3", "h7", "h8", "ha", "hb"],
+                         list(util.expand_host("h[1,3,7-8,a-b]")))
+        self.assertEqual(["[::1]"], list(util.expand_host("[::1]")))
+        for bad in ("web[3-1]", "web[1,]", "web[a-10]"):
+            with self.assertRaises(ValueError):
+                util.expand_host(bad)
+
+    def test_expand_host_lazy(self):
+        hosts = util.expand_host("10.[0-255].[0-255].[1-254]")
+        self.assertEqual(["10.0.0.1", "10.0.0.2"], [next(hosts), next(hosts)])
+
+    def test_host_file_ranges(self):
+        path = self.write_hosts("bob@web[001-300]:2222 timeout=5\ndb[1-2]\nbad[2-1]\n")
+        with contextlib.redirect_stderr(io.StringIO()) as err:
+            hosts = util.read_host_file(path, "web*5,db*")
+        self.assertEqual([("web005", "2222", "bob", {"timeout": "5"}),
+                          ("web015", "2222", "bob", {"timeout": "5"})],
+                         hosts[:2])
+        self.assertEqual(32, len(hosts))
+        self.assertEqual(["db1", "db2"], [h[0] for h in hosts[-2:]])
+        self.assertIn("Bad line bad[2-1]", err.getvalue())
+        self.assertEqual([("a1", None, "u", {}), ("a2", None, "u", {})],
+                         util.parse_host_string("u@a[1-2]"))
+
+    def test_parse_host_string(self):
+        self.assertEqual([("a", "22", "u", {}), ("b", None, None, {})],
+                         util.parse_host_string("u@a:22 b"))
+
+    def test_parse_size(self):
+        self.assertEqual(512, util.parse_size("512"))
+        self.assertEqual(64 << 10, util.parse_size("64K"))
+        self.assertEqual(16 << 20, util.parse_size("16m"))
+        self.assertEqual(1 << 30, util.parse_size("1GB"))
+
+
+if "__main__" == __name__:
+    unittest.main(verbosity=2)